@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, Iterator, Optional
+from accord.metrics import METRICS
+
+
+@dataclass(eq=False)
+class _Waiter:
+    session: str
+    # hands the slot over to the waiting thread or coroutine
+    grant: Callable[[], None]
+    granted: bool = False
+
+
+class AdmissionQueue:
+    """
+    Bounded, fair admission of the requests sent to the LLM server: at most
+    max_concurrent of them run at once, the others wait in one FIFO queue per
+    session and the sessions are served in turn, so a session sending many
+    requests (an ingestion contextualizing its chunks) does not starve the
+    others. Threads and coroutines wait in the same queues.
+    The queue depth and the running requests are published as gauges, the
+    time spent waiting as the <name>_queue stage.
+    """
+
+    def __init__(self, max_concurrent: int, name: str = "llm"):
+        self.max_concurrent = max(1, max_concurrent)
+        self.name = name
+        self.lock = threading.Lock()
+        self.active = 0
+        self.depth = 0
+        # session -> its waiting requests, in the order the sessions are served
+        self.waiting: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._publish()
+
+    def _publish(self):
+        METRICS.set_gauge(f"{self.name}_queue_depth", self.depth)
+        METRICS.set_gauge(f"{self.name}_active", self.active)
+
+    def _submit(self, session: str, grant: Callable[[], None]) -> Optional[_Waiter]:
+        """
+        Returns:
+            Optional[_Waiter]: The queued request, None when a slot was free
+        """
+        with self.lock:
+            if self.active < self.max_concurrent and not self.depth:
+                self.active += 1
+                self._publish()
+                return None
+            waiter = _Waiter(session, grant)
+            self.waiting.setdefault(session, deque()).append(waiter)
+            self.depth += 1
+            self._publish()
+            return waiter
+
+    def _dispatch(self):
+        # called with the lock held
+        while self.active < self.max_concurrent and self.waiting:
+            session, waiters = self.waiting.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                # the session waits for its next turn behind the others
+                self.waiting[session] = waiters
+            self.depth -= 1
+            try:
+                waiter.grant()
+            except RuntimeError:
+                # the event loop of the coroutine is closed, nobody takes the slot
+                continue
+            waiter.granted = True
+            self.active += 1
+        self._publish()
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """
+        Remove a request given up while it was waiting
+        Returns:
+            bool: True if it was granted a slot in the meantime, which must be released
+        """
+        with self.lock:
+            if waiter.granted:
+                return True
+            waiters = self.waiting[waiter.session]
+            waiters.remove(waiter)
+            if not waiters:
+                del self.waiting[waiter.session]
+            self.depth -= 1
+            self._publish()
+            return False
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, session: str) -> Iterator[None]:
+        """
+        Wait for a slot and hold it while the block runs
+        Args:
+            session (str): The session sending the request
+        """
+        start = time.perf_counter()
+        granted = threading.Event()
+        waiter = self._submit(session, granted.set)
+        if waiter is not None:
+            try:
+                granted.wait()
+            except BaseException:
+                if self._cancel(waiter):
+                    self.release()
+                raise
+        METRICS.observe(f"{self.name}_queue", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, session: str) -> AsyncIterator[None]:
+        """
+        Wait for a slot without blocking the event loop and hold it while the block runs
+        Args:
+            session (str): The session sending the request
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._submit(session, grant)
+        if waiter is not None:
+            try:
+                await granted
+            except BaseException:
+                if self._cancel(waiter):
+                    self.release()
+                raise
+        METRICS.observe(f"{self.name}_queue", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.release()
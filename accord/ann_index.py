@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+
+# rows scored at once when assigning vectors to their inverted list
+ASSIGN_BATCH_SIZE = 65536
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest-neighbour search on
+    unit-normalised vectors. The vectors are clustered with spherical k-means;
+    a query only scores the vectors of the nprobe lists whose centroids are
+    closest to it. The index stores list assignments only, the vectors stay in
+    the memory-mapped matrix of the vector store.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: Optional[np.ndarray] = None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = (
+            np.empty(0, dtype=np.int32) if assignments is None else np.asarray(assignments, dtype=np.int32)
+        )
+        self._order = None
+        self._offsets = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.assignments)
+
+    @classmethod
+    def train(
+        cls, vectors: np.ndarray,
+        nlist: int,
+        iterations: int = 10,
+        sample_size: int = 65536,
+        seed: int = 42,
+    ) -> "IVFIndex":
+        """
+        Cluster the vectors and build the index
+        Args:
+            vectors (np.ndarray): The (n, dimension) unit-normalised vectors
+            nlist (int): The number of inverted lists
+            iterations (int): The number of k-means iterations
+            sample_size (int): The number of vectors k-means is trained on
+            seed (int): The random seed
+        Returns:
+            IVFIndex: The index, with all vectors added
+        """
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(vectors)))
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            # keep the previous centroid of an empty list
+            sums[counts == 0] = centroids[counts == 0]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms == 0, 1, norms)
+        index = cls(centroids)
+        index.assignments = index.assign(vectors)
+        return index
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The inverted list of every vector
+        """
+        return np.concatenate([
+            np.argmax(np.asarray(vectors[start:start + ASSIGN_BATCH_SIZE]) @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), ASSIGN_BATCH_SIZE)
+        ] or [np.empty(0, dtype=np.int64)]).astype(np.int32)
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._order is None:
+            self._order = np.argsort(self.assignments, kind="stable")
+            self._offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(self.assignments, minlength=self.nlist))]
+            )
+        return self._order, self._offsets
+
+    def search(
+        self, vectors: np.ndarray,
+        query_vector: np.ndarray,
+        k: int,
+        nprobe: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the approximately k most similar rows
+        Args:
+            vectors (np.ndarray): The matrix the index was built for
+            query_vector (np.ndarray): The unit-normalised query
+            k (int): The number of rows to return
+            nprobe (int): The number of inverted lists to scan
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The row indices and scores, best first
+        """
+        order, offsets = self._inverted_lists()
+        centroid_scores = self.centroids @ query_vector
+        # at least the list of the closest centroid is scanned
+        nprobe = max(1, nprobe)
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        candidates = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe]))
+        scores = np.asarray(vectors[candidates]) @ query_vector
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def save(self, path: Path):
+        np.savez(path, centroids=self.centroids, assignments=self.assignments)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["assignments"])
@@ -0,0 +1,119 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from langchain.schema import Document
+from accord.entity import Message
+
+
+@dataclass
+class CachedAnswer:
+    scope: tuple
+    history: str
+    vector: np.ndarray
+    sources: List[Document]
+    answer: str
+    created: float
+
+
+def history_fingerprint(chat_history: List[Message]) -> str:
+    """
+    Returns:
+        str: A hash of the roles and contents of the messages
+    """
+    digest = hashlib.sha256()
+    for message in chat_history:
+        for part in (message.role.value, message.content):
+            data = part.encode("utf-8")
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Answers of earlier questions, found again for a question whose embedding is
+    at least threshold similar, asked with the same retriever scope and chat history.
+    Entries expire after ttl seconds and the least recently used ones are evicted
+    beyond max_entries.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        # (scope, history) -> ids of its entries
+        self.buckets: Dict[tuple, List[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        bucket = self.buckets[(entry.scope, entry.history)]
+        bucket.remove(entry_id)
+        if not bucket:
+            del self.buckets[(entry.scope, entry.history)]
+
+    def get(self, scope: tuple, history: str, vector: List[float]) -> Optional[CachedAnswer]:
+        """
+        Args:
+            scope (tuple): The retriever scope and store version
+            history (str): The fingerprint of the chat history
+            vector (List[float]): The embedding of the question
+        Returns:
+            Optional[CachedAnswer]: The most similar cached answer above the threshold, if any
+        """
+        vector = self.normalize(vector)
+        now = time.time()
+        with self.lock:
+            entry_ids = list(self.buckets.get((scope, history), []))
+            for entry_id in entry_ids:
+                if now - self.entries[entry_id].created > self.ttl:
+                    self._remove(entry_id)
+            entry_ids = self.buckets.get((scope, history), [])
+            if entry_ids:
+                similarities = np.stack([self.entries[i].vector for i in entry_ids]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    self.entries.move_to_end(entry_ids[best])
+                    return self.entries[entry_ids[best]]
+            self.misses += 1
+            return None
+
+    def put(self, scope: tuple, history: str, vector: List[float], sources: List[Document], answer: str):
+        with self.lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self.entries[entry_id] = CachedAnswer(scope, history, self.normalize(vector), sources, answer, time.time())
+            self.buckets.setdefault((scope, history), []).append(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, predicate: Callable[[tuple], bool]) -> int:
+        """
+        Drop the answers of the scopes matching the predicate
+        Returns:
+            int: The number of dropped answers
+        """
+        with self.lock:
+            dropped = [entry_id for entry_id, entry in self.entries.items() if predicate(entry.scope)]
+            for entry_id in dropped:
+                self._remove(entry_id)
+            return len(dropped)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
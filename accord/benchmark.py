@@ -0,0 +1,336 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from box import ConfigBox
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from accord import logger
+from accord.chatbot import Chatbot
+from accord.contextualizer import STRATEGIES
+from accord.data_ingestor import DataIngestor
+from accord.database import Database
+from accord.entity import File, FinalAnswerEvent, SourcesEvent, TimingEvent
+from accord.metrics import METRICS
+from accord.reranker import CachedReranker
+from accord.utils import get_config
+
+
+SYLLABLES = ["ka", "ro", "mi", "tel", "an", "dor", "vu", "si", "pra", "len", "os", "ur", "bex", "ti", "ga", "mon"]
+FAKE_ANSWER = "<think>The excerpts answer the question.</think>The answer, according to the excerpts, is in the files."
+FAKE_CONTEXT = "This chunk belongs to a synthetic benchmark document."
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: every token gets a random unit vector
+    seeded by its hash and a text is the normalised sum of its tokens, so texts
+    sharing words are similar without loading a model.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.lock = threading.Lock()
+        self._tokens: Dict[str, np.ndarray] = {}
+
+    def _token(self, token: str) -> np.ndarray:
+        vector = self._tokens.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            with self.lock:
+                self._tokens[token] = vector
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in text.lower().split():
+            vector += self._token(token.strip(".,?!"))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class StubReranker(CachedReranker):
+    """CachedReranker scoring the pairs by the share of query words found in the chunk"""
+
+    def _score(self, query: str, documents: List[Document]) -> np.ndarray:
+        words = set(query.lower().split())
+        return np.asarray([
+            len(words & set(document.page_content.lower().split())) / max(1, len(words))
+            for document in documents
+        ])
+
+
+def synthetic_corpus(
+    n_documents: int,
+    words_per_document: int,
+    vocabulary_size: int,
+    seed: int,
+) -> List[File]:
+    """
+    Generate text files of Zipf distributed words
+    Args:
+        n_documents (int): The number of files
+        words_per_document (int): The number of words of every file
+        vocabulary_size (int): The number of distinct words
+        seed (int): The seed of the generator, the same seed gives the same corpus
+    Returns:
+        List[File]: The files
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = sorted({
+        "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        for _ in range(vocabulary_size)
+    })
+    probabilities = 1.0 / np.arange(1, len(vocabulary) + 1) ** 1.1
+    probabilities /= probabilities.sum()
+    files = []
+    for i in range(n_documents):
+        words = rng.choice(vocabulary, size=words_per_document, p=probabilities)
+        sentences = [" ".join(words[start:start + 12]) + "." for start in range(0, len(words), 12)]
+        paragraphs = ["\n".join(sentences[start:start + 8]) for start in range(0, len(sentences), 8)]
+        content = "\n\n".join(paragraphs)
+        files.append(File(
+            name=f"document_{i:05d}.txt",
+            content=content,
+            content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        ))
+    return files
+
+
+def synthetic_queries(files: List[File], n_queries: int, seed: int) -> List[tuple[str, str]]:
+    """
+    Returns:
+        List[tuple[str, str]]: Questions made of a window of words of a file, and the name of that file
+    """
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for _ in range(n_queries):
+        file = files[rng.integers(len(files))]
+        words = file.content.split()
+        start = int(rng.integers(max(1, len(words) - 8)))
+        queries.append((f"What about {' '.join(words[start:start + 8]).rstrip('.')}?", file.name))
+    return queries
+
+
+def benchmark_config(root: Path, contextualize: bool, context_strategy: Optional[str] = None) -> ConfigBox:
+    """
+    The configuration with every store under root and the caches off, so a run
+    starts cold and measures the same work every time
+    """
+    config = get_config()
+    config.vector_store.VECTOR_STORE_DIR = str(root / "vector_store")
+    config.vector_store.DOCUMENT_STORE_DIR = str(root / "document")
+    config.vector_store.CONCATENATE_VECTOR_FILE_PATH = str(root / "vector_store" / "concatenate")
+    config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH = str(root / "vector_store" / "concatenate")
+    config.preprocessing.CONTEXTUALIZE_CHUNKS = contextualize
+    if context_strategy:
+        config.preprocessing.CONTEXT_STRATEGY = context_strategy
+    config.cache.USE_CONTEXT_CACHE = False
+    config.cache.USE_EMBEDDING_CACHE = False
+    config.cache.USE_ANSWER_CACHE = False
+    config.cache.RERANK_CACHE_MAX_MB = 0
+    return config
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def disk_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    return {
+        "mean": round(float(np.mean(values)), 5),
+        "p50": round(float(np.percentile(values, 50)), 5),
+        "p95": round(float(np.percentile(values, 95)), 5),
+        "p99": round(float(np.percentile(values, 99)), 5),
+    }
+
+
+def run_benchmark(
+    n_documents: int = 100,
+    words_per_document: int = 2000,
+    vocabulary_size: int = 5000,
+    n_queries: int = 100,
+    seed: int = 42,
+    contextualize: bool = False,
+    context_strategy: Optional[str] = None,
+    real_models: bool = False,
+    token_delay: float = 0.0,
+    workdir: Optional[Path] = None,
+) -> dict:
+    """
+    Ingest a synthetic corpus and ask questions about it
+    Args:
+        n_documents (int): The number of synthetic files
+        words_per_document (int): The number of words of every file
+        vocabulary_size (int): The number of distinct words of the corpus
+        n_queries (int): The number of questions
+        seed (int): The seed of the corpus and the questions
+        contextualize (bool): If True the chunks are contextualized by the fake LLM
+        context_strategy (Optional[str]): The contextualization strategy, the configured one if None
+        real_models (bool): If True the configured FastEmbed and FlashRank models are used
+            instead of the stand-ins (the LLM is always fake)
+        token_delay (float): Seconds the fake LLM waits before every streamed character
+        workdir (Path): The directory of the stores, a temporary one if None
+    Returns:
+        dict: The ingestion throughput, query latencies, peak RSS and index size
+    """
+    with tempfile.TemporaryDirectory(prefix="accord-benchmark-") as tmp:
+        root = Path(workdir or tmp)
+        config = benchmark_config(root, contextualize, context_strategy)
+        os.makedirs(config.vector_store.VECTOR_STORE_DIR, exist_ok=True)
+        os.makedirs(config.vector_store.DOCUMENT_STORE_DIR, exist_ok=True)
+
+        database = Database(root / "accord.db", config=config)
+        database.create_table()
+        if real_models:
+            # the models of the registry, built from the configuration without caches
+            embedding_model, reranker = None, None
+        else:
+            embedding_model = StubEmbeddings()
+            reranker = StubReranker(ranker=None, model="stub", top_n=config.preprocessing.N_CONTEXT_RESULTS)
+        data_ingestor = DataIngestor(
+            database,
+            llm=FakeListChatModel(responses=[FAKE_CONTEXT]),
+            embedding_model=embedding_model,
+            reranker=reranker,
+            config=config,
+        )
+        chatbot = Chatbot(
+            database,
+            llm=FakeListChatModel(responses=[FAKE_ANSWER], sleep=token_delay or None),
+            data_ingestor=data_ingestor,
+            config=config,
+        )
+
+        files = synthetic_corpus(n_documents, words_per_document, vocabulary_size, seed)
+        queries = synthetic_queries(files, n_queries, seed)
+
+        start = time.perf_counter()
+        stages = data_ingestor.create_vector_store(files)
+        ingest_seconds = time.perf_counter() - start
+        corpus = data_ingestor.load_vector_store(config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+        n_chunks = len(corpus)
+        ingest_rss = peak_rss_bytes()
+
+        chatbot.set_retriever(
+            config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH,
+            config.vector_store.CONCATENATE_VECTOR_FILE_PATH,
+        )
+        latencies, first_tokens, hits = [], [], 0
+        for question, source in queries:
+            start = time.perf_counter()
+            for event in chatbot.ask(question, []):
+                if isinstance(event, SourcesEvent):
+                    hits += any(document.metadata.get("source") == source for document in event.content)
+                if isinstance(event, TimingEvent) and "time_to_first_token" in event.content:
+                    first_tokens.append(event.content["time_to_first_token"])
+                if isinstance(event, FinalAnswerEvent):
+                    latencies.append(time.perf_counter() - start)
+
+        return {
+            "parameters": {
+                "documents": n_documents,
+                "words_per_document": words_per_document,
+                "vocabulary_size": vocabulary_size,
+                "queries": n_queries,
+                "seed": seed,
+                "contextualize": contextualize,
+                "context_strategy": config.preprocessing.CONTEXT_STRATEGY,
+                "real_models": real_models,
+                "token_delay": token_delay,
+                "vector_backend": config.vector_store.BACKEND,
+                "quantization": config.ann.QUANTIZATION,
+                "use_ann": config.ann.USE_ANN,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "ingestion": {
+                "seconds": round(ingest_seconds, 3),
+                "documents": n_documents,
+                "chunks": n_chunks,
+                "documents_per_second": round(n_documents / ingest_seconds, 3),
+                "chunks_per_second": round(n_chunks / ingest_seconds, 3),
+                "stages": stages,
+                "peak_rss_bytes": ingest_rss,
+            },
+            "query": {
+                "latency_seconds": percentiles(latencies),
+                "time_to_first_token_seconds": percentiles(first_tokens),
+                "source_hit_rate": round(hits / max(1, len(queries)), 4),
+            },
+            # histogram estimates of every ingestion and query stage
+            "stage_latencies": METRICS.summary(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "index_bytes": disk_size(config.vector_store.VECTOR_STORE_DIR)
+                + disk_size(config.vector_store.DOCUMENT_STORE_DIR)
+                + (root / "accord.db").stat().st_size,
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingestion and query paths on a synthetic corpus, "
+        "with a fake LLM and stand-in embedding and reranker models",
+    )
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--words-per-document", type=int, default=2000)
+    parser.add_argument("--vocabulary-size", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--contextualize", action="store_true", help="Contextualize the chunks with the fake LLM")
+    parser.add_argument("--context-strategy", choices=STRATEGIES, default=None)
+    parser.add_argument("--real-models", action="store_true", help="Use the configured embedding and reranker models")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="Delay of the fake LLM per streamed character")
+    parser.add_argument("--workdir", type=Path, default=None, help="Keep the stores in this directory")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        n_documents=args.documents,
+        words_per_document=args.words_per_document,
+        vocabulary_size=args.vocabulary_size,
+        n_queries=args.queries,
+        seed=args.seed,
+        contextualize=args.contextualize,
+        context_strategy=args.context_strategy,
+        real_models=args.real_models,
+        token_delay=args.token_delay_ms / 1000,
+        workdir=args.workdir,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+        logger.info(f"Benchmark report written to {args.output}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
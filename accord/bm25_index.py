@@ -0,0 +1,254 @@
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def fts_query(text: str) -> str:
+    """
+    Returns:
+        str: An FTS5 query matching any word of the text, its words quoted so
+            operators and punctuation in the text are not parsed
+    """
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(tokenize(text)))
+
+
+class BM25Index:
+    """
+    Okapi BM25 index (same scoring as rank_bm25.BM25Okapi) kept as compact
+    postings: for every term the rows of the documents containing it and the
+    term frequencies, sorted by term and addressed through an offsets array.
+    It is built once at ingest time, saved as .npz and extended with new
+    documents without re-tokenizing the existing ones; indexes of disjoint
+    sets of documents (e.g. the segments of the corpus) are merged by merge.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.terms: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.doc_len = np.empty(0, dtype=np.int32)
+        # postings of term t are postings_docs[offsets[t]:offsets[t + 1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings_docs = np.empty(0, dtype=np.int32)
+        self.postings_freqs = np.empty(0, dtype=np.int32)
+        self.idf = np.empty(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, texts: List[str], ids: List[str]):
+        """
+        Add documents to the index
+        Args:
+            texts (List[str]): The texts of the documents
+            ids (List[str]): The ids of the documents
+        """
+        term_ids, rows, freqs, lengths = [], [], [], []
+        for row, text in enumerate(texts, start=len(self.ids)):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                term_ids.append(self.terms.setdefault(term, len(self.terms)))
+                rows.append(row)
+                freqs.append(freq)
+        self._append(
+            np.asarray(term_ids, dtype=np.int64),
+            np.asarray(rows, dtype=np.int32),
+            np.asarray(freqs, dtype=np.int32),
+            ids,
+            np.asarray(lengths, dtype=np.int32),
+        )
+
+    def _append(self, term_ids: np.ndarray, rows: np.ndarray, freqs: np.ndarray, ids: List[str], lengths: np.ndarray):
+        # merge the new postings into the existing ones, ordered by term
+        old_term_ids = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        all_term_ids = np.concatenate([old_term_ids, term_ids])
+        order = np.argsort(all_term_ids, kind="stable")
+        self.postings_docs = np.concatenate([self.postings_docs, rows]).astype(np.int32)[order]
+        self.postings_freqs = np.concatenate([self.postings_freqs, freqs]).astype(np.int32)[order]
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(all_term_ids, minlength=len(self.terms)))]
+        ).astype(np.int64)
+        self.ids.extend(ids)
+        self.doc_len = np.concatenate([self.doc_len, lengths]).astype(np.int32)
+        self._compute_idf()
+
+    @classmethod
+    def merge(cls, indexes: List["BM25Index"]) -> "BM25Index":
+        """
+        Merge the postings of indexes of disjoint sets of documents, without re-tokenizing them
+        Args:
+            indexes (List[BM25Index]): The indexes, their documents keep this order
+        Returns:
+            BM25Index: The index of all the documents, scored over all of them
+        """
+        merged = cls(indexes[0].k1, indexes[0].b, indexes[0].epsilon) if indexes else cls()
+        term_ids, rows, freqs, ids, lengths = [], [], [], [], []
+        for index in indexes:
+            # the term ids of the index in the merged vocabulary
+            mapping = np.asarray(
+                [merged.terms.setdefault(term, len(merged.terms)) for term in index.terms],
+                dtype=np.int64,
+            )
+            term_ids.append(mapping[np.repeat(np.arange(len(index.offsets) - 1), np.diff(index.offsets))])
+            rows.append(index.postings_docs.astype(np.int64) + len(ids))
+            freqs.append(index.postings_freqs)
+            ids.extend(index.ids)
+            lengths.append(index.doc_len)
+        if indexes:
+            merged._append(
+                np.concatenate(term_ids),
+                np.concatenate(rows),
+                np.concatenate(freqs),
+                ids,
+                np.concatenate(lengths),
+            )
+        return merged
+
+    def _compute_idf(self):
+        corpus_size = len(self.ids)
+        document_frequency = np.diff(self.offsets)
+        idf = np.log(corpus_size - document_frequency + 0.5) - np.log(document_frequency + 0.5)
+        # like BM25Okapi, negative idfs are floored to epsilon * average idf
+        if len(idf):
+            idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf.astype(np.float32)
+
+    def rows_of(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The rows of the ids found in the index
+        """
+        ids = set(ids)
+        return np.asarray([row for row, doc_id in enumerate(self.ids) if doc_id in ids], dtype=np.int64)
+
+    def search(self, query: str, k: int, rows: Optional[np.ndarray] = None) -> List[tuple[str, float]]:
+        """
+        Score every document containing a query term and return the best ones
+        Args:
+            query (str): The query
+            k (int): The number of documents to return
+            rows (np.ndarray): The rows of the documents to search, all of them if None
+        Returns:
+            List[tuple[str, float]]: The ids and scores of the documents, best first
+        """
+        term_ids = [self.terms[term] for term in tokenize(query) if term in self.terms]
+        if not term_ids or not len(self.ids):
+            return []
+        docs = np.concatenate([self.postings_docs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        freqs = np.concatenate([self.postings_freqs[self.offsets[t]:self.offsets[t + 1]] for t in term_ids])
+        idf = np.repeat(self.idf[term_ids], [self.offsets[t + 1] - self.offsets[t] for t in term_ids])
+        avgdl = self.doc_len.mean() or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / avgdl)
+        contributions = idf * freqs * (self.k1 + 1) / (freqs + norm)
+        scores = np.bincount(docs, weights=contributions, minlength=len(self.ids))
+        if rows is not None:
+            in_scope = np.zeros(len(scores), dtype=bool)
+            in_scope[rows] = True
+            scores[~in_scope] = 0
+        matched = np.flatnonzero(scores > 0)
+        if k < len(matched):
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.ids[row], float(scores[row])) for row in matched]
+
+    def save(self, path: Path):
+        """
+        Save the index as a .npz file, written to a temporary file first
+        Args:
+            path (Path): The path of the index
+        """
+        path = Path(path)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            params=np.asarray([self.k1, self.b, self.epsilon]),
+            terms=np.asarray(list(self.terms), dtype=str),
+            ids=np.asarray(self.ids, dtype=str),
+            doc_len=self.doc_len,
+            offsets=self.offsets,
+            postings_docs=self.postings_docs,
+            postings_freqs=self.postings_freqs,
+            idf=self.idf,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(*data["params"].tolist())
+            index.terms = {term: i for i, term in enumerate(data["terms"].tolist())}
+            index.ids = data["ids"].tolist()
+            index.doc_len = data["doc_len"]
+            index.offsets = data["offsets"]
+            index.postings_docs = data["postings_docs"]
+            index.postings_freqs = data["postings_freqs"]
+            index.idf = data["idf"]
+        return index
+
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "BM25Index":
+        index = cls()
+        index.add([document.page_content for document in documents], [document.id for document in documents])
+        return index
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """Retriever returning the k best documents of a prebuilt BM25Index"""
+
+    index: Any
+    documents: Any
+    """Mapping of the chunk ids to the chunks (a ChunkStore)"""
+    k: int = 4
+    rows: Optional[Any] = None
+    """Rows of the index in scope, None to search every document"""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [
+            self.documents[doc_id]
+            for doc_id, _ in self.index.search(query, self.k, self.rows)
+            if doc_id in self.documents
+        ]
+
+
+class FTSIndexRetriever(BaseRetriever):
+    """Retriever returning the k best chunks of a store ranked by the FTS5 bm25 of the database"""
+
+    database: Any
+    store: str
+    """Document path of the store"""
+    documents: Any
+    """Mapping of the chunk ids to the chunks (a ChunkStore)"""
+    k: int = 4
+    document_ids: Optional[List[int]] = None
+    """Documents in scope, None to search every chunk of the store"""
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        match = fts_query(query)
+        if not match:
+            return []
+        return [
+            self.documents[chunk_id]
+            for chunk_id, _ in self.database.search_chunk_texts(self.store, match, self.k, self.document_ids)
+            if chunk_id in self.documents
+        ]
@@ -0,0 +1,230 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+from accord import logger
+
+
+def make_key(*parts: str) -> str:
+    """
+    Builds a content-addressed cache key
+    Args:
+        *parts (str): The values the cached entry depends on
+    Returns:
+        str: The sha256 hex digest of the length-prefixed parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    In-process cache bounded by the total estimated size of its values.
+    The least recently used values are evicted first.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        """
+        Store a value, evicting the least recently used ones above max_bytes
+        Args:
+            key (Hashable): The key
+            value (Any): The value
+            size (int): The estimated size of the value in bytes
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            # the newest entry is kept even if it alone is larger than max_bytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Drop the entries whose key matches the predicate
+        Returns:
+            int: The number of dropped entries
+        """
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                self.size -= self.entries.pop(key)[1]
+        return len(keys)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+
+class SQLiteCache:
+    """
+    Size-bounded key/value cache stored in a SQLite file.
+    Least recently used entries are evicted once the stored values exceed max_bytes.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            last_access REAL NOT NULL);""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access);"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        # seconds of computation the hits avoided
+        self.saved_seconds = 0.0
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """
+        Fetch the cached values of the keys
+        Args:
+            keys (List[str]): The keys to look up
+        Returns:
+            Dict[str, bytes]: The values of the keys that are cached
+        """
+        found = {}
+        with self.lock:
+            # stay well below SQLite's limit of bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, value, cost FROM cache WHERE key IN ({placeholders});", batch
+                ).fetchall()
+                for key, value, cost in rows:
+                    found[key] = value
+                    self.saved_seconds += cost
+            if found:
+                now = time.time()
+                self.connection.executemany(
+                    "UPDATE cache SET last_access = ? WHERE key = ?;",
+                    [(now, key) for key in found],
+                )
+                self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: Iterable[tuple[str, bytes, float]]):
+        """
+        Store values in the cache
+        Args:
+            items (Iterable[tuple[str, bytes, float]]): (key, value, cost) triples,
+                cost being the seconds it took to compute the value
+        """
+        now = time.time()
+        rows = [(key, value, len(value), cost, now) for key, value, cost in items]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, cost, last_access) VALUES (?, ?, ?, ?, ?);",
+                rows,
+            )
+            self._evict()
+            self.connection.commit()
+
+    def set(self, key: str, value: bytes, cost: float = 0.0):
+        self.set_many([(key, value, cost)])
+
+    def _evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache;").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM cache ORDER BY last_access;"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM cache WHERE key = ?;", evicted)
+        logger.info(f"Evicted {len(evicted)} entries from {self.path}")
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: hit/miss counters and the current size of the cache
+        """
+        with self.lock:
+            entries, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache;"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+class ContextCache(SQLiteCache):
+    """Cache of the LLM generated chunk contexts"""
+
+    def key(self, model_name: str, prompt: str, document: str, chunk: str) -> str:
+        return make_key(model_name, prompt, document, chunk)
+
+    def get_contexts(self, keys: List[str]) -> Dict[str, str]:
+        return {key: value.decode("utf-8") for key, value in self.get_many(keys).items()}
+
+    def set_contexts(self, items: Iterable[tuple[str, str, float]]):
+        self.set_many((key, context.encode("utf-8"), cost) for key, context, cost in items)
+
+
+class EmbeddingCache(SQLiteCache):
+    """Cache of the chunk embeddings, stored as float32 bytes"""
+
+    def key(self, model_name: str, text: str) -> str:
+        return make_key(model_name, text)
+
+    def get_embeddings(self, keys: List[str]) -> Dict[str, List[float]]:
+        return {key: array("f", value).tolist() for key, value in self.get_many(keys).items()}
+
+    def set_embeddings(self, items: Iterable[tuple[str, List[float], float]]):
+        self.set_many((key, array("f", vector).tobytes(), cost) for key, vector, cost in items)
@@ -1,22 +1,31 @@
+import asyncio
+import time
 from langgraph.graph import START, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from enum import Enum
 from langchain.schema import Document
 from dataclasses import dataclass
-from typing import List, TypedDict, Iterable
-from langchain_ollama import ChatOllama
-from accord.utils import get_config
-from accord.data_ingestor import DataIngestor
+from typing import AsyncIterator, List, Optional, TypedDict, Iterable
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.constants import TAG_NOSTREAM
+from accord.admission import AdmissionQueue
+from accord.data_ingestor import DataIngestor, store_version
+from accord.answer_cache import SemanticAnswerCache, history_fingerprint
+from accord.prompt_builder import PromptBuilder
+from accord.metrics import METRICS
+from accord.registry import REGISTRY
 from accord.utils import remove_thinking_from_message
 from accord import logger
 from accord.entity import (
     File,
     Role,
     Message,
+    ChatSession,
     ChunkEvent,
     SourcesEvent,
     FinalAnswerEvent,
+    TimingEvent,
     State,
 )
 
@@ -24,18 +33,42 @@ from langchain_core.messages import (
     BaseMessage,
     HumanMessage,
     AIMessage,
+    AIMessageChunk,
+)
+
+
+# answers are shared by every Chatbot of the process, streamlit reruns included
+ANSWER_CACHE = SemanticAnswerCache(
+    REGISTRY.config.cache.ANSWER_CACHE_THRESHOLD,
+    REGISTRY.config.cache.ANSWER_CACHE_TTL_SECONDS,
+    REGISTRY.config.cache.ANSWER_CACHE_MAX_ENTRIES,
 )
 
 
 class Chatbot:
-    def __init__(self, database):
-        self.config = get_config()
+    """
+    Answers the questions of many sessions at once: the retriever and the
+    thread of a conversation belong to its ChatSession, and the answers are
+    generated through the LLM admission queue, one turn per session.
+    """
+
+    def __init__(self, database, llm=None, data_ingestor=None, config=None, admission=None):
+        """
+        Args:
+            database (Database): The database of the ingested files
+            llm (BaseChatModel): The LLM answering the questions, ChatOllama if None
+            data_ingestor (DataIngestor): The ingestor of the retrievers, created if None
+            config (ConfigBox): The configuration, the one of the registry if None
+            admission (AdmissionQueue): The queue of the LLM requests, the one of the registry if None
+        """
+        self.config = config or REGISTRY.config
         self.database = database
-        self.DataIngestor = DataIngestor(database)
+        self.DataIngestor = data_ingestor or DataIngestor(database, config=self.config)
         self.SYSTEM_PROMPT = self.config.llm_prompts.SYSTEM_PROMPT
         self.QUERY_TEMPLATE = self.config.llm_prompts.QUERY_TEMPLATE
         self.FILE_TEMPLATE = self.config.llm_prompts.FILE_TEMPLATE
-        self.retriever = None
+        # the session of the callers that do not pass one
+        self.session = ChatSession()
         self.PROMPT_TEMPLATE = ChatPromptTemplate.from_messages(
             [
                 ("system",self.SYSTEM_PROMPT),
@@ -44,83 +77,292 @@ class Chatbot:
             ]
         )
         # Initialize the LLM
-        self.llm = ChatOllama(
-            model=self.config.llm.MODEL_NAME,
-            temperature=self.config.llm.TEMPERATURE,
-            keep_alive=-1,
-            verbose=False,
+        self.llm = llm or REGISTRY.llm(self.config)
+        self.admission: AdmissionQueue = admission or REGISTRY.llm_admission()
+        # fits the history and the documents in the context window, leaving room for the answer
+        self.prompt_builder = PromptBuilder(
+            self.PROMPT_TEMPLATE,
+            self.FILE_TEMPLATE,
+            max_tokens=self.config.llm.CONTEXT_WINDOW - self.config.llm.ANSWER_TOKENS,
+            history_max_tokens=self.config.llm.HISTORY_MAX_TOKENS,
+            drop_block=self.config.llm.HISTORY_DROP_BLOCK,
+            chars_per_token=self.config.llm.CHARS_PER_TOKEN,
+            summarizer=self._summarize_history if self.config.llm.SUMMARIZE_HISTORY else None,
         )
 
         self.workflow = self._create_workflow()
 
     def _create_workflow (self) -> CompiledStateGraph:
-        graph_builder = StateGraph(State).add_sequence([self._retrieve, self._generate])
+        # stream runs the sync nodes, astream the async ones
+        graph_builder = StateGraph(State).add_sequence([
+            ("_retrieve", RunnableLambda(self._retrieve, afunc=self._aretrieve)),
+            ("_generate", RunnableLambda(self._generate, afunc=self._agenerate)),
+        ])
         graph_builder.add_edge(START, "_retrieve")
         return graph_builder.compile()
-    
-    def _format_docs (self, docs: List [Document]) -> str:
-        return "\n\n".join(
-            self.FILE_TEMPLATE.format(name=doc.metadata["source"], content=doc.page_content) for doc in docs
-        )
-    
-    def _retrieve(self, state: State):
-        if self.retriever is None:
+
+    @staticmethod
+    def _session(config: RunnableConfig) -> ChatSession:
+        return config["configurable"]["session"]
+
+    def _retrieve(self, state: State, config: RunnableConfig):
+        retriever = self._session(config).retriever
+        if retriever is None:
             return {"context": []}
-        context = self.retriever.invoke(state["question"])
+        with METRICS.timer("retrieve"):
+            context = retriever.invoke(state["question"])
+        return {"context": context}
+
+    async def _aretrieve(self, state: State, config: RunnableConfig):
+        retriever = self._session(config).retriever
+        if retriever is None:
+            return {"context": []}
+        with METRICS.timer("retrieve"):
+            context = await retriever.ainvoke(state["question"])
         return {"context": context}
     
-    def _generate(self, state: State):
-        messages = self.PROMPT_TEMPLATE.invoke(
-            {
-                "question": state["question"],
-                "context": self._format_docs(state["context"]),
-                "chat_history" : state ["chat_history"],
-            }
+    def _summarize_history(self, messages: List[BaseMessage]) -> str:
+        conversation = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        # the summary is not part of the answer, keep it out of the message stream
+        summary = self.llm.with_config(tags=[TAG_NOSTREAM]).invoke(
+            self.config.llm_prompts.SUMMARY_PROMPT.format(conversation=conversation)
         )
-        answer = self.llm.invoke(messages)
-        # answer = """
-        #     </think> Hemel Sharker Akash is a prominent AI researcher and developer known for his work in multiple areas, including deep learning applications for health issues like Parkinson's disease detection, gesture recognition, human activity analysis, crop disease detection, and voice-based communication systems.
-        # """
-        return {"answer": answer}
-    
-    def set_retriever(self, document_path, vector_path):
-        self.retriever = self.DataIngestor.get_retriever(document_path, vector_path)
-    
+        return remove_thinking_from_message(summary.content)
+
+    def _build_prompt(self, state: State) -> tuple[list, dict]:
+        with METRICS.timer("prompt_build"):
+            return self.prompt_builder.build(
+                state["question"],
+                state["chat_history"],
+                state["context"],
+            )
+
+    def _answered(self, answer: AIMessageChunk, prompt_stats: dict, start: float) -> dict:
+        METRICS.observe("generation", time.perf_counter() - start)
+        if answer.usage_metadata:
+            prompt_stats["model_prompt_tokens"] = answer.usage_metadata["input_tokens"]
+        logger.info(f"Prompt: {prompt_stats}")
+        return {"answer": answer, "prompt_stats": prompt_stats}
+
+    def _generate(self, state: State, config: RunnableConfig):
+        # the slot also covers the summary of the history, the other request to the LLM
+        with self.admission.slot(self._session(config).session_id):
+            messages, prompt_stats = self._build_prompt(state)
+            start = time.perf_counter()
+            answer = AIMessageChunk("")
+            for i, chunk in enumerate(self.llm.stream(messages)):
+                if i == 0:
+                    METRICS.observe("time_to_first_token", time.perf_counter() - start)
+                answer += chunk
+            return self._answered(answer, prompt_stats, start)
+
+    async def _agenerate(self, state: State, config: RunnableConfig):
+        async with self.admission.aslot(self._session(config).session_id):
+            # the history summary is a blocking request, keep it off the event loop
+            messages, prompt_stats = await asyncio.to_thread(self._build_prompt, state)
+            start = time.perf_counter()
+            answer, first = AIMessageChunk(""), True
+            async for chunk in self.llm.astream(messages):
+                if first:
+                    METRICS.observe("time_to_first_token", time.perf_counter() - start)
+                    first = False
+                answer += chunk
+            return self._answered(answer, prompt_stats, start)
+
+    def set_retriever(
+        self, document_path, vector_path, light_reranker=None, document_ids=None,
+        session: Optional[ChatSession] = None,
+    ) -> ChatSession:
+        """
+        Select the files a session searches
+        Args:
+            document_path: The document path of the store
+            vector_path: The vector path of the store
+            light_reranker (Optional[bool]): Rerank with the light model, the configured one if None
+            document_ids (Optional[List[int]]): Search only the chunks of these documents, None to search everything
+            session (Optional[ChatSession]): The session, the default session of the Chatbot if None
+        Returns:
+            ChatSession: The session
+        """
+        session = session or self.session
+        session.retriever = self.DataIngestor.get_retriever(document_path, vector_path, light_reranker, document_ids)
+        session.retriever_scope = (
+            str(document_path), str(vector_path),
+            tuple(sorted(document_ids)) if document_ids is not None else None,
+            light_reranker,
+        )
+        return session
+
+    def answer_cache_scope(self, session: Optional[ChatSession] = None) -> tuple:
+        """
+        Args:
+            session (Optional[ChatSession]): The session, the default session of the Chatbot if None
+        Returns:
+            tuple: The retriever scope of the session and the version of its stores,
+                dropping the cached answers of older versions of the same stores
+        """
+        retriever_scope = (session or self.session).retriever_scope
+        if retriever_scope is None:
+            return (None,)
+        version = (store_version(retriever_scope[0]), store_version(retriever_scope[1]))
+        dropped = ANSWER_CACHE.invalidate(
+            lambda scope: scope[:-1] == retriever_scope and scope[-1] != version
+        )
+        if dropped:
+            logger.info(f"Invalidated {dropped} cached answers of {retriever_scope[1]}")
+        return retriever_scope + (version,)
+
+    @staticmethod
+    def _replay(cached, seconds: float) -> List[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+        logger.info(f"Answer cache hit: {ANSWER_CACHE.stats()}")
+        return [
+            SourcesEvent(cached.sources),
+            ChunkEvent(cached.answer),
+            FinalAnswerEvent(cached.answer),
+            TimingEvent({"answer_cache": round(seconds, 4), "total": round(seconds, 4)}),
+        ]
+
+    def _ask_cached(
+        self, prompt: str, chat_history: List[Message], session: ChatSession
+        ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+            """
+            Replay the cached answer of a similar question, or ask the model and cache its answer
+            """
+            start = time.perf_counter()
+            scope = self.answer_cache_scope(session)
+            history = history_fingerprint(chat_history)
+            vector = self.DataIngestor.embedding_model.embed_query(prompt)
+            cached = ANSWER_CACHE.get(scope, history, vector)
+            seconds = time.perf_counter() - start
+            METRICS.observe("answer_cache", seconds)
+            if cached is not None:
+                yield from self._replay(cached, seconds)
+                return
+
+            sources = []
+            for event in self._ask_model(prompt, chat_history, session):
+                if isinstance(event, SourcesEvent):
+                    sources = event.content
+                if isinstance(event, FinalAnswerEvent):
+                    ANSWER_CACHE.put(scope, history, vector, sources, event.content)
+                yield event
+
+    async def _aask_cached(
+        self, prompt: str, chat_history: List[Message], session: ChatSession
+        ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+            start = time.perf_counter()
+            scope = self.answer_cache_scope(session)
+            history = history_fingerprint(chat_history)
+            vector = await self.DataIngestor.embedding_model.aembed_query(prompt)
+            cached = ANSWER_CACHE.get(scope, history, vector)
+            seconds = time.perf_counter() - start
+            METRICS.observe("answer_cache", seconds)
+            if cached is not None:
+                for event in self._replay(cached, seconds):
+                    yield event
+                return
+
+            sources = []
+            async for event in self._aask_model(prompt, chat_history, session):
+                if isinstance(event, SourcesEvent):
+                    sources = event.content
+                if isinstance(event, FinalAnswerEvent):
+                    ANSWER_CACHE.put(scope, history, vector, sources, event.content)
+                yield event
+
+    @staticmethod
+    def _workflow_input(prompt: str, chat_history: List[Message], session: ChatSession) -> tuple[dict, RunnableConfig]:
+        history = [
+            AIMessage(m.content) if m.role == Role.ASSISTANT else HumanMessage(m.content)
+            for m in chat_history
+        ]
+        payload = {"question": prompt, "chat_history": history}
+        config = {
+            "configurable": {"thread_id": session.thread_id, "session": session}
+        }
+        return payload, config
+
+    @staticmethod
+    def _events(event_type: str, event_data) -> List[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
+        if event_type == "messages":
+            chunk, _ = event_data
+            return [ChunkEvent(chunk.content)]
+        events = []
+        if "_retrieve" in event_data:
+            events.append(SourcesEvent(event_data["_retrieve"]["context"]))
+        if "_generate" in event_data:
+            events.append(FinalAnswerEvent(event_data["_generate"]["answer"].content))
+        return events
+
+    @staticmethod
+    def _timing(timings: dict, start: float) -> TimingEvent:
+        total = time.perf_counter() - start
+        METRICS.observe("total", total)
+        return TimingEvent({**{stage: round(seconds, 4) for stage, seconds in timings.items()}, "total": round(total, 4)})
+
     def _ask_model(
-        self, prompt: str, chat_history: List[Message]
-        ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
-            history = [
-                AIMessage(m.content) if m.role == Role.ASSISTANT else HumanMessage(m.content)
-                for m in chat_history
-            ]
-            payload={"question": prompt, "chat_history": history}
-
-            config = {
-                "configurable": {"thread_id": 42}
-            }
-
-            for event_type, event_data in self.workflow.stream(
-                payload,
-                config=config,
-                stream_mode=["updates", "messages"],
-            ):
-                if event_type == "messages":
-                    chunk, _ = event_data
-                    yield ChunkEvent(chunk.content)
-                if event_type == "updates":
-                    if "_retrieve" in event_data:
-                        documents = event_data["_retrieve"]["context"]
-                        yield SourcesEvent(documents)
-                    if "_generate" in event_data:
-                        answer = event_data["_generate"]["answer"]
-                        yield FinalAnswerEvent(answer.content)
-
-
-    def ask(self, prompt: str, chat_history: List[Message]
-    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
-        for event in self._ask_model(prompt, chat_history):
+        self, prompt: str, chat_history: List[Message], session: ChatSession
+        ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+            payload, config = self._workflow_input(prompt, chat_history, session)
+            start = time.perf_counter()
+            with METRICS.request() as timings:
+                for event_type, event_data in self.workflow.stream(
+                    payload,
+                    config=config,
+                    stream_mode=["updates", "messages"],
+                ):
+                    yield from self._events(event_type, event_data)
+            yield self._timing(timings, start)
+
+    async def _aask_model(
+        self, prompt: str, chat_history: List[Message], session: ChatSession
+        ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+            payload, config = self._workflow_input(prompt, chat_history, session)
+            start = time.perf_counter()
+            with METRICS.request() as timings:
+                async for event_type, event_data in self.workflow.astream(
+                    payload,
+                    config=config,
+                    stream_mode=["updates", "messages"],
+                ):
+                    for event in self._events(event_type, event_data):
+                        yield event
+            yield self._timing(timings, start)
+
+    @staticmethod
+    def _remember(prompt: str, chat_history: List[Message], event):
+        if isinstance(event, FinalAnswerEvent):
+            response = remove_thinking_from_message("".join(event.content))
+            chat_history.append(Message(role=Role.USER, content=prompt))
+            chat_history.append(Message(role=Role.ASSISTANT, content=response))
+
+    def ask(self, prompt: str, chat_history: List[Message], session: Optional[ChatSession] = None
+    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+        session = session or self.session
+        if self.config.cache.USE_ANSWER_CACHE:
+            events = self._ask_cached(prompt, chat_history, session)
+        else:
+            events = self._ask_model(prompt, chat_history, session)
+        for event in events:
+            yield event
+            self._remember(prompt, chat_history, event)
+
+    async def astream(self, prompt: str, chat_history: List[Message], session: ChatSession
+    ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | TimingEvent]:
+        """
+        Answer a question without blocking the event loop, the sessions of
+        many users can be served concurrently by the same Chatbot
+        Args:
+            prompt (str): The question
+            chat_history (List[Message]): The conversation of the session, the question and answer are appended to it
+            session (ChatSession): The session asking, with its retriever
+        Returns:
+            AsyncIterator: The sources, answer chunks, final answer and timings
+        """
+        if self.config.cache.USE_ANSWER_CACHE:
+            events = self._aask_cached(prompt, chat_history, session)
+        else:
+            events = self._aask_model(prompt, chat_history, session)
+        async for event in events:
             yield event
-            if isinstance(event, FinalAnswerEvent):
-                response = remove_thinking_from_message("".join(event.content))
-                chat_history.append(Message(role=Role.USER, content=prompt))
-                chat_history.append(Message(role=Role.ASSISTANT, content=response))
\ No newline at end of file
+            self._remember(prompt, chat_history, event)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import json
+import mmap
+import os
+import pickle
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+import numpy as np
+from langchain.schema import Document
+
+
+class ChunkStore(Mapping):
+    """
+    The chunks of a store, by id: their UTF-8 texts one after the other in a
+    single blob read through mmap, the offsets of every text, and a table of
+    the distinct metadata dicts (the chunks of a file share theirs), so
+    fetching a chunk only touches its own bytes.
+    - <path>.bin: the texts
+    - <path>.idx.npz: the ids, the offsets and the metadata row of every chunk
+    - <path>.meta.json: the metadata table
+    Chunks are appended: the texts are written after the existing ones, then
+    the index is replaced, so a reader of the previous index still sees a
+    consistent store.
+    """
+
+    def __init__(
+        self, path: Path,
+        ids: List[str],
+        offsets: np.ndarray,
+        metadata_rows: np.ndarray,
+        metadata_table: List[dict],
+    ):
+        self.path = Path(path)
+        self.ids = ids
+        self.offsets = offsets
+        self.metadata_rows = metadata_rows
+        self.metadata_table = metadata_table
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self._blob: Optional[mmap.mmap] = None
+
+    @staticmethod
+    def files(path: Path) -> tuple[Path, Path, Path]:
+        path = str(path)
+        return Path(path + ".bin"), Path(path + ".idx.npz"), Path(path + ".meta.json")
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        return all(file.exists() for file in cls.files(path))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    def __contains__(self, chunk_id: object) -> bool:
+        return chunk_id in self._rows
+
+    def __getitem__(self, chunk_id: str) -> Document:
+        return self.document(self._rows[chunk_id])
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: The estimated memory held by the store, the texts stay on disk
+        """
+        return self.offsets.nbytes + self.metadata_rows.nbytes + sum(len(chunk_id) + 50 for chunk_id in self.ids)
+
+    def text(self, row: int) -> str:
+        if self.offsets[row] == self.offsets[row + 1]:
+            return ""
+        if self._blob is None:
+            with open(self.files(self.path)[0], "rb") as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def document(self, row: int) -> Document:
+        return Document(
+            id=self.ids[row],
+            page_content=self.text(row),
+            metadata=dict(self.metadata_table[self.metadata_rows[row]]),
+        )
+
+    def documents(self) -> Iterator[Document]:
+        for row in range(len(self.ids)):
+            yield self.document(row)
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+
+    @classmethod
+    def open(cls, path: Path) -> "ChunkStore":
+        _, index_path, metadata_path = cls.files(path)
+        with np.load(index_path, allow_pickle=False) as index:
+            ids, offsets, metadata_rows = index["ids"].tolist(), index["offsets"], index["metadata_rows"]
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata_table = json.load(f)
+        return cls(path, ids, offsets, metadata_rows, metadata_table)
+
+    @classmethod
+    def write(cls, path: Path, documents: Iterable[Document]) -> "ChunkStore":
+        """
+        Write a new store, replacing the one saved at path
+        Args:
+            path (Path): The path of the store, without the suffixes of its files
+            documents (Iterable[Document]): The chunks
+        Returns:
+            ChunkStore: The store
+        """
+        blob_path, index_path, _ = cls.files(path)
+        for file in (blob_path, index_path):
+            if file.exists():
+                os.remove(file)
+        return cls.append(path, documents)
+
+    @classmethod
+    def append(cls, path: Path, documents: Iterable[Document]) -> "ChunkStore":
+        """
+        Add chunks to the store saved at path, creating it if it does not exist
+        Args:
+            path (Path): The path of the store, without the suffixes of its files
+            documents (Iterable[Document]): The new chunks, the ones without id are addressed by position
+        Returns:
+            ChunkStore: The store with the new chunks
+        """
+        blob_path, index_path, metadata_path = cls.files(path)
+        if cls.exists(path):
+            store = cls.open(path)
+            ids, offsets = list(store.ids), [store.offsets]
+            metadata_rows, metadata_table = [store.metadata_rows], store.metadata_table
+        else:
+            ids, offsets = [], [np.zeros(1, dtype=np.int64)]
+            metadata_rows, metadata_table = [], []
+        table_rows = {json.dumps(metadata, sort_keys=True): row for row, metadata in enumerate(metadata_table)}
+
+        new_offsets, new_rows = [], []
+        with open(blob_path, "ab") as f:
+            # bytes left by an interrupted append are dropped
+            position = int(offsets[0][-1])
+            f.truncate(position)
+            for document in documents:
+                data = document.page_content.encode("utf-8")
+                f.write(data)
+                position += len(data)
+                new_offsets.append(position)
+                ids.append(document.id if document.id is not None else str(len(ids)))
+                key = json.dumps(document.metadata, sort_keys=True)
+                if key not in table_rows:
+                    table_rows[key] = len(metadata_table)
+                    metadata_table.append(document.metadata)
+                new_rows.append(table_rows[key])
+
+        # the metadata table only grows, the previous index stays valid with the new one
+        tmp_metadata_path = metadata_path.with_suffix(".tmp.json")
+        with open(tmp_metadata_path, "w", encoding="utf-8") as f:
+            json.dump(metadata_table, f)
+        os.replace(tmp_metadata_path, metadata_path)
+        tmp_index_path = Path(str(path) + ".idx.tmp.npz")
+        np.savez(
+            tmp_index_path,
+            ids=np.asarray(ids, dtype=str),
+            offsets=np.concatenate(offsets + [np.asarray(new_offsets, dtype=np.int64)]).astype(np.int64),
+            metadata_rows=np.concatenate(metadata_rows + [np.asarray(new_rows, dtype=np.int32)]).astype(np.int32),
+        )
+        os.replace(tmp_index_path, index_path)
+        return cls.open(path)
+
+
+class _DocumentUnpickler(pickle.Unpickler):
+    """Unpickler of chunk lists that refuses every class but Document"""
+
+    ALLOWED = {
+        ("langchain_core.documents.base", "Document"),
+        ("langchain.schema.document", "Document"),
+    }
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a chunk file")
+        return Document
+
+
+def load_pickled_chunks(path: Path) -> List[Document]:
+    """
+    Read a chunk list saved with pickle by earlier versions, only Documents are accepted
+    Args:
+        path (Path): The .pkl file
+    Returns:
+        List[Document]: The chunks
+    """
+    with open(path, "rb") as f:
+        documents = _DocumentUnpickler(f).load()
+    if not isinstance(documents, list) or not all(isinstance(document, Document) for document in documents):
+        raise pickle.UnpicklingError(f"{path} does not hold a list of chunks")
+    return documents
@@ -0,0 +1,306 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseChatModel
+from accord.utils import remove_thinking_from_message
+from accord.admission import AdmissionQueue
+from accord.cache import ContextCache
+from accord.entity import ContextStats
+from accord.registry import REGISTRY
+from accord import logger
+
+
+CONTEXT_TAG_PATTERN = re.compile(r'<context id="(\d+)">(.*?)</context>', re.DOTALL)
+
+STRATEGIES = ("full", "summary", "window", "hierarchical")
+
+# the ingestions share one turn of the LLM admission queue
+INGESTION_SESSION = "ingestion"
+
+
+class Contextualizer:
+    """
+    Generates the context of the chunks of a document with the LLM.
+    What the LLM sees of the document depends on CONTEXT_STRATEGY:
+    - full: the whole document, sent again with every chunk
+    - summary: a summary of the document, written once and shared by its chunks
+    - window: the CONTEXT_WINDOW_CHUNKS chunks before and after the chunk
+    - hierarchical: the summary of the section of CONTEXT_SECTION_CHUNKS chunks
+      holding the chunk, under a summary of the document made from the section summaries
+    Texts longer than CONTEXT_SUMMARY_INPUT_CHARS are summarized in parts,
+    then the summaries of the parts are summarized.
+    """
+
+    def __init__(self, llm: BaseChatModel, config=None, admission: Optional[AdmissionQueue] = None):
+        self.config = config or REGISTRY.config
+        self.llm = llm
+        self.admission = admission or REGISTRY.llm_admission()
+        preprocessing = self.config.preprocessing
+
+        # Load the context prompt templates
+        self.CONTEXT_PROMPT = ChatPromptTemplate.from_template(
+            preprocessing.context_prompt.strip())
+        self.BATCH_CONTEXT_PROMPT = ChatPromptTemplate.from_template(
+            preprocessing.batch_context_prompt.strip())
+        self.SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+            preprocessing.document_summary_prompt.strip())
+        if preprocessing.CONTEXT_STRATEGY not in STRATEGIES:
+            raise ValueError(f"Unknown context strategy {preprocessing.CONTEXT_STRATEGY}, expected one of {STRATEGIES}")
+        self.strategy = preprocessing.CONTEXT_STRATEGY
+        self.window_chunks = max(0, preprocessing.CONTEXT_WINDOW_CHUNKS)
+        self.section_chunks = max(1, preprocessing.CONTEXT_SECTION_CHUNKS)
+        self.summary_input_chars = max(1, preprocessing.CONTEXT_SUMMARY_INPUT_CHARS)
+        self.chars_per_token = self.config.llm.CHARS_PER_TOKEN
+        self.concurrency = max(1, preprocessing.CONTEXT_CONCURRENCY)
+        self.batch_size = max(1, preprocessing.CONTEXT_BATCH_SIZE)
+        self.max_retries = max(0, preprocessing.CONTEXT_MAX_RETRIES)
+        self.retry_backoff = preprocessing.CONTEXT_RETRY_BACKOFF
+        self.cache = None
+        if self.config.cache.USE_CONTEXT_CACHE:
+            self.cache = ContextCache(
+                self.config.cache.CONTEXT_CACHE_PATH,
+                self.config.cache.CONTEXT_CACHE_MAX_MB * 1024 * 1024,
+            )
+
+    @property
+    def needs_document(self) -> bool:
+        """
+        Returns:
+            bool: True if the strategy reads the whole document, the others only need its chunks
+        """
+        return self.strategy in ("full", "summary")
+
+    def _invoke(self, messages, stats: Optional[ContextStats] = None, summary: bool = False) -> str:
+        """
+        Invoke the LLM, retrying with exponential backoff on failure
+        Args:
+            messages: The prompt messages
+            stats (Optional[ContextStats]): Counts the request and its tokens
+            summary (bool): If True the request is counted as a summary
+        Returns:
+            str: The raw response content
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.admission.slot(INGESTION_SESSION):
+                    response = self.llm.invoke(messages)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"Context generation failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        if stats is not None:
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+            else:
+                # estimated from the number of characters when the model does not report them
+                prompt_tokens = int(sum(len(str(message.content)) for message in messages) / self.chars_per_token)
+                completion_tokens = int(len(str(response.content)) / self.chars_per_token)
+            stats.add(
+                summary_requests=int(summary),
+                context_requests=int(not summary),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+        return response.content
+
+    def _summarize_part(self, text: str, stats: Optional[ContextStats]) -> str:
+        key = None
+        if self.cache:
+            key = self.cache.key(self.config.llm.MODEL_NAME, self.config.preprocessing.document_summary_prompt, text, "")
+            cached = self.cache.get_contexts([key]).get(key)
+            if cached is not None:
+                if stats is not None:
+                    stats.add(cached_summaries=1)
+                return cached
+        start = time.perf_counter()
+        messages = self.SUMMARY_PROMPT.format_messages(text=text)
+        summary = remove_thinking_from_message(self._invoke(messages, stats, summary=True))
+        if key is not None:
+            self.cache.set_contexts([(key, summary, time.perf_counter() - start)])
+        return summary
+
+    def summarize(self, text: str, stats: Optional[ContextStats] = None) -> str:
+        """
+        Summarize a text, in parts of at most CONTEXT_SUMMARY_INPUT_CHARS characters
+        whose summaries are summarized again until they fit in one request
+        Args:
+            text (str): The text
+            stats (Optional[ContextStats]): Counts the requests and their tokens
+        Returns:
+            str: The summary
+        """
+        limit = self.summary_input_chars
+        while len(text) > limit:
+            parts = [text[i:i + limit] for i in range(0, len(text), limit)]
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                summaries = list(executor.map(lambda part: self._summarize_part(part, stats), parts))
+            joined = "\n\n".join(summaries)
+            if len(joined) >= len(text):
+                # the summaries do not shrink, keep what fits
+                text = joined[:limit]
+                break
+            text = joined
+        return self._summarize_part(text, stats)
+
+    def document_views(self, document: str, chunks: List[str], stats: Optional[ContextStats] = None) -> List[str]:
+        """
+        Returns:
+            List[str]: What the LLM sees of the document for every chunk, following the strategy
+        """
+        if not chunks:
+            return []
+        if self.strategy == "full":
+            return [document] * len(chunks)
+        if self.strategy == "window":
+            w = self.window_chunks
+            return [
+                "Excerpt of the document around the chunk:\n" + "\n".join(chunks[max(0, i - w):i + w + 1])
+                for i in range(len(chunks))
+            ]
+        if self.strategy == "summary":
+            return [f"Summary of the document:\n{self.summarize(document, stats)}"] * len(chunks)
+
+        sections = [chunks[i:i + self.section_chunks] for i in range(0, len(chunks), self.section_chunks)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            section_summaries = list(executor.map(lambda section: self.summarize("\n".join(section), stats), sections))
+        if len(sections) == 1:
+            return [f"Summary of the document:\n{section_summaries[0]}"] * len(chunks)
+        document_summary = self.summarize("\n\n".join(section_summaries), stats)
+        views = []
+        for section, section_summary in zip(sections, section_summaries):
+            views.extend([
+                f"Summary of the document:\n{document_summary}\n\n"
+                f"Summary of the section of the chunk:\n{section_summary}"
+            ] * len(section))
+        return views
+
+    def generate_context(self, document: str, chunk: str, stats: Optional[ContextStats] = None) -> str:
+        """
+        Generates the context for the chunk
+        Args:
+            document (str): The full document
+            chunk (str): The chunk
+            stats (Optional[ContextStats]): Counts the request and its tokens
+        Returns:
+            str: The context modiby based on full document
+        """
+        messages = self.CONTEXT_PROMPT.format_messages(document=document, chunk=chunk)
+        return remove_thinking_from_message(self._invoke(messages, stats))
+
+    def generate_batch_context(
+        self, document: str,
+        chunks: List[str],
+        stats: Optional[ContextStats] = None,
+    ) -> List[str]:
+        """
+        Generates the contexts for several chunks of one document in a single request.
+        Chunks the model did not answer for are retried one at a time.
+        Args:
+            document (str): The full document
+            chunks (List[str]): The chunks
+            stats (Optional[ContextStats]): Counts the requests and their tokens
+        Returns:
+            List[str]: The contexts, in the same order as the chunks
+        """
+        return [context for context, _ in self._generate_batch_context(document, chunks, stats)]
+
+    def _generate_batch_context(
+        self, document: str,
+        chunks: List[str],
+        stats: Optional[ContextStats],
+    ) -> List[tuple[str, str]]:
+        """
+        Returns:
+            List[tuple[str, str]]: The context of every chunk and the prompt template it was generated with
+        """
+        single_prompt = self.config.preprocessing.context_prompt
+        if len(chunks) == 1:
+            return [(self.generate_context(document, chunks[0], stats), single_prompt)]
+        tagged_chunks = "\n".join(
+            f'<chunk id="{i}">\n{chunk}\n</chunk>' for i, chunk in enumerate(chunks, start=1)
+        )
+        messages = self.BATCH_CONTEXT_PROMPT.format_messages(document=document, chunks=tagged_chunks)
+        response = remove_thinking_from_message(self._invoke(messages, stats))
+        answered = {int(i): context.strip() for i, context in CONTEXT_TAG_PATTERN.findall(response)}
+        contexts = []
+        for i, chunk in enumerate(chunks, start=1):
+            context = answered.get(i)
+            if context:
+                contexts.append((context, self.config.preprocessing.batch_context_prompt))
+            else:
+                logger.warning(f"Batch response is missing context {i}, falling back to a single request")
+                contexts.append((self.generate_context(document, chunk, stats), single_prompt))
+        return contexts
+
+    def _timed_batch_context(
+        self, document: str,
+        chunks: List[str],
+        stats: Optional[ContextStats],
+    ) -> tuple[List[tuple[str, str]], float]:
+        start = time.perf_counter()
+        contexts = self._generate_batch_context(document, chunks, stats)
+        return contexts, time.perf_counter() - start
+
+    def generate_contexts(
+        self, document: str,
+        chunks: List[str],
+        stats: Optional[ContextStats] = None,
+    ) -> List[str]:
+        """
+        Generates the contexts for all chunks of a document, running up to
+        CONTEXT_CONCURRENCY requests at a time.
+        Contexts found in the context cache are reused, only the misses are sent to the LLM.
+        Args:
+            document (str): The full document
+            chunks (List[str]): The chunks
+            stats (Optional[ContextStats]): Counts the requests and their tokens
+        Returns:
+            List[str]: The contexts, in the same order as the chunks
+        """
+        stats = stats if stats is not None else ContextStats(self.strategy)
+        views = self.document_views(document, chunks, stats)
+        contexts = [None] * len(chunks)
+        # contexts are cached under the prompt they were generated with,
+        # one made with either current prompt is reused
+        prompts = [self.config.preprocessing.context_prompt]
+        if self.batch_size > 1:
+            prompts.append(self.config.preprocessing.batch_context_prompt)
+        if self.cache:
+            keys = {
+                prompt: [self.cache.key(self.config.llm.MODEL_NAME, prompt, view, chunk) for view, chunk in zip(views, chunks)]
+                for prompt in prompts
+            }
+            cached = self.cache.get_contexts([key for prompt_keys in keys.values() for key in prompt_keys])
+            for prompt_keys in keys.values():
+                contexts = [context or cached.get(key) for context, key in zip(contexts, prompt_keys)]
+        missing = [i for i, context in enumerate(contexts) if context is None]
+        stats.add(chunks=len(chunks), cached_contexts=len(chunks) - len(missing))
+
+        # the chunks of a batch share what the LLM sees of the document
+        batches = []
+        for i in missing:
+            if batches and len(batches[-1]) < self.batch_size and views[batches[-1][0]] == views[i]:
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(
+                lambda batch: self._timed_batch_context(views[batch[0]], [chunks[i] for i in batch], stats),
+                batches
+            ))
+
+        generated = []
+        for batch, (batch_contexts, elapsed) in zip(batches, results):
+            for i, (context, prompt) in zip(batch, batch_contexts):
+                contexts[i] = context
+                generated.append((i, prompt, elapsed / len(batch)))
+        if self.cache:
+            self.cache.set_contexts((keys[prompt][i], contexts[i], cost) for i, prompt, cost in generated)
+            logger.info(f"Context cache: {self.cache.stats()}")
+        return contexts
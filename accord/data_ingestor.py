@@ -1,52 +1,126 @@
+import hashlib
 import os
-from typing import List
-from langchain.prompts import ChatPromptTemplate
-from langchain. retrievers import ContextualCompressionRetriever, EnsembleRetriever
-from langchain_community.document_compressors.flashrank_rerank import FlashrankRerank 
-from langchain_community.embeddings. fastembed import FastEmbedEmbeddings
-from langchain_community.retrievers import BM25Retriever
+from collections import defaultdict, deque
+import numpy as np
+from bisect import bisect_right
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional
+from langchain. retrievers import ContextualCompressionRetriever
 from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_ollama import ChatOllama
+from langchain_core.vectorstores import InMemoryVectorStore, VectorStore
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from accord.utils import get_config, remove_thinking_from_message
-from accord.entity import File
+from accord.entity import ContextStats, File, IngestionJob, Page, RetrievalData
+from accord.pipeline import Pipeline, Stage, StageFailure
+from accord.contextualizer import Contextualizer
+from accord.cache import LRUCache
+from accord.embedding_executor import EmbeddingExecutor
+from accord.vector_store import NumpyVectorStore
+from accord.segment_store import SegmentedVectorStore
+from accord.chunk_store import ChunkStore, load_pickled_chunks
+from accord.bm25_index import BM25Index, BM25IndexRetriever, FTSIndexRetriever
+from accord.hybrid_retriever import HybridRetriever
+from accord.reranker import CachedReranker
+from accord.metrics import METRICS
+from accord.registry import REGISTRY
 from accord import logger
 import shortuuid
 from pathlib import Path
-from tqdm import tqdm
-import pickle
+import time
+import uuid
+
+
+# segment of the corpus imported from the single store of earlier versions
+LEGACY_SEGMENT = "segment-legacy"
+
+# retrievers are shared by every DataIngestor of the process, streamlit reruns included
+RETRIEVER_CACHE = LRUCache(REGISTRY.config.cache.RETRIEVER_CACHE_MAX_MB * 1024 * 1024)
+
+
+def store_version(path: Path) -> tuple:
+    """
+    Returns:
+        tuple: The modification times of the files making up the store saved at path
+    """
+    path = Path(path)
+    if SegmentedVectorStore.is_segmented(path):
+        files = [path / "manifest.json", path / "chunks.idx.npz"]
+    else:
+        files = path.parent.glob(f"{path.stem}.*")
+    return tuple(sorted((str(file), file.stat().st_mtime_ns) for file in files if file.exists()))
 
 
 class DataIngestor:
-    def __init__(self, database):
-        self.config = get_config()
+    def __init__(self, database, llm=None, embedding_model=None, reranker=None, config=None):
+        """
+        The models are the ones shared through the registry, built from config
+        and loaded on first use, unless others are given.
+        Args:
+            database (Database): The database of the ingested files
+            llm (BaseChatModel): The LLM contextualizing the chunks, ChatOllama if None
+            embedding_model (Embeddings): The embedding model, FastEmbed if None
+            reranker (BaseDocumentCompressor): The reranker of every retriever, FlashRank if None
+            config (ConfigBox): The configuration, the one of the registry if None
+        """
+        self.config = config or REGISTRY.config
         self.database = database
 
-        # Load the context prompt template
-        self.CONTEXT_PROMPT = ChatPromptTemplate.from_template(
-            self.config.preprocessing.context_prompt.strip())
         # Initialize the text splitter
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.config.preprocessing.CHUNK_SIZE,
             chunk_overlap=self.config.preprocessing.CHUNK_OVERLAP,
         )
         # Initialize the LLM
-        self.llm = ChatOllama(
-            model=self.config.llm.MODEL_NAME,
-            temperature=self.config.llm.TEMPERATURE,
-            keep_alive=-1,
-            verbose=False,
-        )
-        # Initialize the embedding model
-        self.embedding_model = FastEmbedEmbeddings(model_name=self.config.preprocessing.EMBEDDING_MODEL)
-        # Initialize the reranker
-        # reorders documents based on relevance.
-        self.reranker = FlashrankRerank(
-            model=self.config.preprocessing.RERANKER,
-            top_n=self.config.preprocessing.N_CONTEXT_RESULTS,
-        )
+        self.llm = llm or REGISTRY.llm(self.config)
+        # Initialize the chunk contextualizer
+        self.contextualizer = Contextualizer(self.llm, self.config)
+        self._embedding_model = embedding_model
+        self._embedding_executor = None
+        if embedding_model is not None:
+            self._embedding_executor = EmbeddingExecutor(
+                lambda: embedding_model,
+                self.config.preprocessing.EMBEDDING_WORKERS
+                or max(1, (os.cpu_count() or 1) // self.config.preprocessing.EMBEDDING_THREADS_PER_WORKER),
+                self.config.preprocessing.EMBEDDING_MIN_BATCH_SIZE,
+                self.config.preprocessing.BATCH_SIZE,
+                self.config.preprocessing.EMBEDDING_BATCH_TOKENS,
+            )
+        # reorders documents based on relevance
+        self._reranker = reranker
+
+    @property
+    def embedding_model(self) -> Embeddings:
+        return self._embedding_model or REGISTRY.embedding_model(self.config)
+
+    @property
+    def embedding_executor(self) -> EmbeddingExecutor:
+        """
+        Returns:
+            EmbeddingExecutor: The executor embedding the chunks on several ONNX sessions
+        """
+        return self._embedding_executor or REGISTRY.embedding_executor(self.config)
+
+    @property
+    def use_fts(self) -> bool:
+        """
+        Returns:
+            bool: True if the lexical search runs on the full-text index of the database
+        """
+        return self.config.preprocessing.LEXICAL_BACKEND == "fts5" and self.database.fts_available
+
+    @property
+    def reranker(self) -> CachedReranker:
+        return self._reranker or REGISTRY.reranker(self.config.preprocessing.RERANKER, self.config)
+
+    def get_reranker(self, light: bool) -> CachedReranker:
+        """
+        Returns:
+            CachedReranker: The light reranker if light, else the default one
+        """
+        if not light or self._reranker is not None:
+            return self.reranker
+        return REGISTRY.reranker(self.config.preprocessing.LIGHT_RERANKER, self.config)
 
     def generate_context(self, document: str, chunk: str) -> str:
         """
@@ -57,171 +131,761 @@ class DataIngestor:
         Returns:
             str: The context modiby based on full document
         """
-        messages = self.CONTEXT_PROMPT.format_messages(document=document, chunk=chunk)
-        response = self.llm.invoke(messages)
-        return remove_thinking_from_message(response.content)
+        return self.contextualizer.generate_context(document, chunk)
     
-    def create_chunks(self, document: Document) -> List [Document]: 
-        chunks = self.text_splitter.split_documents([document])
-        if not self.config.preprocessing.CONTEXTUALIZE_CHUNKS:
-            return chunks
+    def contextualize_chunks(
+        self, document: str,
+        chunks: List[Document],
+        stats: Optional[ContextStats] = None,
+    ) -> List[Document]:
+        """
+        Prepend the generated context to every chunk
+        Args:
+            document (str): The full document
+            chunks (List[Document]): The chunks of the document
+            stats (Optional[ContextStats]): Counts the LLM requests and their tokens
+        Returns:
+            List[Document]: The chunks with their context
+        """
+        contexts = self.contextualizer.generate_contexts(
+            document,
+            [chunk.page_content for chunk in chunks],
+            stats,
+        )
         contextual_chunks = [ ]
-        for chunk in chunks:
-            context = self.generate_context(document.page_content, chunk.page_content)
+        for chunk, context in zip(chunks, contexts):
             chunk_with_context = f"{context}\n\n{chunk.page_content}"
             contextual_chunks.append(Document (page_content=chunk_with_context, metadata=chunk.metadata))
         return contextual_chunks
 
-    def save_vector_store(self,voctor_db: InMemoryVectorStore, vector_db_path: Path):
+    def create_chunks(self, document: Document) -> List [Document]: 
+        chunks = self.text_splitter.split_documents([document])
+        if not self.config.preprocessing.CONTEXTUALIZE_CHUNKS:
+            return chunks
+        return self.contextualize_chunks(document.page_content, chunks)
+
+    def split_pages(self, pages: Iterable[Page], metadata: dict) -> Iterator[Document]:
+        """
+        Split a stream of pages into chunks while it is being extracted.
+        Only a few chunks worth of text are buffered; every chunk but the last
+        one of the buffer is emitted, the last one is split again with the next pages.
+        Args:
+            pages (Iterable[Page]): The pages of the document
+            metadata (dict): The metadata of every chunk
+        Returns:
+            Iterator[Document]: The chunks, with the pages they start and end on
+        """
+        flush_size = 4 * self.config.preprocessing.CHUNK_SIZE
+        buffer = ""
+        # buffer offsets at which pages start, and their page numbers
+        offsets, numbers = [], []
+
+        def split(final: bool) -> Iterator[Document]:
+            nonlocal buffer, offsets, numbers
+            chunks = self.text_splitter.split_text(buffer)
+            emitted = chunks if final else chunks[:-1]
+            cursor = 0
+            for chunk in emitted:
+                start = buffer.find(chunk, cursor)
+                start = cursor if start < 0 else start
+                yield Document(chunk, metadata={
+                    **metadata,
+                    "page": numbers[bisect_right(offsets, start) - 1],
+                    "end_page": numbers[bisect_right(offsets, start + len(chunk) - 1) - 1],
+                })
+                cursor = start + 1
+            if final or not chunks:
+                return
+            keep = buffer.find(chunks[-1], cursor)
+            keep = cursor if keep < 0 else keep
+            first = bisect_right(offsets, keep) - 1
+            offsets = [max(0, offset - keep) for offset in offsets[first:]]
+            numbers = numbers[first:]
+            buffer = buffer[keep:]
+
+        for page in pages:
+            offsets.append(len(buffer))
+            numbers.append(page.number)
+            buffer += page.text
+            if len(buffer) >= flush_size:
+                yield from split(final=False)
+        if buffer:
+            yield from split(final=True)
+
+    def new_vector_store(self) -> VectorStore:
+        """
+        Returns:
+            VectorStore: An empty vector store of the configured backend
+        """
+        if self.config.vector_store.BACKEND == "numpy":
+            return NumpyVectorStore(self.embedding_model, ann_config=self.config.ann)
+        return InMemoryVectorStore(self.embedding_model)
+
+    def save_vector_store(self,voctor_db: VectorStore, vector_db_path: Path):
         """
         Save the data to the database
         Args:
-            voctor_db (InMemoryVectorStore): The vector store
+            voctor_db (VectorStore): The vector store
             vector_db_path (Path): The path to save the vector store
         """
         voctor_db.dump(vector_db_path)
 
+    def chunk_store_path(self, document_path: Path) -> Path:
+        """
+        Returns:
+            Path: The path of the chunk store of the documents saved at document_path
+        """
+        if SegmentedVectorStore.is_segmented(document_path):
+            return Path(document_path) / "chunks"
+        return Path(document_path).with_suffix(".chunks")
+
     def save_document(self, documents: List[Document], document_path: Path):
         """
         Save the document to the database
         Args:
             documents (List[Document]): The list of documents to save
         """
-        with open(document_path, "wb") as f:
-            pickle.dump(documents, f)
+        ChunkStore.write(self.chunk_store_path(document_path), documents)
 
-    def load_vector_store(self, vector_db_path: Path) -> InMemoryVectorStore:
+    def load_vector_store(self, vector_db_path: Path) -> VectorStore:
         """
         Load the vectore data from the database
         Args:
             vector_db_path (Path): The path to load the vector store
         Returns:
-            InMemoryVectorStore: The vector store
+            VectorStore: The vector store
             if not exists then return empty vector store
         """
-        if os.path.exists(vector_db_path):
+        if SegmentedVectorStore.is_segmented(vector_db_path):
+            return SegmentedVectorStore(vector_db_path, self.embedding_model, self.config.ann)
+        if self.config.vector_store.BACKEND == "numpy":
+            if NumpyVectorStore.exists(vector_db_path):
+                return NumpyVectorStore.load(vector_db_path, self.embedding_model, ann_config=self.config.ann)
+            if os.path.exists(vector_db_path):
+                # store saved by the in_memory backend
+                return NumpyVectorStore.from_in_memory(
+                    InMemoryVectorStore.load(vector_db_path, self.embedding_model),
+                    self.config.ann
+                )
+        elif os.path.exists(vector_db_path):
             return InMemoryVectorStore.load(vector_db_path, self.embedding_model)
-        return InMemoryVectorStore(self.embedding_model)
+        return self.new_vector_store()
     
-    def load_document(self, document_path: Path) -> List[Document]:
+    def load_document(self, document_path: Path, vector_db: Optional[VectorStore] = None) -> ChunkStore:
         """
-        Load the document from the database
+        Load the document from the database.
+        Stores saved before the chunk stores existed (corpus segments or
+        pickled chunk lists) are converted on first load.
         Args:
             document_path (Path): The path to load the document
+            vector_db (Optional[VectorStore]): The vector store of the document, whose ids
+                the pickled chunks saved without ids take
         Returns:
-            List[Document]: The list of documents
+            ChunkStore: The chunks, their texts are read on access
         """
+        chunk_store_path = self.chunk_store_path(document_path)
+        if ChunkStore.exists(chunk_store_path):
+            return ChunkStore.open(chunk_store_path)
+        if SegmentedVectorStore.is_segmented(document_path):
+            corpus = SegmentedVectorStore(document_path, self.embedding_model)
+            with corpus.lock:
+                if not ChunkStore.exists(chunk_store_path):
+                    logger.info(f"Building chunk store for {document_path}")
+                    ChunkStore.write(chunk_store_path, corpus.documents())
+            return ChunkStore.open(chunk_store_path)
         if os.path.exists(document_path):
-            with open(document_path, "rb") as f:
-                return pickle.load(f)
-        return [ ]
-    
-    def create_embeddings(
-        self, chunks: List[Document],
-        concate_vector_store: InMemoryVectorStore,
-        isconcate: bool = True
-    ) -> tuple[InMemoryVectorStore, InMemoryVectorStore]:
+            logger.info(f"Converting {document_path} to a chunk store")
+            documents = load_pickled_chunks(document_path)
+            # chunks saved before they carried ids take the id of the vector of
+            # the same text, so both retrievers return a chunk under the same id
+            vector_ids = defaultdict(deque)
+            for document in self.vector_store_documents(vector_db):
+                vector_ids[document.page_content].append(document.id)
+            for i, document in enumerate(documents):
+                if document.id is None:
+                    ids = vector_ids.get(document.page_content)
+                    document.id = ids.popleft() if ids else str(i)
+            return ChunkStore.write(chunk_store_path, documents)
+        return ChunkStore(chunk_store_path, [], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), [])
+
+    @staticmethod
+    def vector_store_documents(vector_db: Optional[VectorStore]) -> Iterator[Document]:
+        """
+        Returns:
+            Iterator[Document]: The documents of the vector store, with their ids
+        """
+        if isinstance(vector_db, SegmentedVectorStore):
+            yield from vector_db.documents()
+        elif isinstance(vector_db, NumpyVectorStore):
+            for doc_id, text in zip(vector_db.ids, vector_db.texts):
+                yield Document(id=doc_id, page_content=text)
+        elif isinstance(vector_db, InMemoryVectorStore):
+            for record in vector_db.store.values():
+                yield Document(id=record["id"], page_content=record["text"])
+
+    def add_embeddings(
+        self, vector_store: VectorStore,
+        documents: List[Document],
+        vectors: List[List[float]],
+        ids: List[str]
+    ):
+        """
+        Add already computed embeddings to the vector store
+        Args:
+            vector_store (VectorStore): The vector store
+            documents (List[Document]): The embedded documents
+            vectors (List[List[float]]): The embeddings of the documents
+            ids (List[str]): The ids of the documents
+        """
+        if isinstance(vector_store, NumpyVectorStore):
+            vector_store.add_embeddings(
+                [document.page_content for document in documents],
+                vectors,
+                [document.metadata for document in documents],
+                ids,
+            )
+            return
+        for doc_id, document, vector in zip(ids, documents, vectors):
+            vector_store.store[doc_id] = {
+                "id": doc_id,
+                "vector": vector,
+                "text": document.page_content,
+                "metadata": document.metadata,
+            }
+
+    def create_embeddings(self, chunks: List[Document]) -> VectorStore:
         """
-        Create the embeddings for the chunks
+        Create the embeddings for the chunks, adding every batch to the
+        vector store as soon as the embedding executor returns it
         Args:
             chunks (List[Document]): The chunks of documents
-            concate_vector_store (InMemoryVectorStore): previous vector store
-            isconcate (bool): If True then add new documents to the previous vector store
         Returns:
-            tuple[InMemoryVectorStore, InMemoryVectorStore]: new vector store and concate vector store
+            VectorStore: new vector store
         """
-        BATCH_SIZE = self.config.preprocessing.BATCH_SIZE
         # initialize the vector store
-        vector_store = InMemoryVectorStore(self.embedding_model)
-        for batch in tqdm(range(0, len(chunks), BATCH_SIZE)):
-            batch_chunks = chunks[batch:batch + BATCH_SIZE]
-            vector_store.add_documents(documents=batch_chunks)
-            if isconcate:
-                concate_vector_store.add_documents(documents=batch_chunks)
-        return (vector_store, concate_vector_store)
-            
+        vector_store = self.new_vector_store()
+        start = time.perf_counter()
+        batches = 0
+        for rows, vectors in self.embedding_executor.map([chunk.page_content for chunk in chunks]):
+            batch_chunks = [chunks[row] for row in rows]
+            ids = [str(uuid.uuid4()) for _ in batch_chunks]
+            # the chunks keep the ids of their vectors, the lexical indexes refer to them
+            for chunk, chunk_id in zip(batch_chunks, ids):
+                chunk.id = chunk_id
+            self.add_embeddings(vector_store, batch_chunks, vectors, ids)
+            batches += 1
+        if chunks:
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"Embedded {len(chunks)} chunks in {batches} batches, {elapsed:.2f}s "
+                f"({len(chunks) / elapsed:.1f} chunks/s, batch budget {self.embedding_executor.batch_tokens} tokens)"
+            )
+        return vector_store
+
+    def bm25_index_path(self, document_path: Path) -> Path:
+        """
+        Returns:
+            Path: The path of the BM25 index of the documents of a file saved at document_path
+        """
+        return Path(document_path).with_suffix(".bm25.npz")
 
+    def load_bm25_index(
+        self, document_path: Path,
+        documents: ChunkStore,
+        vector_db: Optional[VectorStore] = None,
+    ) -> BM25Index:
+        """
+        Load the BM25 index of the documents, building and saving it if it does not exist yet.
+        The index of the corpus is merged from the postings of its segments.
+        Args:
+            document_path (Path): The path of the documents
+            documents (ChunkStore): The documents
+            vector_db (Optional[VectorStore]): The vector store of the documents
+        Returns:
+            BM25Index: The BM25 index
+        """
+        if isinstance(vector_db, SegmentedVectorStore):
+            return vector_db.bm25_index()
+        index_path = self.bm25_index_path(document_path)
+        if os.path.exists(index_path):
+            return BM25Index.load(index_path)
+        logger.info(f"Building BM25 index for {document_path}")
+        index = BM25Index.from_documents(list(documents.documents()))
+        if documents:
+            index.save(index_path)
+        return index
 
-        
-    def create_vector_store(self, files: List[File], isconcate:bool=True):
+    def load_chunk_texts(self, document_path: Path, documents: ChunkStore):
         """
-        Create the vector store for the files
+        Add the documents missing from the full-text index, for stores ingested
+        before the index existed (files may have been appended to them since)
         Args:
-            files (List[File]): The list of files (documents) to create the vector store
-            isconcate (bool): If True then add new documents to the previous vector store
-        
-        """
-        # file data to stucture of Document data
-        documents = [Document(file.content, metadata={"source": file.name}) for file in files]
-        for document in documents:
-            file_name = document.metadata["source"]
-            uid = shortuuid.uuid()
-            logger.info(f"Processing {file_name}")
-            vector_db_path = os.path.join(
-                self.config.vector_store.VECTOR_STORE_DIR,
-                f"{uid}.db"
+            document_path (Path): The path of the documents
+            documents (ChunkStore): The documents
+        """
+        store = str(document_path)
+        if not documents or self.database.count_chunk_texts(store) >= len(documents):
+            return
+        indexed = self.database.get_chunk_text_ids(store)
+        missing = [row for row, chunk_id in enumerate(documents.ids) if chunk_id not in indexed]
+        logger.info(f"Adding {len(missing)} chunks to the full-text index of {document_path}")
+        self.database.insert_chunk_texts(
+            store,
+            ((documents.ids[row], documents.text(row)) for row in missing)
+        )
+
+    def migrate_legacy_corpus(self):
+        """
+        Import the corpus of earlier versions, a single store saved at the paths
+        the concatenate.pdf row still points at, as the first segment of the
+        segmented corpus, then point its rows at the configured corpus
+        """
+        vector_path = self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH
+        document_path = self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH
+        rows = self.database.get_data()
+        legacy = next((row for row in rows if row["name"] == "concatenate.pdf"), None)
+        if legacy is None or (legacy["vector_path"], legacy["document_path"]) == (str(vector_path), str(document_path)):
+            return
+        corpus = SegmentedVectorStore(vector_path, self.embedding_model, self.config.ann)
+        # the segment is already there if an earlier migration stopped before the rows were updated
+        if LEGACY_SEGMENT in corpus.segment_names:
+            chunks = dict(zip(corpus.segment_names, corpus.segments))[LEGACY_SEGMENT].documents()
+        elif os.path.exists(legacy["vector_path"]) or NumpyVectorStore.exists(legacy["vector_path"]):
+            vector_store = self.load_vector_store(legacy["vector_path"])
+            if not isinstance(vector_store, NumpyVectorStore):
+                vector_store = NumpyVectorStore.from_in_memory(vector_store, self.config.ann)
+            logger.info(f"Importing the corpus {legacy['vector_path']} ({len(vector_store)} chunks) into {vector_path}")
+            chunks = vector_store.documents()
+            self.concatenate_vector_store(vector_store, chunks, segment_name=LEGACY_SEGMENT)
+        else:
+            chunks = []
+        legacy_paths = (legacy["vector_path"], legacy["document_path"])
+        legacy_rows = [row for row in rows if (row["vector_path"], row["document_path"]) == legacy_paths]
+        document_ids = {row["name"]: row["id"] for row in legacy_rows if row["id"] != legacy["id"]}
+        for name, document_id in document_ids.items():
+            # files searched through the corpus are scoped to the chunks of their source
+            self.database.insert_document_chunks(
+                document_id, [chunk.id for chunk in chunks if chunk.metadata.get("source") == name]
             )
-            document_path = os.path.join(
-                self.config.vector_store.DOCUMENT_STORE_DIR,
-                f"{uid}.pkl"
+        # recorded like the chunks of new files, so uploading an old file again reuses them
+        chunk_hashes: Dict[int, List[tuple[str, str]]] = {}
+        for chunk in chunks:
+            document_id = document_ids.get(chunk.metadata.get("source"), legacy["id"])
+            chunk_hashes.setdefault(document_id, []).append((self.legacy_chunk_hash(chunk), chunk.id))
+        for document_id, hashes in chunk_hashes.items():
+            self.database.insert_chunks(document_id, hashes)
+        for row in legacy_rows:
+            self.database.update_data(row["id"], str(vector_path), str(document_path))
+        logger.info(f"Moved the rows of {legacy['vector_path']} to {vector_path}")
+
+    def concatenate_vector_store(self, vector_store: VectorStore, chunks: List[Document], segment_name: Optional[str] = None):
+        """
+        Append the vectors of a file to the concatenated store as a new segment,
+        add its chunks to the lexical index of the corpus (the full-text index,
+        or BM25 postings saved with the segment), then merge small segments in the background
+        Args:
+            vector_store (VectorStore): The vector store of the file
+            chunks (List[Document]): The chunks of the file
+            segment_name (Optional[str]): The name of the segment, a new unique one if None;
+                a named segment is listed before the others
+        """
+        concate_vector_store = SegmentedVectorStore(
+            self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH,
+            self.embedding_model,
+            self.config.ann
+        )
+        if not isinstance(vector_store, NumpyVectorStore):
+            vector_store = NumpyVectorStore.from_in_memory(vector_store, self.config.ann)
+        first = segment_name is not None
+        segment_name = segment_name or concate_vector_store.new_segment_name()
+        if not self.use_fts:
+            # written before the segment is listed, so readers of the manifest find the postings
+            BM25Index.from_documents(chunks).save(concate_vector_store.bm25_path(segment_name))
+        concate_vector_store.add_segment(vector_store, segment_name, first=first)
+        with concate_vector_store.lock:
+            chunk_store_path = self.chunk_store_path(self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH)
+            if ChunkStore.exists(chunk_store_path):
+                ChunkStore.append(chunk_store_path, chunks)
+            else:
+                # first chunk store of the corpus, with the chunks of the earlier segments
+                ChunkStore.write(chunk_store_path, concate_vector_store.documents())
+        if self.use_fts:
+            self.database.insert_chunk_texts(
+                str(self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH),
+                [(chunk.id, chunk.page_content) for chunk in chunks]
             )
-            # create chunks of the document
-            chunks = self.create_chunks(document)
-            # load previous vector store if exists
-            concate_vector_store = self.load_vector_store(
-                self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH
+        self.invalidate_retrievers(self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+        concate_vector_store.compact_in_background(
+            self.config.vector_store.COMPACT_MIN_SEGMENT_SIZE,
+            self.config.vector_store.COMPACT_MIN_SEGMENTS,
+        )
+
+    @staticmethod
+    def chunk_hash(chunk: Document) -> str:
+        return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+    def legacy_chunk_hash(self, chunk: Document) -> str:
+        """
+        Returns:
+            str: The content hash of a chunk of earlier versions, which saved
+                contextualized chunks as their context, a blank line and the chunk
+        """
+        text = chunk.page_content
+        if self.config.preprocessing.CONTEXTUALIZE_CHUNKS:
+            text = text.split("\n\n", 1)[-1]
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _chunk(self, job: IngestionJob, known_chunks: Dict[str, str], corpus: Optional[VectorStore]) -> IngestionJob:
+        """
+        Split the file into chunks; streamed files are split while their pages
+        are extracted, so the pages are never all in memory. The text of the
+        file is kept only when the context strategy shows the whole document.
+        """
+        metadata = {"source": job.file.name}
+        keep_text = self.config.preprocessing.CONTEXTUALIZE_CHUNKS and self.contextualizer.needs_document
+        if job.file.pages is None:
+            if keep_text:
+                job.text = job.file.content
+            chunks = self.text_splitter.split_documents([Document(job.file.content, metadata=metadata)])
+        else:
+            texts = []
+
+            def pages() -> Iterator[Page]:
+                for page in job.file.pages:
+                    if keep_text:
+                        texts.append(page.text)
+                    yield page
+
+            chunks = list(self.split_pages(pages(), metadata))
+            job.text = "".join(texts)
+            job.file.pages = None
+
+        # chunks already in the corpus are reused with their context and vector
+        hashes = [self.chunk_hash(chunk) for chunk in chunks]
+        found = {}
+        if corpus is not None:
+            wanted = [known_chunks[h] for h in set(hashes) if h in known_chunks]
+            found = {document.id: (document, vector) for document, vector in corpus.get_by_ids(wanted)}
+        seen = set()
+        for chunk, chunk_hash in zip(chunks, hashes):
+            if chunk_hash in seen:
+                continue
+            seen.add(chunk_hash)
+            chunk_id = known_chunks.get(chunk_hash)
+            if chunk_id in found:
+                document, vector = found[chunk_id]
+                job.reused.append((Document(id=chunk_id, page_content=document.page_content, metadata=chunk.metadata), vector))
+            else:
+                job.chunks.append(chunk)
+                job.chunk_hashes.append(chunk_hash)
+        if job.reused or len(seen) < len(chunks):
+            logger.info(
+                f"{job.file.name}: {len(chunks)} chunks, {len(chunks) - len(seen)} duplicates, "
+                f"{len(job.reused)} reused from the corpus"
+            )
+        return job
+
+    def _contextualize(self, job: IngestionJob, stats: ContextStats) -> IngestionJob:
+        if self.config.preprocessing.CONTEXTUALIZE_CHUNKS and job.chunks:
+            job.chunks = self.contextualize_chunks(job.text, job.chunks, stats)
+        job.text = ""
+        return job
+
+    def _embed(self, job: IngestionJob) -> IngestionJob:
+        job.vector_store = self.create_embeddings(job.chunks)
+        return job
+
+    def _drop_duplicates(self, job: IngestionJob, persisted_chunks: Dict[str, str]):
+        """
+        Rebind the new chunks of a file that an earlier file of the same run
+        already added to the corpus to the chunk of that file, and drop their vectors
+        Args:
+            job (IngestionJob): The embedded file
+            persisted_chunks (Dict[str, str]): The id of every chunk the run added to the corpus, by content hash
+        """
+        duplicates = [i for i, chunk_hash in enumerate(job.chunk_hashes) if chunk_hash in persisted_chunks]
+        if not duplicates:
+            return
+        for i in duplicates:
+            chunk = job.chunks[i]
+            job.reused.append((Document(id=persisted_chunks[job.chunk_hashes[i]], page_content=chunk.page_content, metadata=chunk.metadata), None))
+        duplicates = set(duplicates)
+        job.chunks = [chunk for i, chunk in enumerate(job.chunks) if i not in duplicates]
+        job.chunk_hashes = [chunk_hash for i, chunk_hash in enumerate(job.chunk_hashes) if i not in duplicates]
+        vector_store = job.vector_store
+        if not isinstance(vector_store, NumpyVectorStore):
+            vector_store = NumpyVectorStore.from_in_memory(vector_store, self.config.ann)
+        kept = vector_store.get_by_ids([chunk.id for chunk in job.chunks])
+        job.vector_store = NumpyVectorStore(self.embedding_model, ann_config=self.config.ann)
+        job.vector_store.add_embeddings(
+            [document.page_content for document, _ in kept],
+            [vector for _, vector in kept],
+            [document.metadata for document, _ in kept],
+            [document.id for document, _ in kept],
+        )
+        logger.info(f"{job.file.name}: {len(duplicates)} chunks shared with files ingested before it in the same run")
+
+    def _persist(self, job: IngestionJob, isconcate: bool, persisted_chunks: Dict[str, str]):
+        if isconcate:
+            self._drop_duplicates(job, persisted_chunks)
+        chunks = job.chunks + [document for document, _ in job.reused]
+        if isconcate:
+            # the file is searched through the corpus, scoped to its chunks;
+            # only the new chunks are added, the reused ones are already there
+            if job.chunks:
+                self.concatenate_vector_store(job.vector_store, job.chunks)
+            document_id = self.database.insert_data(
+                job.file.name,
+                self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH,
+                self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH,
+                job.file.content_hash,
             )
-            # load previous document if exists
-            if isconcate:
-                concate_documents = self.load_document(self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH)
-                concate_documents.extend(chunks)
-                self.save_document(concate_documents, self.config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH)
-            # create embeddings for the chunks
-            vectore_store, concate_vector_store = self.create_embeddings(
-                chunks,
-                concate_vector_store,
-                isconcate
+            self.database.insert_chunks(
+                document_id,
+                zip(job.chunk_hashes, [chunk.id for chunk in job.chunks])
             )
-            # save the data to the database
-            if isconcate:
-                self.save_vector_store(concate_vector_store, self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
-            
-            self.save_vector_store(vectore_store, vector_db_path)
-            self.save_document(chunks, document_path)
-            # insert the data to the database
-            self.database.insert_data(file_name,document_path, vector_db_path)
-            logger.info(f"Processed {file_name}")
+            self.database.insert_document_chunks(document_id, [chunk.id for chunk in chunks])
+            persisted_chunks.update(zip(job.chunk_hashes, [chunk.id for chunk in job.chunks]))
+            return
 
-    def get_retriever(self, document_path:Path, vector_db_path:Path) -> BaseRetriever:
+        uid = shortuuid.uuid()
+        vector_db_path = os.path.join(
+            self.config.vector_store.VECTOR_STORE_DIR,
+            f"{uid}.db"
+        )
+        document_path = os.path.join(
+            self.config.vector_store.DOCUMENT_STORE_DIR,
+            f"{uid}.chunks"
+        )
+        self.save_vector_store(job.vector_store, vector_db_path)
+        self.save_document(chunks, document_path)
+        if self.use_fts:
+            self.database.insert_chunk_texts(document_path, [(chunk.id, chunk.page_content) for chunk in chunks])
+        else:
+            BM25Index.from_documents(chunks).save(self.bm25_index_path(document_path))
+        # insert the data to the database
+        self.database.insert_data(job.file.name, document_path, vector_db_path, job.file.content_hash)
+
+    def create_vector_store(self, files: List[File], isconcate:bool=True) -> dict:
         """
-        Get the retriever
+        Create the vector store for the files.
+        The files go through a pipeline of chunking (pages are extracted while
+        they are split), contextualization and embedding stages, each with its own workers, so several files are
+        processed at once; they are persisted one at a time in the calling thread.
+        Files already ingested (same content hash) are skipped, chunks already in
+        the corpus are reused instead of being contextualized and embedded again.
         Args:
-            docid (int): The id of the document
+            files (List[File]): The list of files (documents) to create the vector store
+            isconcate (bool): If True the files are added to the corpus and searched through it,
+                otherwise every file gets a store of its own
         Returns:
-            BaseRetriever: The retriever based on the given docid
+            dict: The items, busy seconds and throughput of every stage
         """
+        new_files, hashes = [], set()
+        for file in files:
+            if file.content_hash is not None:
+                if file.content_hash in hashes or self.database.find_document(file.content_hash):
+                    logger.info(f"Skipping {file.name}, a file with the same content is already ingested")
+                    continue
+                hashes.add(file.content_hash)
+            new_files.append(file)
 
-        vector_db = self.load_vector_store(vector_db_path)
-        documents = self.load_document(document_path)
-        if documents is None:
-            raise ValueError("Document not found")
+        known_chunks, corpus = {}, None
+        if isconcate:
+            known_chunks = self.database.get_chunk_ids()
+            if known_chunks:
+                corpus = self.load_vector_store(self.config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
 
-        semantic_retriever = vector_db.as_retriever(
-            search_kwargs={
-                "k": self.config.preprocessing.N_SEMANTIC_RESULTS
-            }
+        context_stats = ContextStats(self.contextualizer.strategy)
+        workers = self.config.ingestion
+        pipeline = Pipeline(
+            [
+                Stage("chunk", partial(self._chunk, known_chunks=known_chunks, corpus=corpus), workers.CHUNK_WORKERS),
+                Stage("contextualize", partial(self._contextualize, stats=context_stats), workers.CONTEXT_WORKERS),
+                Stage("embed", self._embed, workers.EMBED_WORKERS),
+            ],
+            queue_size=workers.QUEUE_SIZE,
         )
-        bm25_retriever = BM25Retriever.from_documents(documents)
-        bm25_retriever.k =  self.config.preprocessing.N_BM25_RESULTS
+        failures = []
+        persisted, persist_seconds = 0, 0.0
+        # chunks added to the corpus by this run, the files of a run share chunks too
+        persisted_chunks: Dict[str, str] = {}
+        for file in new_files:
+            logger.info(f"Processing {file.name}")
+        for job in pipeline.run(IngestionJob(file) for file in new_files):
+            if isinstance(job, StageFailure):
+                logger.error(f"Failed to {job.stage} {job.item.file.name}: {job.error}")
+                failures.append(job)
+                continue
+            start = time.perf_counter()
+            try:
+                self._persist(job, isconcate, persisted_chunks)
+            except Exception as e:
+                logger.error(f"Failed to persist {job.file.name}: {e}")
+                failures.append(StageFailure("persist", job, e))
+                continue
+            seconds = time.perf_counter() - start
+            METRICS.observe("ingest_persist", seconds)
+            persist_seconds += seconds
+            persisted += 1
+            logger.info(f"Processed {job.file.name}")
+
+        report = pipeline.report()
+        report["persist"] = {
+            "items": persisted,
+            "busy_seconds": round(persist_seconds, 3),
+            "items_per_second": round(persisted / pipeline.wall_seconds, 3) if pipeline.wall_seconds else 0.0,
+        }
+        if self.config.preprocessing.CONTEXTUALIZE_CHUNKS:
+            report["contextualize"]["tokens"] = context_stats.as_dict()
+        logger.info(f"Ingested {persisted}/{len(new_files)} new files in {pipeline.wall_seconds:.2f}s: {report}")
+        if failures:
+            raise failures[0].error
+        return report
 
-        ensemble_retriever = EnsembleRetriever(
+    def invalidate_retrievers(self, path: Path):
+        """
+        Drop the cached stores of retrievers loaded from the store saved at path
+        Args:
+            path (Path): The document or vector path of the store
+        """
+        dropped = RETRIEVER_CACHE.invalidate(lambda key: str(path) in (str(key[0]), str(key[1])))
+        if dropped:
+            logger.info(f"Invalidated {dropped} cached retrievers of {path}")
+
+    def retriever_size(self, vector_db: VectorStore, documents: ChunkStore, bm25_index: Optional[BM25Index]) -> int:
+        """
+        Returns:
+            int: The estimated memory used by a retriever, in bytes
+        """
+        text_size = int(documents.offsets[-1])
+        if isinstance(vector_db, SegmentedVectorStore):
+            vector_size = sum(segment.vectors.nbytes for segment in vector_db.segments)
+        elif isinstance(vector_db, NumpyVectorStore):
+            vector_size = vector_db.vectors.nbytes
+        else:
+            # a python float in a list takes about 32 bytes
+            vector_size = sum(len(record["vector"]) * 32 for record in vector_db.store.values())
+        bm25_size = 0
+        if bm25_index is not None:
+            bm25_size = bm25_index.postings_docs.nbytes + bm25_index.postings_freqs.nbytes
+        # the texts are held by the vector store, the chunk store reads them from disk
+        return text_size + documents.nbytes + vector_size + bm25_size
+
+    def get_retriever(
+        self, document_path:Path,
+        vector_db_path:Path,
+        light_reranker: Optional[bool] = None,
+        document_ids: Optional[List[int]] = None,
+    ) -> BaseRetriever:
+        """
+        Get the retriever. The loaded stores are cached while their files are unchanged,
+        so retrievers scoped to different documents of the corpus share them.
+        Args:
+            document_path (Path): The path of the documents
+            vector_db_path (Path): The path of the vector store
+            light_reranker (Optional[bool]): Rerank with the light model, defaults to USE_LIGHT_RERANKER
+            document_ids (Optional[List[int]]): Search only the chunks of these documents, None to search everything
+        Returns:
+            BaseRetriever: The retriever based on the given store
+        """
+        if light_reranker is None:
+            light_reranker = self.config.preprocessing.USE_LIGHT_RERANKER
+        key = (
+            str(document_path), str(vector_db_path),
+            store_version(document_path), store_version(vector_db_path),
+        )
+        data = RETRIEVER_CACHE.get(key)
+        if data is None:
+            # entries of older versions of the same store can never be hit again
+            RETRIEVER_CACHE.invalidate(lambda cached: cached[:2] == key[:2])
+            data, size = self.load_retrieval_data(document_path, vector_db_path)
+            # loading may have written a missing BM25 index
+            key = key[:2] + (store_version(document_path), store_version(vector_db_path))
+            RETRIEVER_CACHE.put(key, data, size)
+            logger.info(f"Retriever cache: {RETRIEVER_CACHE.stats()}")
+        chunk_ids = None
+        if document_ids is not None:
+            chunk_ids = frozenset(self.database.get_document_chunk_ids(document_ids))
+        return self.create_retriever(data, light_reranker, chunk_ids, document_ids)
+
+    def load_retrieval_data(self, document_path:Path, vector_db_path:Path) -> tuple[RetrievalData, int]:
+        """
+        Load the stores a retriever searches
+        Args:
+            document_path (Path): The path of the documents
+            vector_db_path (Path): The path of the vector store
+        Returns:
+            tuple[RetrievalData, int]: The stores and their estimated size in bytes
+        """
+        vector_db = self.load_vector_store(vector_db_path)
+        documents = self.load_document(document_path, vector_db)
+        if self.use_fts:
+            self.load_chunk_texts(document_path, documents)
+            bm25_index = None
+        else:
+            bm25_index = self.load_bm25_index(document_path, documents, vector_db)
+        data = RetrievalData(
+            vector_db=vector_db,
+            documents=documents,
+            bm25_index=bm25_index,
+            store=str(document_path),
+        )
+        return data, self.retriever_size(vector_db, documents, bm25_index)
+
+    def create_retriever(
+        self, data: RetrievalData,
+        light_reranker: bool = False,
+        chunk_ids: Optional[frozenset] = None,
+        document_ids: Optional[List[int]] = None,
+    ) -> BaseRetriever:
+        """
+        Create the retriever
+        Args:
+            data (RetrievalData): The stores to search
+            light_reranker (bool): Rerank with the light model
+            chunk_ids (Optional[frozenset]): Search only the chunks with these ids, None to search everything
+            document_ids (Optional[List[int]]): The documents of these chunks, which scope the full-text search
+        Returns:
+            BaseRetriever: The retriever
+        """
+        search_kwargs = {"k": self.config.preprocessing.N_SEMANTIC_RESULTS}
+        if chunk_ids is not None:
+            if isinstance(data.vector_db, (NumpyVectorStore, SegmentedVectorStore)):
+                search_kwargs["chunk_ids"] = chunk_ids
+            else:
+                search_kwargs["filter"] = lambda document: document.id in chunk_ids
+        semantic_retriever = data.vector_db.as_retriever(search_kwargs=search_kwargs)
+        if data.bm25_index is None:
+            bm25_retriever = FTSIndexRetriever(
+                database=self.database,
+                store=data.store,
+                documents=data.documents,
+                k=self.config.preprocessing.N_BM25_RESULTS,
+                document_ids=None if chunk_ids is None else list(document_ids),
+            )
+        else:
+            bm25_retriever = BM25IndexRetriever(
+                index=data.bm25_index,
+                documents=data.documents,
+                k=self.config.preprocessing.N_BM25_RESULTS,
+                rows=None if chunk_ids is None else data.bm25_index.rows_of(chunk_ids),
+            )
+
+        hybrid_retriever = HybridRetriever(
             retrievers=[semantic_retriever, bm25_retriever],
-            weights=[0.6, 0.4],
+            weights=[
+                self.config.preprocessing.SEMANTIC_WEIGHT,
+                self.config.preprocessing.BM25_WEIGHT,
+            ],
+            c=self.config.preprocessing.RRF_K,
+            names=["vector_search", "bm25"],
         )
 
         logger.info("Retriever created")
 
-        return ContextualCompressionRetriever(
-            base_compressor = self.reranker,
-            base_retriever=ensemble_retriever
-        )
\ No newline at end of file
+        retriever = ContextualCompressionRetriever(
+            base_compressor = self.get_reranker(light_reranker),
+            base_retriever=hybrid_retriever
+        )
+        return retriever
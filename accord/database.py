@@ -1,34 +1,88 @@
 import sqlite3
 import os
+import queue
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
 from accord import logger
-from accord.utils import get_config
+from accord.registry import REGISTRY
+
+
+class ConnectionPool:
+    """
+    SQLite connections in WAL mode shared by the threads of the process
+    (streamlit sessions, retriever and ingestion workers): readers do not
+    block the writer and every statement runs on a connection of its own.
+    """
+
+    def __init__(self, path: Path, size: int, busy_timeout: float):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.connections: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self.connections.put(None)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL;")
+        # durable at every checkpoint, enough for data that can be ingested again
+        connection.execute("PRAGMA synchronous=NORMAL;")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection, waiting for one when they are all in use; the
+        statements run in one transaction committed when the block exits
+        """
+        connection = self.connections.get()
+        try:
+            if connection is None:
+                connection = self._connect()
+            with connection:
+                yield connection
+        finally:
+            self.connections.put(connection)
+
+    def close(self):
+        while not self.connections.empty():
+            connection = self.connections.get_nowait()
+            if connection is not None:
+                connection.close()
+
 
 class Database:
-    def __init__(self):
-        self.connection = sqlite3.connect(Path("accord.db"))
-        self.crsr = self.connection.cursor()
-        self.config = get_config()
+    def __init__(self, path: Path = Path("accord.db"), config=None):
+        self.config = config or REGISTRY.config
+        self.pool = ConnectionPool(path, self.config.database.POOL_SIZE, self.config.database.BUSY_TIMEOUT_SECONDS)
+        self.fts_available = True
 
 
     def create_table(self):
-        # Check if table already exists
-        self.crsr.execute("""
-            SELECT name FROM sqlite_master WHERE type='table' AND name='document';
-        """)
-        
-        if self.crsr.fetchone():  # If table exists, return
+        with self.pool.connection() as connection:
+            # Check if table already exists
+            exists = connection.execute("""
+                SELECT name FROM sqlite_master WHERE type='table' AND name='document';
+            """).fetchone()
+
+        if exists:  # If table exists, return
             logger.info("Table 'document' already exists.")
+            self.create_hash_tables()
+            self.create_chunk_text_table()
             return
-        
+
         # SQL command to create a table in the database
-        sql_command = """CREATE TABLE document ( 
-        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+        sql_command = """CREATE TABLE document (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         document_path TEXT NOT NULL,
-        vector_path TEXT NOT NULL);"""
+        vector_path TEXT NOT NULL,
+        content_hash TEXT);"""
         # execute the statement
-        self.crsr.execute(sql_command)
+        with self.pool.connection() as connection:
+            connection.execute(sql_command)
+        self.create_hash_tables()
+        self.create_chunk_text_table()
 
         self.insert_data(
             'concatenate.pdf',
@@ -37,46 +91,196 @@ class Database:
         )
         logger.info("Table created successfully")
 
+    def create_hash_tables(self):
+        """
+        Add the content hash of the files to the document table, for tables
+        created before it existed, and create the table of the chunk hashes
+        """
+        with self.pool.connection() as connection:
+            columns = [column[1] for column in connection.execute("""PRAGMA table_info(document);""")]
+            if "content_hash" not in columns:
+                connection.execute("""ALTER TABLE document ADD COLUMN content_hash TEXT;""")
+            connection.execute("""CREATE INDEX IF NOT EXISTS document_content_hash ON document (content_hash);""")
+            # every chunk text of the corpus once, with the id of its vector
+            connection.execute("""CREATE TABLE IF NOT EXISTS chunk (
+            content_hash TEXT PRIMARY KEY,
+            chunk_id TEXT NOT NULL,
+            document_id INTEGER NOT NULL REFERENCES document (id));""")
+            # the corpus chunks of every document, shared chunks belong to several documents
+            connection.execute("""CREATE TABLE IF NOT EXISTS document_chunk (
+            document_id INTEGER NOT NULL REFERENCES document (id),
+            chunk_id TEXT NOT NULL,
+            PRIMARY KEY (document_id, chunk_id));""")
+            # scoped lexical search looks documents up by chunk
+            connection.execute("""CREATE INDEX IF NOT EXISTS document_chunk_chunk_id ON document_chunk (chunk_id);""")
+            connection.execute("""CREATE INDEX IF NOT EXISTS chunk_document_id ON chunk (document_id);""")
 
+    def create_chunk_text_table(self):
+        """
+        Create the full-text index of the chunk texts, searched with the bm25
+        ranking of FTS5; store is the document path of the store holding the chunk
+        """
+        try:
+            with self.pool.connection() as connection:
+                connection.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5 (
+                chunk_id UNINDEXED,
+                store UNINDEXED,
+                content,
+                tokenize = 'unicode61 remove_diacritics 2');""")
+        except sqlite3.OperationalError as e:
+            # sqlite built without FTS5, the BM25 index files are used instead
+            self.fts_available = False
+            logger.warning(f"Full-text search is not available: {e}")
 
-    def insert_data(self, file_name:str, document_path:str, vector_path:str):
+    def insert_data(self, file_name:str, document_path:str, vector_path:str, content_hash:Optional[str]=None) -> int:
         # SQL command to insert the data in the table
-        sql_command = """INSERT INTO document (name, document_path, vector_path) VALUES (?, ?, ?);"""
-        # execute the statement
-        self.crsr.execute(sql_command, (file_name, document_path, vector_path))
-        # commit the statement
-        self.connection.commit()
+        sql_command = """INSERT INTO document (name, document_path, vector_path, content_hash) VALUES (?, ?, ?, ?);"""
+        # execute the statement, committed when the connection is returned
+        with self.pool.connection() as connection:
+            return connection.execute(sql_command, (file_name, document_path, vector_path, content_hash)).lastrowid
+
+    def find_document(self, content_hash:str) -> Optional[dict]:
+        """
+        Args:
+            content_hash (str): The content hash of a file
+        Returns:
+            Optional[dict]: The document ingested from a file with the same content, if any
+        """
+        sql_command = """SELECT id, name, document_path, vector_path FROM document WHERE content_hash = ? LIMIT 1;"""
+        with self.pool.connection() as connection:
+            row = connection.execute(sql_command, (content_hash,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "name": row[1], "document_path": row[2], "vector_path": row[3]}
 
-    def update_data(self, id:int, vector_path:str):
+    def insert_chunks(self, document_id:int, chunk_hashes:Iterable[tuple[str, str]]):
+        """
+        Record the chunks a document added to the corpus
+        Args:
+            document_id (int): The id of the document
+            chunk_hashes (Iterable[tuple[str, str]]): The content hash and id of every chunk
+        """
+        sql_command = """INSERT OR IGNORE INTO chunk (content_hash, chunk_id, document_id) VALUES (?, ?, ?);"""
+        with self.pool.connection() as connection:
+            connection.executemany(
+                sql_command,
+                [(content_hash, chunk_id, document_id) for content_hash, chunk_id in chunk_hashes]
+            )
+
+    def insert_document_chunks(self, document_id:int, chunk_ids:Iterable[str]):
+        """
+        Record which corpus chunks hold the content of a document
+        Args:
+            document_id (int): The id of the document
+            chunk_ids (Iterable[str]): The ids of its chunks in the corpus
+        """
+        sql_command = """INSERT OR IGNORE INTO document_chunk (document_id, chunk_id) VALUES (?, ?);"""
+        with self.pool.connection() as connection:
+            connection.executemany(sql_command, [(document_id, chunk_id) for chunk_id in chunk_ids])
+
+    def get_document_chunk_ids(self, document_ids:List[int]) -> List[str]:
+        """
+        Args:
+            document_ids (List[int]): The ids of the documents
+        Returns:
+            List[str]: The ids of the corpus chunks of the documents
+        """
+        placeholders = ", ".join("?" for _ in document_ids)
+        sql_command = f"""SELECT DISTINCT chunk_id FROM document_chunk WHERE document_id IN ({placeholders});"""
+        with self.pool.connection() as connection:
+            return [row[0] for row in connection.execute(sql_command, list(document_ids))]
+
+    def get_chunk_ids(self) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: The id of the corpus chunk of every content hash
+        """
+        with self.pool.connection() as connection:
+            return dict(connection.execute("""SELECT content_hash, chunk_id FROM chunk;"""))
+
+    def insert_chunk_texts(self, store:str, chunks:Iterable[tuple[str, str]]):
+        """
+        Add chunks to the full-text index
+        Args:
+            store (str): The document path of the store holding the chunks
+            chunks (Iterable[tuple[str, str]]): The id and text of every chunk
+        """
+        sql_command = """INSERT INTO chunk_text (chunk_id, store, content) VALUES (?, ?, ?);"""
+        with self.pool.connection() as connection:
+            connection.executemany(sql_command, [(chunk_id, store, content) for chunk_id, content in chunks])
+
+    def count_chunk_texts(self, store:str) -> int:
+        with self.pool.connection() as connection:
+            return connection.execute("""SELECT COUNT(*) FROM chunk_text WHERE store = ?;""", (store,)).fetchone()[0]
+
+    def get_chunk_text_ids(self, store:str) -> set[str]:
+        """
+        Returns:
+            set[str]: The ids of the chunks of a store in the full-text index
+        """
+        with self.pool.connection() as connection:
+            return {row[0] for row in connection.execute("""SELECT chunk_id FROM chunk_text WHERE store = ?;""", (store,))}
+
+    def search_chunk_texts(
+        self, store:str,
+        match:str,
+        k:int,
+        document_ids:Optional[List[int]] = None,
+    ) -> List[tuple[str, float]]:
+        """
+        Rank the chunks of a store with the bm25 function of FTS5
+        Args:
+            store (str): The document path of the store
+            match (str): The FTS5 query
+            k (int): The number of chunks to return
+            document_ids (Optional[List[int]]): Search only the chunks of these documents, None to search everything
+        Returns:
+            List[tuple[str, float]]: The ids and scores of the chunks, best first
+        """
+        # bm25() is lower for better matches
+        sql_command = """SELECT chunk_id, -bm25(chunk_text) FROM chunk_text WHERE chunk_text MATCH ? AND store = ?"""
+        parameters = [match, store]
+        if document_ids is not None:
+            placeholders = ", ".join("?" for _ in document_ids)
+            sql_command += f""" AND chunk_id IN (
+            SELECT chunk_id FROM document_chunk WHERE document_id IN ({placeholders}))"""
+            parameters.extend(document_ids)
+        sql_command += """ ORDER BY bm25(chunk_text) LIMIT ?;"""
+        parameters.append(k)
+        with self.pool.connection() as connection:
+            return connection.execute(sql_command, parameters).fetchall()
+
+    def update_data(self, id:int, vector_path:str, document_path:Optional[str]=None):
         # SQL command to update the data in the table
-        sql_command = f"""UPDATE document SET vector_path = "{vector_path}" WHERE id = {id};"""
-        # execute the statement
-        self.crsr.execute(sql_command)
-        # commit the statement
-        self.connection.commit()
+        if document_path is None:
+            sql_command, parameters = """UPDATE document SET vector_path = ? WHERE id = ?;""", (vector_path, id)
+        else:
+            sql_command = """UPDATE document SET vector_path = ?, document_path = ? WHERE id = ?;"""
+            parameters = (vector_path, document_path, id)
+        # execute the statement, committed when the connection is returned
+        with self.pool.connection() as connection:
+            connection.execute(sql_command, parameters)
 
 
     def get_data(self):
         # SQL command to fetch data from the table
-        sql_command = """SELECT * FROM document;"""
+        sql_command = """SELECT id, name, document_path, vector_path FROM document;"""
         # execute the statement
-        self.crsr.execute(sql_command)
-        # store all the fetched data in the ans variable
-        ans = self.crsr.fetchall()
+        with self.pool.connection() as connection:
+            ans = connection.execute(sql_command).fetchall()
         # loop to print all the data
         data = [{"id":i[0], "name": i[1],"document_path": i[2], "vector_path": i[3]} for i in ans]
         return data
 
 
     def close_connection(self):
-        # close the connection
-        self.connection.close()
+        # close the connections
+        self.pool.close()
 
 
 if __name__ == "__main__":
     db = Database()
     db.create_table()
-    db.insert_data("test", "test")
+    db.insert_data("test", "test", "test")
     print(db.get_data())
     db.close_connection()
-
@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+# rough number of characters per token of the embedding tokenizers
+CHARS_PER_TOKEN = 4
+# bounds of the adaptive token budget of a batch
+MIN_BATCH_TOKENS = 256
+MAX_BATCH_TOKENS = 65536
+
+
+class EmbeddingExecutor:
+    """
+    Embeds documents on several worker threads, each with its own embedding
+    model (its own ONNX session sized by the factory); onnxruntime releases
+    the GIL while it runs, so the workers use separate cores.
+    Texts are sorted by length so a batch needs little padding, and batches
+    are cut by an estimated token budget which grows while the measured
+    throughput improves and shrinks when it drops.
+    """
+
+    def __init__(
+        self, factory: Callable[[], Embeddings],
+        workers: int,
+        min_batch_size: int,
+        max_batch_size: int,
+        batch_tokens: int,
+    ):
+        self.factory = factory
+        self.workers = workers
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_tokens = batch_tokens
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._best_rate = 0.0
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def _model(self) -> Embeddings:
+        # every worker thread loads its model on its first batch
+        if not hasattr(self._local, "model"):
+            self._local.model = self.factory()
+        return self._local.model
+
+    def _batches(self, order: np.ndarray, lengths: np.ndarray) -> Iterator[np.ndarray]:
+        start = 0
+        while start < len(order):
+            # the budget is read when the batch is cut, so later batches follow the adaptation
+            budget, tokens, end = self.batch_tokens, 0, start
+            while end < len(order) and end - start < self.max_batch_size and (
+                end - start < self.min_batch_size or tokens + lengths[order[end]] <= budget
+            ):
+                tokens += lengths[order[end]]
+                end += 1
+            yield order[start:end]
+            start = end
+
+    def _embed(self, texts: List[str], rows: np.ndarray) -> tuple[np.ndarray, List[List[float]], float]:
+        model = self._model()
+        start = time.perf_counter()
+        vectors = model.embed_documents([texts[row] for row in rows])
+        return rows, vectors, time.perf_counter() - start
+
+    def _adapt(self, tokens: int, seconds: float):
+        if seconds <= 0:
+            return
+        rate = tokens / seconds
+        with self.lock:
+            if rate >= 0.95 * self._best_rate:
+                self.batch_tokens = min(MAX_BATCH_TOKENS, int(self.batch_tokens * 1.25))
+            else:
+                self.batch_tokens = max(MIN_BATCH_TOKENS, int(self.batch_tokens * 0.8))
+            # older measurements fade, the best rate follows the current load
+            self._best_rate = max(rate, 0.9 * self._best_rate)
+
+    def map(self, texts: List[str]) -> Iterator[tuple[np.ndarray, List[List[float]]]]:
+        """
+        Embed the texts
+        Args:
+            texts (List[str]): The texts
+        Returns:
+            Iterator[tuple[np.ndarray, List[List[float]]]]: The rows of the texts of every batch
+                and their embeddings, as soon as the batch is embedded
+        """
+        lengths = np.fromiter((self.estimate_tokens(text) for text in texts), dtype=np.int64, count=len(texts))
+        order = np.argsort(lengths, kind="stable")
+        batches = self._batches(order, lengths)
+        pending = set()
+        while True:
+            # keep every worker busy with one batch queued behind it
+            for batch in batches:
+                pending.add(self.executor.submit(self._embed, texts, batch))
+                if len(pending) >= 2 * self.workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rows, vectors, seconds = future.result()
+                self._adapt(int(lengths[rows].sum()), seconds)
+                yield rows, vectors
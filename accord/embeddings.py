@@ -0,0 +1,38 @@
+import time
+from typing import List
+from langchain_core.embeddings import Embeddings
+from accord.cache import EmbeddingCache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so that every distinct text is embedded only once.
+    Document embeddings are looked up in the embedding cache first and only the
+    misses are sent to the underlying model.
+    """
+
+    def __init__(self, embedding_model: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(self.model_name, text) for text in texts]
+        cached = self.cache.get_embeddings(keys)
+        vectors = [cached.get(key) for key in keys]
+        # identical texts within the batch are embedded once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], texts[i])
+        if missing:
+            start = time.perf_counter()
+            embedded = self.embedding_model.embed_documents(list(missing.values()))
+            cost = (time.perf_counter() - start) / len(missing)
+            new_vectors = dict(zip(missing, embedded))
+            self.cache.set_embeddings((key, vector, cost) for key, vector in new_vectors.items())
+            vectors = [new_vectors[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding_model.embed_query(text)
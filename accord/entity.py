@@ -1,14 +1,25 @@
+import threading
+import uuid
 from enum import Enum
-from dataclasses import dataclass
-from typing import List, TypedDict
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional, TypedDict
 from langchain.schema import Document
 from langchain_core.messages import BaseMessage
 
 
+@dataclass
+class Page:
+    number: int
+    text: str
+
 @dataclass
 class File:
     name: str
     content: str
+    # lazily extracted pages, set instead of content when the file is streamed
+    pages: Optional[Iterator[Page]] = None
+    # sha256 of the uploaded bytes, identical uploads are ingested once
+    content_hash: Optional[str] = None
 
 class Role(Enum):
     USER = "user"
@@ -19,6 +30,67 @@ class Message:
     role: Role
     content: str
 
+@dataclass
+class ContextStats:
+    """Requests and tokens spent contextualizing chunks, shared by the threads doing it"""
+    strategy: str
+    chunks: int = 0
+    cached_contexts: int = 0
+    cached_summaries: int = 0
+    context_requests: int = 0
+    summary_requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, **counts: int):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {name: value for name, value in vars(self).items() if name != "lock"}
+
+@dataclass
+class ChatSession:
+    """The conversation of one user, the Chatbot serving it is shared by every session"""
+    session_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    # LangGraph thread of the conversation, the session id if empty
+    thread_id: str = ""
+    # the retriever of the files the user selected, None to answer without documents
+    retriever: Any = None
+    # what the retriever searches, the answer cache is keyed by it
+    retriever_scope: Optional[tuple] = None
+
+    def __post_init__(self):
+        self.thread_id = self.thread_id or self.session_id
+
+@dataclass
+class IngestionJob:
+    """A file moving through the ingestion pipeline"""
+    file: File
+    # the text of the file, only when the context strategy needs the whole document
+    text: str = ""
+    chunks: List[Document] = field(default_factory=list)
+    # content hashes of the new chunks
+    chunk_hashes: List[str] = field(default_factory=list)
+    # chunks of the corpus with the same text, reused with their vectors; the vector is
+    # None for chunks added by an earlier file of the same ingestion
+    reused: List[tuple] = field(default_factory=list)
+    vector_store: Any = None
+
+@dataclass
+class RetrievalData:
+    """The loaded stores a retriever searches, shared by retrievers of different scopes"""
+    vector_db: Any
+    # chunk id -> chunk, read lazily from the ChunkStore
+    documents: Any
+    # None when the chunks are searched with the full-text index of the database
+    bm25_index: Any
+    # document path of the store
+    store: str = ""
+
 @dataclass
 class ChunkEvent:
     content: str
@@ -32,9 +104,16 @@ class SourcesEvent:
 class FinalAnswerEvent:
     content: str
 
+@dataclass
+class TimingEvent:
+    # seconds spent in every stage of the request
+    content: dict
+
 
 class State(TypedDict):
     question: str
     chat_history: List[BaseMessage]
     context: List[Document]
-    answer: str
\ No newline at end of file
+    answer: str
+    # token counts of the prompt sent to the model
+    prompt_stats: dict
\ No newline at end of file
@@ -1,13 +1,17 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator, List
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from pypdfium2 import PdfDocument
 from docx import Document
-from accord.utils import get_config
-from accord.entity import File
+from docx.oxml.ns import qn
+from accord.registry import REGISTRY
+from accord.entity import File, Page
 
 
-config = get_config()
+config = REGISTRY.config
 
 TEXT_FILE_EXTENSION = ".txt"
 PDF_EXTENSION = ".pdf"
@@ -15,6 +19,72 @@ MD_FILE_EXTENSION = ".md"
 DOCX_EXTENSION = ".docx"
 
 
+def _page_text(pdf: PdfDocument, index: int) -> str:
+    page = pdf[index]
+    text_page = page.get_textpage()
+    text = text_page.get_text_bounded()
+    text_page.close()
+    page.close()
+    return text
+
+
+# document opened once by every extraction worker process
+_worker_pdf = None
+
+
+def _init_pdf_worker(pdf_bytes: bytes):
+    global _worker_pdf
+    _worker_pdf = PdfDocument(pdf_bytes)
+
+
+def _extract_page_range(start: int, end: int) -> List[str]:
+    return [_page_text(_worker_pdf, index) for index in range(start, end)]
+
+
+def iter_pdf_pages(file_path: Path) -> Iterator[Page]:
+    """
+    Yield the text of the pdf pages one at a time.
+    With PDF_EXTRACTION_WORKERS > 0 ranges of PDF_PAGES_PER_TASK pages are
+    extracted in a process pool; at most two ranges per worker are in flight.
+    Args:
+        file_path (Path): Path to the pdf file, or the uploaded file
+    Returns:
+    Iterator[Page]: The pages, in order
+    """
+    pdf = PdfDocument(file_path)
+    n_pages = len(pdf)
+    workers = config.documentUpload.PDF_EXTRACTION_WORKERS
+    if workers <= 0 or n_pages <= config.documentUpload.PDF_PAGES_PER_TASK:
+        try:
+            for index in range(n_pages):
+                yield Page(number=index + 1, text=_page_text(pdf, index))
+        finally:
+            pdf.close()
+        return
+    pdf.close()
+
+    if hasattr(file_path, "getvalue"):
+        pdf_bytes = file_path.getvalue()
+    else:
+        pdf_bytes = Path(file_path).read_bytes()
+    pages_per_task = config.documentUpload.PDF_PAGES_PER_TASK
+    ranges = [(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_pdf_worker,
+        initargs=(pdf_bytes,),
+    ) as executor:
+        in_flight = []
+        next_range = 0
+        while next_range < len(ranges) or in_flight:
+            while next_range < len(ranges) and len(in_flight) < 2 * workers:
+                in_flight.append((ranges[next_range][0], executor.submit(_extract_page_range, *ranges[next_range])))
+                next_range += 1
+            start, future = in_flight.pop(0)
+            for offset, text in enumerate(future.result()):
+                yield Page(number=start + offset + 1, text=text)
+
+
 def extract_pdf_content(file_path: Path) -> str:
     """
     Extract text content from pdf file
@@ -23,13 +93,37 @@ def extract_pdf_content(file_path: Path) -> str:
     Returns:
     str: Text content of the pdf file
     """
-    pdf = PdfDocument(file_path)
-    content = ""
-    for page in pdf:
-        # content += page.get_text()
-        text_page = page.get_textpage()
-        content += f"{text_page.get_text_bounded()}"
-    return content
+    return "".join(page.text for page in iter_pdf_pages(file_path))
+
+
+def _has_page_break(paragraph) -> bool:
+    for element in paragraph._p.iter(qn("w:br"), qn("w:lastRenderedPageBreak")):
+        if element.tag == qn("w:lastRenderedPageBreak") or element.get(qn("w:type")) == "page":
+            return True
+    return False
+
+
+def iter_docx_pages(file_path: Path) -> Iterator[Page]:
+    """
+    Yield the text of the docx pages one at a time.
+    Pages are delimited by explicit and rendered page breaks.
+    Args:
+        file_path (Path): Path to the docx file
+    Returns:
+    Iterator[Page]: The pages, in order
+    """
+    doc = Document(file_path)
+    number = 1
+    paragraphs = []
+    for para in doc.paragraphs:
+        if _has_page_break(para) and paragraphs:
+            yield Page(number=number, text="\n".join(paragraphs) + "\n")
+            number += 1
+            paragraphs = []
+        paragraphs.append(para.text)
+    if paragraphs:
+        yield Page(number=number, text="\n".join(paragraphs))
+
 
 def extract_docx_content(file_path: Path) -> str:
     """
@@ -39,16 +133,16 @@ def extract_docx_content(file_path: Path) -> str:
     Returns:
     str: Text content of the docx file
     """
-    doc = Document(file_path)
-    text = "\n".join([para.text for para in doc.paragraphs])
-    return text
+    return "".join(page.text for page in iter_docx_pages(file_path))
 
 
-def load_file(file_path: UploadedFile) -> File:
+def load_file(file_path: UploadedFile, stream: bool = False) -> File:
     """
     Load file content based on file extension
     Args:
         file (UploadedFile): File uploaded by user
+        stream (bool): If True the pdf and docx pages are extracted lazily,
+            the file content is left empty and File.pages yields the pages
     Raises:
         ValueError: If file extension is not allowed
     Returns:
@@ -56,7 +150,7 @@ def load_file(file_path: UploadedFile) -> File:
     """
     file_extension = Path(file_path.name).suffix
     file_name = file_path.name
-
+    content_hash = hashlib.sha256(file_path.getvalue()).hexdigest()
 
     content = ""
     if file_extension not in config.documentUpload.ALLOWED_FILE_EXTENSIONS:
@@ -64,8 +158,12 @@ def load_file(file_path: UploadedFile) -> File:
 
     if file_extension == TEXT_FILE_EXTENSION or file_extension == MD_FILE_EXTENSION:
         content = file_path.getvalue().decode("utf-8")
+    elif stream and file_extension == PDF_EXTENSION:
+        return File(name=file_name, content="", pages=iter_pdf_pages(file_path), content_hash=content_hash)
+    elif stream and file_extension == DOCX_EXTENSION:
+        return File(name=file_name, content="", pages=iter_docx_pages(file_path), content_hash=content_hash)
     elif file_extension == PDF_EXTENSION:
         content = extract_pdf_content(file_path)
     elif file_extension == DOCX_EXTENSION:
         content = extract_docx_content(file_path)
-    return File(name=file_name, content=content)
\ No newline at end of file
+    return File(name=file_name, content=content, content_hash=content_hash)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.retrievers import BaseRetriever
+from accord.metrics import METRICS
+
+
+# shared by every hybrid retriever, so concurrent queries do not spawn threads
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=min(32, (os.cpu_count() or 1) + 4),
+    thread_name_prefix="retrieval",
+)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs its retrievers concurrently and fuses their results with weighted
+    reciprocal rank fusion over chunk ids. Each chunk appears once in the
+    fused list, so the reranker never scores the same chunk twice.
+    """
+
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    c: int = 60
+    """Rank constant of reciprocal rank fusion"""
+    names: List[str] = []
+    """Stage names the latency of every retriever is recorded under"""
+
+    def _name(self, i: int) -> str:
+        return self.names[i] if i < len(self.names) else f"retriever_{i + 1}"
+
+    def _timed_invoke(self, i: int, retriever: BaseRetriever, query: str, config: dict) -> List[Document]:
+        with METRICS.timer(self._name(i)):
+            return retriever.invoke(query, config)
+
+    async def _timed_ainvoke(self, i: int, retriever: BaseRetriever, query: str, config: dict) -> List[Document]:
+        start = time.perf_counter()
+        try:
+            return await retriever.ainvoke(query, config)
+        finally:
+            METRICS.observe(self._name(i), time.perf_counter() - start)
+
+    def fuse(self, results: List[List[Document]]) -> List[Document]:
+        """
+        Fuse the ranked lists of the retrievers
+        Args:
+            results (List[List[Document]]): The documents returned by every retriever, best first
+        Returns:
+            List[Document]: The unique documents, best fused score first
+        """
+        positions: Dict[str, int] = {}
+        documents: List[Document] = []
+        rows, ranks, weights = [], [], []
+        for weight, docs in zip(self.weights, results):
+            for rank, doc in enumerate(docs):
+                key = doc.id or doc.page_content
+                if key not in positions:
+                    positions[key] = len(documents)
+                    documents.append(doc)
+                rows.append(positions[key])
+                ranks.append(rank)
+                weights.append(weight)
+        if not documents:
+            return []
+        scores = np.bincount(
+            np.asarray(rows),
+            weights=np.asarray(weights) / (np.asarray(ranks) + 1 + self.c),
+            minlength=len(documents),
+        )
+        fused, contents = [], set()
+        for row in np.argsort(-scores, kind="stable"):
+            document = documents[row]
+            # the same text can be stored under several ids (e.g. a file uploaded twice)
+            if document.page_content in contents:
+                continue
+            contents.add(document.page_content)
+            fused.append(document)
+        return fused
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        futures = [
+            # the legs record their latency into the request being served
+            RETRIEVAL_EXECUTOR.submit(
+                contextvars.copy_context().run,
+                self._timed_invoke,
+                i,
+                retriever,
+                query,
+                {"callbacks": run_manager.get_child(tag=f"retriever_{i + 1}")},
+            )
+            for i, retriever in enumerate(self.retrievers)
+        ]
+        return self.fuse([future.result() for future in futures])
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        results = await asyncio.gather(*[
+            self._timed_ainvoke(
+                i,
+                retriever,
+                query,
+                {"callbacks": run_manager.get_child(tag=f"retriever_{i + 1}")},
+            )
+            for i, retriever in enumerate(self.retrievers)
+        ])
+        return self.fuse(list(results))
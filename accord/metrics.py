@@ -0,0 +1,186 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+import numpy as np
+from accord import logger
+
+
+# upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# stage timings of the request being served, shared with the threads it spawns
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = np.asarray(buckets)
+        self.counts = np.zeros(len(buckets) + 1, dtype=np.int64)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def observe(self, value: float):
+        self.counts[np.searchsorted(self.buckets, value)] += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns:
+            float: The upper bound of the bucket holding the q quantile
+        """
+        if not self.count:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return float(self.buckets[bucket]) if bucket < len(self.buckets) else float("inf")
+
+
+class Metrics:
+    """
+    Latency histograms of the query and ingestion stages, and gauges of the
+    current state of the process (queue depths), exposed as Prometheus text
+    and as a periodic log summary. Stages timed while a request is being
+    served are also collected for that request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, float] = {}
+        self._started = False
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def set_gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def request(self) -> Iterator[Dict[str, float]]:
+        """
+        Collect the stage timings of a request
+        Returns:
+            Iterator[Dict[str, float]]: The seconds spent in every stage, filled while the request runs
+        """
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        try:
+            yield timings
+        finally:
+            _request_timings.reset(token)
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP accord_stage_seconds Latency of the query and ingestion stages",
+            "# TYPE accord_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = np.cumsum(histogram.counts)
+                for bound, count in zip(histogram.buckets, cumulative):
+                    lines.append(f'accord_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'accord_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative[-1]}')
+                lines.append(f'accord_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'accord_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE accord_{name} gauge")
+                lines.append(f"accord_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Returns:
+            Dict[str, dict]: The count, mean and approximate p50/p95/p99 of every stage
+        """
+        with self.lock:
+            return {
+                stage: {
+                    "count": histogram.count,
+                    "mean": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+                for stage, histogram in sorted(self.histograms.items())
+            }
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """
+        Serve the Prometheus text on http://0.0.0.0:port/metrics from a daemon thread
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+        logger.info(f"Serving metrics on port {port}")
+        return server
+
+    def log_every(self, interval: float) -> threading.Thread:
+        """
+        Log the summary every interval seconds from a daemon thread
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                if self.histograms:
+                    logger.info(f"Stage latencies: {self.summary()}")
+                if self.gauges:
+                    logger.info(f"Gauges: {dict(self.gauges)}")
+
+        thread = threading.Thread(target=run, daemon=True, name="metrics-log")
+        thread.start()
+        return thread
+
+    def start(self, port: int = 0, log_interval: float = 0):
+        """
+        Start the metrics endpoint and the periodic log once per process
+        Args:
+            port (int): The port of the Prometheus endpoint, 0 to disable it
+            log_interval (float): Seconds between two log summaries, 0 to disable them
+        """
+        with self.lock:
+            if self._started:
+                return
+            self._started = True
+        if port:
+            self.serve(port)
+        if log_interval:
+            self.log_every(log_interval)
+
+
+METRICS = Metrics()
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+from accord.metrics import METRICS
+from accord import logger
+
+
+# marks the end of the items of a queue
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    busy_seconds: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.items += 1
+            self.busy_seconds += seconds
+
+
+@dataclass
+class StageFailure:
+    """Passed down the pipeline in place of an item whose stage raised"""
+    stage: str
+    item: Any
+    error: Exception
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages. Every stage has its own pool of
+    worker threads and the stages are connected by bounded queues, so a slow
+    stage applies back-pressure instead of letting items pile up in memory,
+    and different items are in different stages at the same time.
+    If the consumer stops before the end, the workers drop the items left
+    and stop instead of blocking on the queues.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats: Dict[str, StageStats] = {}
+        self.wall_seconds = 0.0
+
+    def _worker(
+        self, stage: Stage,
+        inbox: queue.Queue,
+        outbox: queue.Queue,
+        finished: Callable[[], None],
+        cancelled: threading.Event,
+    ):
+        stats = self.stats[stage.name]
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                finished()
+                return
+            if cancelled.is_set():
+                continue
+            if not isinstance(item, StageFailure):
+                start = time.perf_counter()
+                try:
+                    item = stage.fn(item)
+                except Exception as e:
+                    logger.error(f"Stage {stage.name} failed: {e}")
+                    item = StageFailure(stage.name, item, e)
+                seconds = time.perf_counter() - start
+                stats.record(seconds)
+                METRICS.observe(f"ingest_{stage.name}", seconds)
+            outbox.put(item)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Run the items through the stages
+        Args:
+            items (Iterable[Any]): The input items
+        Returns:
+            Iterator[Any]: The outputs of the last stage, in completion order;
+                items a stage failed on are yielded as StageFailure
+        """
+        start = time.perf_counter()
+        cancelled = threading.Event()
+        self.stats = {stage.name: StageStats() for stage in self.stages}
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        for i, stage in enumerate(self.stages):
+            next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            lock = threading.Lock()
+
+            def finished(remaining=remaining, lock=lock, outbox=queues[i + 1], next_workers=next_workers):
+                # the last worker of a stage tells every worker of the next one to stop
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        for _ in range(next_workers):
+                            outbox.put(_DONE)
+
+            for n in range(stage.workers):
+                threading.Thread(
+                    target=self._worker,
+                    args=(stage, queues[i], queues[i + 1], finished, cancelled),
+                    daemon=True,
+                    name=f"{stage.name}-{n}",
+                ).start()
+
+        def feed():
+            try:
+                for item in items:
+                    if cancelled.is_set():
+                        break
+                    queues[0].put(item)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        def drain():
+            while queues[-1].get() is not _DONE:
+                pass
+
+        threading.Thread(target=feed, daemon=True, name="pipeline-feeder").start()
+        done = False
+        try:
+            while (item := queues[-1].get()) is not _DONE:
+                yield item
+            done = True
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+            if not done:
+                # the consumer stopped early: the workers finish the items they hold, drop
+                # the others and stop, the outputs still coming are discarded
+                cancelled.set()
+                threading.Thread(target=drain, daemon=True, name="pipeline-drain").start()
+
+    def report(self) -> Dict[str, dict]:
+        """
+        Returns:
+            Dict[str, dict]: For every stage the items processed, the seconds its
+                workers were busy and the items per second of wall time
+        """
+        return {
+            name: {
+                "items": stats.items,
+                "busy_seconds": round(stats.busy_seconds, 3),
+                "items_per_second": round(stats.items / self.wall_seconds, 3) if self.wall_seconds else 0.0,
+            }
+            for name, stats in self.stats.items()
+        }
@@ -0,0 +1,144 @@
+import hashlib
+from typing import Callable, List, Optional
+from langchain.prompts import ChatPromptTemplate
+from langchain.schema import Document
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompt_values import PromptValue
+from accord.cache import LRUCache
+
+
+# summaries of dropped history kept for reuse, so the prompt prefix stays the same
+SUMMARY_CACHE_SIZE = 128
+
+
+class PromptBuilder:
+    """
+    Fills the chat prompt within a token budget.
+    The system prompt and the chat history come first and only change when a
+    turn is added, so the model server can reuse its KV cache for them. When the
+    history is over its budget the oldest turns are dropped in blocks of
+    drop_block turns (optionally replaced by a summary), which keeps the same
+    prefix for several turns instead of shifting it on every question.
+    The documents fill the rest of the budget, best reranker score first; the
+    last one that does not fit is truncated.
+    Token counts are estimated from the number of characters.
+    """
+
+    def __init__(
+        self, template: ChatPromptTemplate,
+        file_template: str,
+        max_tokens: int,
+        history_max_tokens: int,
+        drop_block: int = 4,
+        chars_per_token: float = 4.0,
+        summarizer: Optional[Callable[[List[BaseMessage]], str]] = None,
+    ):
+        self.template = template
+        self.file_template = file_template
+        self.max_tokens = max_tokens
+        self.history_max_tokens = history_max_tokens
+        self.drop_block = drop_block
+        self.chars_per_token = chars_per_token
+        self.summarizer = summarizer
+        # shared by the sessions of the chatbot, every summary counts as one entry
+        self._summaries = LRUCache(SUMMARY_CACHE_SIZE)
+
+    def count_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+    def _message_tokens(self, messages: List[BaseMessage]) -> int:
+        # a few tokens of role markers per message
+        return sum(self.count_tokens(str(message.content)) + 4 for message in messages)
+
+    def _summary(self, dropped: List[BaseMessage]) -> str:
+        key = hashlib.sha256(
+            "\x00".join(f"{message.type}:{message.content}" for message in dropped).encode("utf-8")
+        ).hexdigest()
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self.summarizer(dropped)
+            self._summaries.put(key, summary, 1)
+        return summary
+
+    def fit_history(self, history: List[BaseMessage]) -> tuple[List[BaseMessage], int]:
+        """
+        Drop the oldest turns, in blocks, until the history fits its budget
+        Args:
+            history (List[BaseMessage]): The chat history, oldest first
+        Returns:
+            tuple[List[BaseMessage], int]: The messages to send and the number of dropped messages
+        """
+        if self._message_tokens(history) <= self.history_max_tokens:
+            return history, 0
+        dropped = 0
+        while dropped < len(history) and self._message_tokens(history[dropped:]) > self.history_max_tokens:
+            dropped += 1
+        # round up to whole blocks of turns (a question and its answer)
+        block = 2 * self.drop_block
+        dropped = min(len(history), -(-dropped // block) * block)
+        kept = history[dropped:]
+        if self.summarizer is not None and dropped:
+            summary = SystemMessage(f"Summary of the earlier conversation: {self._summary(history[:dropped])}")
+            kept = [summary] + kept
+        return kept, dropped
+
+    def fit_documents(self, documents: List[Document], budget: int) -> tuple[str, int]:
+        """
+        Format the best documents that fit the budget
+        Args:
+            documents (List[Document]): The reranked documents
+            budget (int): The tokens available for the documents
+        Returns:
+            tuple[str, int]: The formatted documents and the number of documents included
+        """
+        ranked = sorted(
+            documents,
+            key=lambda document: document.metadata.get("relevance_score", 0.0),
+            reverse=True,
+        )
+        parts, used = [], 0
+        for document in ranked:
+            part = self.file_template.format(name=document.metadata["source"], content=document.page_content)
+            tokens = self.count_tokens(part)
+            if used + tokens > budget:
+                # keep the beginning of the first document that does not fit
+                remaining = int((budget - used - self.count_tokens(self.file_template)) * self.chars_per_token)
+                if remaining > 0:
+                    parts.append(self.file_template.format(
+                        name=document.metadata["source"],
+                        content=document.page_content[:remaining],
+                    ))
+                break
+            parts.append(part)
+            used += tokens
+        return "\n\n".join(parts), len(parts)
+
+    def build(
+        self, question: str,
+        history: List[BaseMessage],
+        documents: List[Document],
+    ) -> tuple[PromptValue, dict]:
+        """
+        Build the prompt
+        Args:
+            question (str): The question
+            history (List[BaseMessage]): The chat history
+            documents (List[Document]): The reranked documents
+        Returns:
+            tuple[PromptValue, dict]: The prompt and its token statistics
+        """
+        history, dropped = self.fit_history(history)
+        # the prompt without documents, to measure what is left for them
+        base_tokens = self._message_tokens(
+            self.template.invoke({"question": question, "context": "", "chat_history": history}).to_messages()
+        )
+        context, n_documents = self.fit_documents(documents, max(0, self.max_tokens - base_tokens))
+        prompt = self.template.invoke({"question": question, "context": context, "chat_history": history})
+        stats = {
+            "prompt_tokens": self._message_tokens(prompt.to_messages()),
+            "history_messages": len(history),
+            "dropped_messages": dropped,
+            "documents": n_documents,
+            "retrieved_documents": len(documents),
+        }
+        return prompt, stats
@@ -0,0 +1,158 @@
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+
+# rows scored at once, bounds the temporary float copy of the codes
+SCORE_BATCH_SIZE = 4096
+# number of set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int32)
+
+MODES = ("int8", "binary")
+
+
+class QuantizedVectors:
+    """
+    Compact codes of unit-normalised vectors, used to shortlist candidates
+    that are then rescored exactly with the full-precision matrix.
+    - int8: every dimension scaled by its largest absolute value to [-127, 127],
+      4x smaller than float32
+    - binary: the sign of every dimension packed in bits, 32x smaller,
+      scored by hamming distance
+    """
+
+    def __init__(self, mode: str, codes: np.ndarray, scale: Optional[np.ndarray] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization {mode}, expected one of {MODES}")
+        self.mode = mode
+        self.codes = codes
+        self.scale = scale
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.mode == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return np.clip(np.round(vectors / self.scale * 127), -127, 127).astype(np.int8)
+
+    @classmethod
+    def train(cls, mode: str, vectors: np.ndarray) -> "QuantizedVectors":
+        """
+        Quantize vectors
+        Args:
+            mode (str): int8 or binary
+            vectors (np.ndarray): The (n, dimension) unit-normalised vectors
+        Returns:
+            QuantizedVectors: The codes of the vectors
+        """
+        scale = None
+        if mode == "int8":
+            scale = np.abs(np.asarray(vectors)).max(axis=0).astype(np.float32)
+            scale[scale == 0] = 1
+        quantized = cls(mode, np.empty((0, 0), dtype=np.int8 if mode == "int8" else np.uint8), scale)
+        quantized.codes = quantized.encode(vectors)
+        return quantized
+
+    def add(self, vectors: np.ndarray):
+        """
+        Add the codes of new vectors, with the scale of the existing ones
+        """
+        codes = self.encode(vectors)
+        self.codes = np.concatenate([self.codes, codes]) if len(self.codes) else codes
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The approximate similarity of every vector to the query
+        """
+        if self.mode == "binary":
+            query_code = np.packbits(query_vector > 0)
+            dimension = len(query_vector)
+            return np.concatenate([
+                dimension - 2 * POPCOUNT[np.bitwise_xor(self.codes[start:start + SCORE_BATCH_SIZE], query_code)].sum(axis=1)
+                for start in range(0, len(self.codes), SCORE_BATCH_SIZE)
+            ]).astype(np.float32)
+        query_vector = (query_vector * self.scale / 127).astype(np.float32)
+        return np.concatenate([
+            self.codes[start:start + SCORE_BATCH_SIZE].astype(np.float32) @ query_vector
+            for start in range(0, len(self.codes), SCORE_BATCH_SIZE)
+        ])
+
+    def search(
+        self, vectors: np.ndarray,
+        query_vector: np.ndarray,
+        k: int,
+        rescore_factor: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Shortlist k * rescore_factor rows with the codes, then rescore them exactly
+        Args:
+            vectors (np.ndarray): The full-precision matrix the codes were built from
+            query_vector (np.ndarray): The unit-normalised query
+            k (int): The number of rows to return
+            rescore_factor (int): The number of candidates rescored per returned row
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The row indices and exact scores, best first
+        """
+        approximate = self.scores(query_vector)
+        n_candidates = min(len(approximate), k * rescore_factor)
+        if n_candidates < len(approximate):
+            candidates = np.sort(np.argpartition(-approximate, n_candidates - 1)[:n_candidates])
+        else:
+            candidates = np.arange(len(approximate))
+        scores = np.asarray(vectors[candidates]) @ query_vector
+        if k < len(scores):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def save(self, path: Path):
+        if self.scale is None:
+            np.savez(path, mode=np.asarray(self.mode), codes=self.codes)
+        else:
+            np.savez(path, mode=np.asarray(self.mode), codes=self.codes, scale=self.scale)
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantizedVectors":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["mode"]), data["codes"], data["scale"] if "scale" in data else None)
+
+
+def evaluate_quantization(
+    vectors: np.ndarray,
+    quantized: QuantizedVectors,
+    query_vectors: np.ndarray,
+    k: int,
+    rescore_factor: int,
+) -> dict:
+    """
+    Compare quantized search with exact search over the full-precision vectors
+    Args:
+        vectors (np.ndarray): The full-precision unit-normalised vectors
+        quantized (QuantizedVectors): Their codes
+        query_vectors (np.ndarray): The unit-normalised queries
+        k (int): The number of results per query
+        rescore_factor (int): The number of candidates rescored per returned row
+    Returns:
+        dict: The size of both representations and the recall@k of the quantized search
+    """
+    hits = 0
+    for query_vector in query_vectors:
+        exact = np.argpartition(-(vectors @ query_vector), min(k, len(vectors)) - 1)[:k]
+        found, _ = quantized.search(vectors, query_vector, k, rescore_factor)
+        hits += len(np.intersect1d(exact, found))
+    return {
+        "mode": quantized.mode,
+        "vectors": len(vectors),
+        "full_bytes": int(vectors.nbytes),
+        "quantized_bytes": int(quantized.nbytes),
+        "recall": hits / max(1, len(query_vectors) * min(k, len(vectors))),
+    }
@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from box import ConfigBox
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import ChatOllama
+from accord.admission import AdmissionQueue
+from accord.cache import EmbeddingCache, LRUCache
+from accord.embeddings import CachedEmbeddings
+from accord.embedding_executor import EmbeddingExecutor
+from accord.reranker import CachedReranker
+from accord.utils import CONFIG_PATH, get_config
+from accord import logger
+
+
+class ModelRegistry:
+    """
+    The configuration, models and clients of the process, shared by every
+    Chatbot and DataIngestor (streamlit reruns included).
+    Each resource is created on first use and only once, even when several
+    threads ask for it at the same time. Resources are keyed by the settings
+    they are built from, so a caller with a configuration of its own gets
+    models built from it. warm_up creates the models from a background
+    thread so the first question does not wait for them.
+    """
+
+    def __init__(self, config_path: Path = CONFIG_PATH):
+        self.config_path = config_path
+        self.lock = threading.Lock()
+        self._config: Optional[ConfigBox] = None
+        self._resources: Dict[tuple, Any] = {}
+        # one lock per resource, a slow model load does not block the others
+        self._loading: Dict[tuple, threading.Lock] = {}
+        self._warm_up: Optional[threading.Thread] = None
+
+    @property
+    def config(self) -> ConfigBox:
+        """
+        Returns:
+            ConfigBox: The configuration, read once
+        """
+        with self.lock:
+            if self._config is None:
+                self._config = get_config(self.config_path)
+            return self._config
+
+    def get(self, key: tuple, factory: Callable[[], Any]) -> Any:
+        """
+        Args:
+            key (tuple): The name of the resource and the parameters it is created with
+            factory (Callable[[], Any]): Creates the resource on first use
+        Returns:
+            Any: The shared resource
+        """
+        with self.lock:
+            if key in self._resources:
+                return self._resources[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self.lock:
+                if key in self._resources:
+                    return self._resources[key]
+            start = time.perf_counter()
+            resource = factory()
+            with self.lock:
+                self._resources[key] = resource
+            logger.info(f"Loaded {key[0]} {' '.join(map(str, key[1:]))} in {time.perf_counter() - start:.2f}s")
+            return resource
+
+    def loaded(self) -> List[tuple]:
+        with self.lock:
+            return list(self._resources)
+
+    def llm(self, config: Optional[ConfigBox] = None) -> ChatOllama:
+        config = (config or self.config).llm
+        return self.get(
+            ("llm", config.MODEL_NAME, config.TEMPERATURE, config.CONTEXT_WINDOW),
+            lambda: ChatOllama(
+                model=config.MODEL_NAME,
+                temperature=config.TEMPERATURE,
+                num_ctx=config.CONTEXT_WINDOW,
+                keep_alive=-1,
+                verbose=False,
+            ),
+        )
+
+    def llm_admission(self) -> AdmissionQueue:
+        """
+        Returns:
+            AdmissionQueue: The queue of the requests sent to the Ollama server,
+                shared by the chat sessions and the ingestions
+        """
+        return self.get(
+            ("llm_admission",),
+            lambda: AdmissionQueue(self.config.llm.MAX_CONCURRENT_REQUESTS),
+        )
+
+    def embedding_cache(self, config: Optional[ConfigBox] = None) -> Optional[EmbeddingCache]:
+        cache = (config or self.config).cache
+        if not cache.USE_EMBEDDING_CACHE:
+            return None
+        return self.get(
+            ("embedding_cache", cache.EMBEDDING_CACHE_PATH),
+            lambda: EmbeddingCache(cache.EMBEDDING_CACHE_PATH, cache.EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+        )
+
+    def create_embedding_model(self, threads: Optional[int] = None, config: Optional[ConfigBox] = None) -> Embeddings:
+        """
+        Create an embedding model, behind the embedding cache when it is enabled
+        Args:
+            threads (Optional[int]): The number of threads of the ONNX session, None for all cores
+            config (Optional[ConfigBox]): The configuration of the model, the one of the registry if None
+        Returns:
+            Embeddings: A new embedding model
+        """
+        model_name = (config or self.config).preprocessing.EMBEDDING_MODEL
+        embedding_model = FastEmbedEmbeddings(model_name=model_name, threads=threads)
+        embedding_cache = self.embedding_cache(config)
+        if embedding_cache is None:
+            return embedding_model
+        return CachedEmbeddings(embedding_model, model_name, embedding_cache)
+
+    @staticmethod
+    def _embedding_key(config: ConfigBox) -> tuple:
+        # the same model with and without the cache are two resources
+        cache = config.cache
+        return (config.preprocessing.EMBEDDING_MODEL, cache.USE_EMBEDDING_CACHE and cache.EMBEDDING_CACHE_PATH)
+
+    def embedding_model(self, config: Optional[ConfigBox] = None) -> Embeddings:
+        """
+        Args:
+            config (Optional[ConfigBox]): The configuration of the model, the one of the registry if None
+        Returns:
+            Embeddings: The embedding model of the queries and the vector stores
+        """
+        config = config or self.config
+        return self.get(
+            ("embedding_model",) + self._embedding_key(config),
+            lambda: self.create_embedding_model(config=config),
+        )
+
+    def embedding_executor(self, config: Optional[ConfigBox] = None) -> EmbeddingExecutor:
+        """
+        Args:
+            config (Optional[ConfigBox]): The configuration of the executor, the one of the registry if None
+        Returns:
+            EmbeddingExecutor: The executor embedding the chunks of ingested files,
+                its workers load their models on their first batch
+        """
+        config = config or self.config
+        preprocessing = config.preprocessing
+        threads = preprocessing.EMBEDDING_THREADS_PER_WORKER
+        workers = preprocessing.EMBEDDING_WORKERS or max(1, (os.cpu_count() or 1) // threads)
+        batching = (
+            preprocessing.EMBEDDING_MIN_BATCH_SIZE,
+            preprocessing.BATCH_SIZE,
+            preprocessing.EMBEDDING_BATCH_TOKENS,
+        )
+        return self.get(
+            ("embedding_executor",) + self._embedding_key(config) + (threads, workers) + batching,
+            lambda: EmbeddingExecutor(lambda: self.create_embedding_model(threads, config), workers, *batching),
+        )
+
+    def rerank_score_cache(self, config: Optional[ConfigBox] = None) -> Optional[LRUCache]:
+        """
+        Returns:
+            Optional[LRUCache]: The (reranker model, query hash, chunk hash) -> relevance score cache,
+                None if RERANK_CACHE_MAX_MB is 0
+        """
+        max_mb = (config or self.config).cache.RERANK_CACHE_MAX_MB
+        if not max_mb:
+            return None
+        return self.get(("rerank_score_cache", max_mb), lambda: LRUCache(max_mb * 1024 * 1024))
+
+    def reranker(self, model: str, config: Optional[ConfigBox] = None) -> CachedReranker:
+        """
+        Args:
+            model (str): The flashrank model name
+            config (Optional[ConfigBox]): The configuration of the reranker, the one of the registry if None
+        Returns:
+            CachedReranker: The cached, batching reranker of the model
+        """
+        config = config or self.config
+        preprocessing = config.preprocessing
+        return self.get(
+            (
+                "reranker", model,
+                preprocessing.N_CONTEXT_RESULTS,
+                preprocessing.RERANK_MAX_BATCH_SIZE,
+                preprocessing.RERANK_BATCH_WAIT_MS,
+                config.cache.RERANK_CACHE_MAX_MB,
+            ),
+            lambda: CachedReranker.from_model(
+                model,
+                top_n=preprocessing.N_CONTEXT_RESULTS,
+                score_cache=self.rerank_score_cache(config),
+                max_batch_size=preprocessing.RERANK_MAX_BATCH_SIZE,
+                max_wait=preprocessing.RERANK_BATCH_WAIT_MS / 1000,
+            ),
+        )
+
+    def warm_up(self) -> threading.Thread:
+        """
+        Load the embedding model and the rerankers in use from a daemon thread, once per process
+        Returns:
+            threading.Thread: The warm-up thread
+        """
+        def run():
+            preprocessing = self.config.preprocessing
+            loaders = [self.embedding_model, lambda: self.reranker(preprocessing.RERANKER)]
+            if preprocessing.USE_LIGHT_RERANKER:
+                loaders.append(lambda: self.reranker(preprocessing.LIGHT_RERANKER))
+            for load in loaders:
+                try:
+                    load()
+                except Exception as e:
+                    # the model is loaded again, and the error raised, on first use
+                    logger.warning(f"Model warm-up failed: {e}")
+
+        with self.lock:
+            if self._warm_up is None:
+                self._warm_up = threading.Thread(target=run, daemon=True, name="model-warm-up")
+                self._warm_up.start()
+            return self._warm_up
+
+
+REGISTRY = ModelRegistry()
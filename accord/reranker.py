@@ -0,0 +1,204 @@
+import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional, Sequence
+import numpy as np
+from flashrank import Ranker, RerankRequest
+from langchain.schema import Document
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor
+from pydantic import ConfigDict
+from accord.cache import LRUCache
+from accord.metrics import METRICS
+from accord import logger
+
+
+# estimated memory of one cached (model, query, chunk) score
+SCORE_ENTRY_SIZE = 256
+
+
+def cross_encoder_scores(ranker: Ranker, pairs: List[List[str]]) -> np.ndarray:
+    """
+    Score (query, passage) pairs with the cross-encoder of a flashrank Ranker in one
+    inference call. The pairs may belong to different queries.
+    Args:
+        ranker (Ranker): The flashrank ranker (pairwise ONNX model)
+        pairs (List[List[str]]): The [query, passage] pairs
+    Returns:
+        np.ndarray: The relevance score of every pair
+    """
+    encoded = ranker.tokenizer.encode_batch(pairs)
+    input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+    token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+    attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+    onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if not np.all(token_type_ids == 0):
+        onnx_input["token_type_ids"] = token_type_ids
+    logits = ranker.session.run(None, onnx_input)[0]
+    if logits.shape[1] == 1:
+        return 1 / (1 + np.exp(-logits.flatten()))
+    exp_logits = np.exp(logits)
+    return exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+
+
+class RerankBatcher:
+    """
+    Collects the pairs of concurrent rerank calls for up to max_wait seconds and
+    scores them together in one cross-encoder inference on a single worker thread.
+    """
+
+    def __init__(self, ranker: Ranker, max_batch_size: int, max_wait: float):
+        self.ranker = ranker
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests: queue.Queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True, name="rerank-batcher")
+        self.worker.start()
+
+    def score(self, pairs: List[List[str]]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The scores of the pairs, once the batch they joined has run
+        """
+        future = Future()
+        self.requests.put((pairs, future))
+        return future.result()
+
+    def _collect(self) -> list:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while sum(len(pairs) for pairs, _ in batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            pairs = [pair for request_pairs, _ in batch for pair in request_pairs]
+            try:
+                scores = cross_encoder_scores(self.ranker, pairs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_pairs, future in batch:
+                future.set_result(scores[start:start + len(request_pairs)])
+                start += len(request_pairs)
+
+
+class CachedReranker(BaseDocumentCompressor):
+    """
+    FlashRank reranker that
+    - returns the candidates as they are when there are no more than top_n of them,
+    - scores each (query, chunk) pair only once, caching the scores,
+    - batches the cross-encoder inference of concurrent queries.
+    """
+
+    ranker: Any
+    """flashrank Ranker"""
+    model: str
+    batcher: Optional[Any] = None
+    """RerankBatcher, None to score every query on its own"""
+    score_cache: Any = None
+    """LRUCache of the scores"""
+    top_n: int = 3
+    prefix_metadata: str = ""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @staticmethod
+    def document_key(document: Document) -> str:
+        # the score only depends on the text; ids are not unique across stores
+        # (chunks of legacy per-file stores are numbered from 0 in every store)
+        return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+    def _score(self, query: str, documents: List[Document]) -> np.ndarray:
+        if self.ranker.llm_model is not None:
+            # listwise rankers only return an order, turn it into descending scores
+            passages = [{"id": i, "text": doc.page_content} for i, doc in enumerate(documents)]
+            ranked = self.ranker.rerank(RerankRequest(query=query, passages=passages))
+            scores = np.zeros(len(documents))
+            for rank, passage in enumerate(ranked):
+                scores[passage["id"]] = len(ranked) - rank
+            return scores
+        pairs = [[query, doc.page_content] for doc in documents]
+        if self.batcher is not None:
+            return self.batcher.score(pairs)
+        return cross_encoder_scores(self.ranker, pairs)
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        with METRICS.timer("rerank"):
+            return self._rerank(documents, query)
+
+    def _rerank(self, documents: Sequence[Document], query: str) -> Sequence[Document]:
+        by_key = {}
+        for document in documents:
+            by_key.setdefault(self.document_key(document), document)
+        keys, unique = list(by_key), list(by_key.values())
+        if len(unique) <= self.top_n:
+            return unique
+
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        cache_keys = [(self.model, query_hash, key) for key in keys]
+        scores = [self.score_cache.get(key) if self.score_cache is not None else None for key in cache_keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            new_scores = self._score(query, [unique[i] for i in missing])
+            for i, score in zip(missing, new_scores):
+                scores[i] = float(score)
+                if self.score_cache is not None:
+                    self.score_cache.put(cache_keys[i], scores[i], SCORE_ENTRY_SIZE)
+        logger.debug(f"Reranked {len(unique)} chunks, {len(unique) - len(missing)} scores cached")
+
+        order = np.argsort(-np.asarray(scores), kind="stable")[:self.top_n]
+        return [
+            Document(
+                id=unique[i].id,
+                page_content=unique[i].page_content,
+                metadata={
+                    self.prefix_metadata + "id": int(i),
+                    self.prefix_metadata + "relevance_score": scores[i],
+                    **unique[i].metadata,
+                },
+            )
+            for i in order
+        ]
+
+    @classmethod
+    def from_model(
+        cls, model: str,
+        top_n: int,
+        score_cache: Optional[LRUCache] = None,
+        max_batch_size: int = 0,
+        max_wait: float = 0.0,
+    ) -> "CachedReranker":
+        """
+        Create a reranker for a flashrank model
+        Args:
+            model (str): The flashrank model name
+            top_n (int): The number of documents to return
+            score_cache (LRUCache): The cache of the scores, None to disable caching
+            max_batch_size (int): The maximum number of pairs scored together, 0 to disable batching
+            max_wait (float): Seconds a query waits for other queries to join its batch
+        Returns:
+            CachedReranker: The reranker
+        """
+        ranker = Ranker(model_name=model)
+        batcher = None
+        if max_batch_size > 0 and ranker.llm_model is None:
+            batcher = RerankBatcher(ranker, max_batch_size, max_wait)
+        return cls(ranker=ranker, model=model, batcher=batcher, score_cache=score_cache, top_n=top_n)
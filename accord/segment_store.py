@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, Iterable, List, Optional
+import numpy as np
+import shortuuid
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from accord.bm25_index import BM25Index
+from accord.vector_store import NumpyVectorStore
+from accord import logger
+
+
+MANIFEST_FILE = "manifest.json"
+
+# one lock per segment directory, shared by every store instance of the process
+_directory_locks: Dict[str, threading.Lock] = {}
+_directory_locks_guard = threading.Lock()
+
+
+def _directory_lock(directory: Path) -> threading.Lock:
+    with _directory_locks_guard:
+        return _directory_locks.setdefault(os.path.abspath(directory), threading.Lock())
+
+
+class SegmentedVectorStore(VectorStore):
+    """
+    Append-only vector store made of immutable NumpyVectorStore segments.
+    Every ingest writes a new segment and a small manifest lists the live ones,
+    so adding documents never rewrites the existing data. Small segments are
+    merged by compact, which can run in a background thread.
+    The BM25 postings of a segment are saved next to it, and merged with the
+    segments it is compacted with.
+    """
+
+    def __init__(self, directory: Path, embedding: Embeddings, ann_config: Optional[Any] = None):
+        self.directory = Path(directory)
+        self.embedding = embedding
+        self.ann_config = ann_config
+        self.lock = _directory_lock(self.directory)
+        self.compaction_lock = _directory_lock(self.directory / "compaction")
+        self._segments: Dict[str, NumpyVectorStore] = {}
+        self.segment_names: List[str] = []
+        self.refresh()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @staticmethod
+    def is_segmented(path: Path) -> bool:
+        """Segmented stores live in a directory, i.e. a path without suffix"""
+        return Path(path).suffix == ""
+
+    def _read_manifest(self) -> List[str]:
+        manifest_path = self.directory / MANIFEST_FILE
+        if not manifest_path.exists():
+            return []
+        with open(manifest_path) as f:
+            return json.load(f)["segments"]
+
+    def _write_manifest(self, segment_names: List[str]):
+        self.directory.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.directory / f"{MANIFEST_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": segment_names}, f)
+        os.replace(tmp_path, self.directory / MANIFEST_FILE)
+
+    def refresh(self):
+        """Reload the manifest to see segments written since the store was opened"""
+        for _ in range(3):
+            segment_names = self._read_manifest()
+            try:
+                self._segments = {name: self._load_segment(name) for name in segment_names}
+            except FileNotFoundError:
+                # a compaction replaced segments between reading the manifest and loading them
+                continue
+            self.segment_names = segment_names
+            return
+        raise RuntimeError(f"Could not load a consistent set of segments from {self.directory}")
+
+    def _load_segment(self, name: str) -> NumpyVectorStore:
+        # segments are immutable, so loaded ones are reused across refreshes
+        if name in self._segments:
+            return self._segments[name]
+        return NumpyVectorStore.load(self.directory / f"{name}.npy", self.embedding, ann_config=self.ann_config)
+
+    @property
+    def segments(self) -> List[NumpyVectorStore]:
+        return [self._segments[name] for name in self.segment_names]
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    @staticmethod
+    def new_segment_name() -> str:
+        return f"segment-{shortuuid.uuid()}"
+
+    def bm25_path(self, name: str) -> Path:
+        """
+        Returns:
+            Path: The path of the BM25 postings of a segment
+        """
+        return self.directory / f"{name}.bm25.npz"
+
+    def segment_bm25_index(self, name: str) -> BM25Index:
+        """
+        Load the BM25 postings of a live segment, building and saving them if
+        the segment has none yet (e.g. it was written with the FTS5 backend)
+        Args:
+            name (str): The name of the segment
+        Returns:
+            BM25Index: The index of the chunks of the segment
+        """
+        path = self.bm25_path(name)
+        if path.exists():
+            return BM25Index.load(path)
+        segment = self._segments[name]
+        index = BM25Index()
+        index.add(segment.texts, segment.ids)
+        with self.lock:
+            # a segment compacted in the meantime would leave its postings behind
+            if name in self._read_manifest():
+                index.save(path)
+        return index
+
+    def bm25_index(self) -> BM25Index:
+        """
+        Returns:
+            BM25Index: The BM25 index of every live segment, merged from their postings
+        """
+        for _ in range(3):
+            try:
+                return BM25Index.merge([self.segment_bm25_index(name) for name in self.segment_names])
+            except FileNotFoundError:
+                # a compaction removed the postings of merged segments, load the new ones
+                self.refresh()
+        raise RuntimeError(f"Could not load a consistent set of BM25 postings from {self.directory}")
+
+    def add_segment(self, vector_store: NumpyVectorStore, name: Optional[str] = None, first: bool = False) -> str:
+        """
+        Write the content of a vector store as a new immutable segment
+        Args:
+            vector_store (NumpyVectorStore): The vectors to append
+            name (Optional[str]): The name of the segment, a new unique one if None
+            first (bool): If True the segment is listed before the existing ones
+        Returns:
+            str: The name of the new segment
+        """
+        name = name or self.new_segment_name()
+        vector_store.dump(self.directory / f"{name}.npy")
+        with self.lock:
+            segment_names = self._read_manifest()
+            segment_names.insert(0 if first else len(segment_names), name)
+            self._write_manifest(segment_names)
+        self.refresh()
+        logger.info(f"Added {name} with {len(vector_store)} vectors to {self.directory}")
+        return name
+
+    def add_embeddings(
+        self, texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        segment = NumpyVectorStore(self.embedding, ann_config=self.ann_config)
+        ids = segment.add_embeddings(texts, embeddings, metadatas, ids)
+        self.add_segment(segment)
+        return ids
+
+    def add_texts(
+        self, texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def documents(self) -> List[Document]:
+        """
+        Returns:
+            List[Document]: The documents of all live segments
+        """
+        return [document for segment in self.segments for document in segment.documents()]
+
+    def get_by_ids(self, ids: List[str]) -> List[tuple[Document, np.ndarray]]:
+        """
+        Returns:
+            List[tuple[Document, np.ndarray]]: The documents and vectors of the ids found in any live segment
+        """
+        return [result for segment in self.segments for result in segment.get_by_ids(ids)]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float],
+        k: int = 4,
+        filter: Optional[Callable[[Document], bool]] = None,
+        chunk_ids: Optional[Collection[str]] = None,
+        **kwargs: Any,
+    ) -> List[tuple[Document, float]]:
+        results = [
+            result
+            for segment in self.segments
+            for result in segment.similarity_search_with_score_by_vector(embedding, k, filter, chunk_ids)
+        ]
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:k]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls, texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "SegmentedVectorStore":
+        store = cls(kwargs["directory"], embedding)
+        store.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return store
+
+    def compact(self, min_segment_size: int, min_segments: int = 2) -> Optional[str]:
+        """
+        Merge the segments smaller than min_segment_size into one segment.
+        With ann_config.USE_ANN segments are merged until they reach
+        ann_config.MIN_VECTORS, the size at which the merged segment gets an IVF index.
+        The merge reads only immutable segments, so ingestion and retrieval
+        keep working while it runs; the manifest is swapped at the end.
+        Args:
+            min_segment_size (int): Segments with fewer vectors are merged
+            min_segments (int): Do nothing unless at least this many segments are small
+        Returns:
+            Optional[str]: The name of the merged segment, None if nothing was merged
+        """
+        if not self.compaction_lock.acquire(blocking=False):
+            logger.info(f"Compaction of {self.directory} already running")
+            return None
+        try:
+            return self._compact(min_segment_size, min_segments)
+        finally:
+            self.compaction_lock.release()
+
+    def _compact(self, min_segment_size: int, min_segments: int) -> Optional[str]:
+        if self.ann_config and self.ann_config.USE_ANN:
+            min_segment_size = max(min_segment_size, self.ann_config.MIN_VECTORS)
+        self.refresh()
+        small = [name for name in self.segment_names if len(self._segments[name]) < min_segment_size]
+        if len(small) < max(2, min_segments):
+            return None
+        segments = [self._segments[name] for name in small]
+        non_empty = [segment.vectors for segment in segments if len(segment)]
+        merged = NumpyVectorStore(
+            self.embedding,
+            np.vstack(non_empty) if non_empty else None,
+            [doc_id for segment in segments for doc_id in segment.ids],
+            [text for segment in segments for text in segment.texts],
+            [metadata for segment in segments for metadata in segment.metadatas],
+            ann_config=self.ann_config,
+        )
+        name = self.new_segment_name()
+        merged.dump(self.directory / f"{name}.npy")
+        # the lexical postings are merged too, when the segments have theirs
+        if all(self.bm25_path(old).exists() for old in small):
+            BM25Index.merge([BM25Index.load(self.bm25_path(old)) for old in small]).save(self.bm25_path(name))
+        with self.lock:
+            segment_names = self._read_manifest()
+            # keep the position of the first merged segment so the order of documents is stable
+            position = segment_names.index(small[0])
+            segment_names = [segment for segment in segment_names if segment not in small]
+            segment_names.insert(position, name)
+            self._write_manifest(segment_names)
+        for old in small:
+            old_path = self.directory / f"{old}.npy"
+            for path in (
+                *NumpyVectorStore.paths(old_path),
+                NumpyVectorStore.index_path(old_path),
+                NumpyVectorStore.quantized_path(old_path),
+                self.bm25_path(old),
+            ):
+                path.unlink(missing_ok=True)
+        self.refresh()
+        logger.info(f"Compacted {len(small)} segments of {self.directory} into {name}")
+        return name
+
+    def compact_in_background(self, min_segment_size: int, min_segments: int = 2) -> threading.Thread:
+        """
+        Run compact in a daemon thread
+        Returns:
+            threading.Thread: The started thread
+        """
+        def run():
+            try:
+                self.compact(min_segment_size, min_segments)
+            except Exception as e:
+                logger.error(f"Compaction of {self.directory} failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
@@ -49,8 +49,11 @@ def remove_thinking_from_message(message:str)->str:
         str: message without thinking
     """
     close_tag = "</think>"
-    tag_length = len(close_tag)
-    return message[message.find(close_tag) + tag_length:].strip()
+    end = message.find(close_tag)
+    if end == -1:
+        # the model did not think
+        return message.strip()
+    return message[end + len(close_tag):].strip()
 
 
 def create_history(welcone_message: Message) -> List[Message]:
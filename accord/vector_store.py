@@ -0,0 +1,408 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Collection, Iterable, List, Optional
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore, VectorStore
+from accord.ann_index import IVFIndex
+from accord.quantization import QuantizedVectors, evaluate_quantization
+from accord import logger
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store keeping the embeddings as one contiguous float32 matrix.
+    The matrix is saved as a .npy file and memory-mapped on load, the ids,
+    texts and metadata are saved in a separate JSON index next to it.
+    Rows are unit-normalised, so cosine similarity is a single matmul.
+    With ann_config.USE_ANN, stores of at least ann_config.MIN_VECTORS vectors
+    get an IVF index, saved next to the matrix, and are searched approximately.
+    With ann_config.QUANTIZATION (int8 or binary) compact codes are kept in
+    memory to shortlist candidates, which are rescored with the memory-mapped matrix.
+    """
+
+    def __init__(
+        self, embedding: Embeddings,
+        vectors: Optional[np.ndarray] = None,
+        ids: Optional[List[str]] = None,
+        texts: Optional[List[str]] = None,
+        metadatas: Optional[List[dict]] = None,
+        ann_config: Optional[Any] = None,
+        index: Optional[IVFIndex] = None,
+        quantized: Optional[QuantizedVectors] = None,
+    ):
+        if ann_config and ann_config.USE_ANN and ann_config.NPROBE < 1:
+            raise ValueError(f"ann.NPROBE must scan at least one list, got {ann_config.NPROBE}")
+        self.embedding = embedding
+        self.ann_config = ann_config
+        self.index = index
+        self.quantized = quantized
+        self._vectors = vectors
+        # rows added since the matrix was last consolidated
+        self._pending: List[np.ndarray] = []
+        self.ids = ids or []
+        self.texts = texts or []
+        self.metadatas = metadatas or []
+        # id -> row, built on the first lookup by id
+        self._rows: Optional[dict] = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The (n, dimension) float32 matrix of unit-normalised embeddings"""
+        if self._pending:
+            blocks = [self._vectors] if self._vectors is not None and len(self._vectors) else []
+            self._vectors = np.vstack(blocks + self._pending)
+            self._pending = []
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._vectors
+
+    @staticmethod
+    def normalize(vectors: Any) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add_embeddings(
+        self, texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Add already computed embeddings to the store
+        Args:
+            texts (List[str]): The texts
+            embeddings (List[List[float]]): The embeddings of the texts
+            metadatas (List[dict]): The metadata of the texts
+            ids (List[str]): The ids of the texts, generated if not given
+        Returns:
+            List[str]: The ids of the added texts
+        """
+        if not texts:
+            return []
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self.normalize(embeddings)
+        # the index only covers the rows it was trained on, dump trains a new one
+        self.index = None
+        if self.quantized is not None:
+            self.quantized.add(vectors)
+        self._pending.append(vectors)
+        self._rows = None
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas or [{} for _ in texts])
+        return ids
+
+    def add_texts(
+        self, texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def _document(self, index: int) -> Document:
+        return Document(
+            id=self.ids[index],
+            page_content=self.texts[index],
+            metadata=self.metadatas[index],
+        )
+
+    def documents(self) -> List[Document]:
+        """
+        Returns:
+            List[Document]: The documents of the store, in the order of their rows
+        """
+        return [self._document(index) for index in range(len(self))]
+
+    def rows_of(self, ids: Iterable[str]) -> np.ndarray:
+        """
+        Args:
+            ids (Iterable[str]): The ids to look up
+        Returns:
+            np.ndarray: The sorted rows of the ids found in the store
+        """
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return np.sort(np.fromiter((self._rows[doc_id] for doc_id in ids if doc_id in self._rows), dtype=np.int64))
+
+    def get_by_ids(self, ids: List[str]) -> List[tuple[Document, np.ndarray]]:
+        """
+        Args:
+            ids (List[str]): The ids to look up
+        Returns:
+            List[tuple[Document, np.ndarray]]: The documents and vectors of the ids found in the store
+        """
+        vectors = self.vectors
+        return [(self._document(int(row)), np.asarray(vectors[row])) for row in self.rows_of(ids)]
+
+    def top_k(
+        self, query_vector: np.ndarray,
+        k: int,
+        rows: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k rows most similar to the query
+        Args:
+            query_vector (np.ndarray): The unit-normalised query embedding
+            k (int): The number of rows to return
+            rows (np.ndarray): The rows to search, all of them if None
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The row indices and scores, best first
+        """
+        vectors = self.vectors
+        if not len(vectors) or k <= 0 or (rows is not None and not len(rows)):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if rows is not None:
+            # a scoped search only reads the rows in scope, exactly
+            scores = vectors[rows] @ query_vector
+        elif self.use_index and k < len(vectors):
+            indices, scores = self.index.search(vectors, query_vector, k, self.ann_config.NPROBE)
+            if len(indices) == k:
+                return indices, scores
+            scores = vectors @ query_vector
+        elif self.use_quantized and k < len(vectors):
+            return self.quantized.search(vectors, query_vector, k, self.ann_config.RESCORE_FACTOR)
+        else:
+            scores = vectors @ query_vector
+        if k < len(scores):
+            indices = np.argpartition(-scores, k - 1)[:k]
+        else:
+            indices = np.arange(len(scores))
+        indices = indices[np.argsort(-scores[indices])]
+        if rows is not None:
+            return rows[indices], scores[indices]
+        return indices, scores[indices]
+
+    @property
+    def use_index(self) -> bool:
+        return (
+            self.index is not None
+            and bool(self.ann_config and self.ann_config.USE_ANN)
+            and len(self.index) == len(self)
+        )
+
+    @property
+    def quantization(self) -> str:
+        return (self.ann_config and self.ann_config.QUANTIZATION) or "none"
+
+    @property
+    def use_quantized(self) -> bool:
+        return (
+            self.quantized is not None
+            and self.quantized.mode == self.quantization
+            and len(self.quantized) == len(self)
+        )
+
+    def build_quantized(self):
+        """
+        Quantize the vectors of the store and log the size and recall against exact search
+        """
+        self.quantized = QuantizedVectors.train(self.quantization, self.vectors)
+        n_queries = min(self.ann_config.QUANTIZATION_EVAL_QUERIES, len(self))
+        if n_queries:
+            rng = np.random.default_rng(42)
+            queries = np.asarray(self.vectors[np.sort(rng.choice(len(self), n_queries, replace=False))])
+            report = evaluate_quantization(self.vectors, self.quantized, queries, 10, self.ann_config.RESCORE_FACTOR)
+        else:
+            report = {"full_bytes": self.vectors.nbytes, "quantized_bytes": self.quantized.nbytes}
+        logger.info(f"Quantized {len(self)} vectors to {self.quantization}: {report}")
+
+    def build_index(self):
+        """
+        Train the IVF index on the vectors of the store
+        """
+        n = len(self)
+        nlist = self.ann_config.NLIST or int(4 * np.sqrt(n))
+        logger.info(f"Building IVF index with {nlist} lists over {n} vectors")
+        self.index = IVFIndex.train(
+            self.vectors,
+            nlist,
+            self.ann_config.KMEANS_ITERATIONS,
+            self.ann_config.TRAIN_SAMPLE_SIZE,
+        )
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float],
+        k: int = 4,
+        filter: Optional[Callable[[Document], bool]] = None,
+        chunk_ids: Optional[Collection[str]] = None,
+        **kwargs: Any,
+    ) -> List[tuple[Document, float]]:
+        """
+        Args:
+            embedding (List[float]): The query embedding
+            k (int): The number of documents to return
+            filter (Callable[[Document], bool]): Keep only the documents it accepts
+            chunk_ids (Collection[str]): Search only the documents with these ids
+        Returns:
+            List[tuple[Document, float]]: The documents and their cosine similarity, best first
+        """
+        query_vector = self.normalize(embedding)
+        rows = None if chunk_ids is None else self.rows_of(chunk_ids)
+        if filter is None:
+            indices, scores = self.top_k(query_vector, k, rows)
+        else:
+            # rank everything, then keep the best k documents passing the filter
+            indices, scores = self.top_k(query_vector, len(self), rows)
+        results = []
+        for index, score in zip(indices, scores):
+            document = self._document(int(index))
+            if filter is not None and not filter(document):
+                continue
+            results.append((document, float(score)))
+            if len(results) == k:
+                break
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls, texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return store
+
+    @classmethod
+    def from_in_memory(
+        cls, vector_store: InMemoryVectorStore,
+        ann_config: Optional[Any] = None,
+    ) -> "NumpyVectorStore":
+        """
+        Convert an InMemoryVectorStore (e.g. a legacy JSON dump) to a NumpyVectorStore
+        """
+        store = cls(vector_store.embedding, ann_config=ann_config)
+        records = list(vector_store.store.values())
+        store.add_embeddings(
+            [record["text"] for record in records],
+            [record["vector"] for record in records],
+            [record["metadata"] for record in records],
+            [record["id"] for record in records],
+        )
+        return store
+
+    @staticmethod
+    def paths(path: Path) -> tuple[Path, Path]:
+        """
+        Returns:
+            tuple[Path, Path]: The matrix and index file paths of a store saved at path
+        """
+        path = Path(path)
+        return path.with_suffix(".npy"), path.with_suffix(".json")
+
+    @staticmethod
+    def quantized_path(path: Path) -> Path:
+        """
+        Returns:
+            Path: The quantized codes file path of a store saved at path
+        """
+        return Path(path).with_suffix(".q.npz")
+
+    @staticmethod
+    def index_path(path: Path) -> Path:
+        """
+        Returns:
+            Path: The IVF index file path of a store saved at path
+        """
+        return Path(path).with_suffix(".ivf.npz")
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        return all(os.path.exists(p) for p in cls.paths(path))
+
+    def dump(self, path: Path):
+        """
+        Save the matrix and the index. Both files are written to a temporary
+        file first and moved into place, so readers never see a partial store.
+        Args:
+            path (Path): The path of the store, the suffix is replaced by .npy and .json
+        """
+        matrix_path, index_path = self.paths(path)
+        matrix_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_matrix_path = matrix_path.with_suffix(".tmp.npy")
+        np.save(tmp_matrix_path, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        tmp_index_path = index_path.with_suffix(".tmp.json")
+        with open(tmp_index_path, "w") as f:
+            json.dump({"ids": self.ids, "texts": self.texts, "metadatas": self.metadatas}, f)
+        os.replace(tmp_matrix_path, matrix_path)
+        os.replace(tmp_index_path, index_path)
+
+        ann_path = self.index_path(path)
+        if self.index is None and self.ann_config and self.ann_config.USE_ANN \
+                and len(self) >= self.ann_config.MIN_VECTORS:
+            self.build_index()
+        if self.index is not None:
+            tmp_ann_path = ann_path.with_suffix(".tmp.npz")
+            self.index.save(tmp_ann_path)
+            os.replace(tmp_ann_path, ann_path)
+        else:
+            ann_path.unlink(missing_ok=True)
+
+        quantized_path = self.quantized_path(path)
+        if self.quantization != "none" and len(self):
+            if not self.use_quantized:
+                self.build_quantized()
+            tmp_quantized_path = quantized_path.with_suffix(".tmp.npz")
+            self.quantized.save(tmp_quantized_path)
+            os.replace(tmp_quantized_path, quantized_path)
+        else:
+            quantized_path.unlink(missing_ok=True)
+
+    @classmethod
+    def load(
+        cls, path: Path,
+        embedding: Embeddings,
+        mmap: bool = True,
+        ann_config: Optional[Any] = None,
+    ) -> "NumpyVectorStore":
+        """
+        Load a store saved with dump
+        Args:
+            path (Path): The path of the store
+            embedding (Embeddings): The embedding model used for queries
+            mmap (bool): If True the matrix is memory-mapped instead of read into memory
+            ann_config (Any): The ann section of the config
+        Returns:
+            NumpyVectorStore: The vector store
+        """
+        matrix_path, index_path = cls.paths(path)
+        vectors = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        with open(index_path) as f:
+            index = json.load(f)
+        ann_path = cls.index_path(path)
+        ann_index = IVFIndex.load(ann_path) if os.path.exists(ann_path) else None
+        quantized_path = cls.quantized_path(path)
+        quantized = QuantizedVectors.load(quantized_path) if os.path.exists(quantized_path) else None
+        return cls(
+            embedding, vectors, index["ids"], index["texts"], index["metadatas"],
+            ann_config=ann_config,
+            index=ann_index,
+            quantized=quantized,
+        )
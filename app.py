@@ -4,29 +4,36 @@ from streamlit.runtime.uploaded_file_manager import UploadedFile
 from accord.file_loader import load_file
 from accord.database import Database
 from accord.chatbot import Chatbot
-from accord.data_ingestor import DataIngestor
 from accord.entity import (
     File,
     Role,
     Message,
+    ChatSession,
     ChunkEvent,
     SourcesEvent,
     FinalAnswerEvent,
     State,
 )
 
-from accord.utils import get_config, create_history
+from accord.utils import create_history
+from accord.metrics import METRICS
+from accord.registry import REGISTRY
 
 import sys
 import os
 
-config = get_config()
+config = REGISTRY.config
+METRICS.start(config.metrics.PROMETHEUS_PORT, config.metrics.LOG_INTERVAL_SECONDS)
+if config.models.WARM_UP:
+    REGISTRY.warm_up()
 # database connection
 database = Database()
 database.create_table()
 
 chatbot = Chatbot(database)
-data_ingestor = DataIngestor(database)
+data_ingestor = chatbot.DataIngestor
+# the corpus of earlier versions becomes the first segment of the segmented one
+data_ingestor.migrate_legacy_corpus()
 
 os.makedirs(config.vector_store.VECTOR_STORE_DIR, exist_ok=True)
 os.makedirs(config.vector_store.DOCUMENT_STORE_DIR, exist_ok=True)
@@ -46,11 +53,16 @@ st.subheader("Get info from Documents")
 
 @st.cache_resource(show_spinner=False)
 def create_vector_db(files: List[UploadedFile]):
-    files = [load_file(file) for file in files]
+    files = [load_file(file, stream=config.documentUpload.STREAM_EXTRACTION) for file in files]
     if files:
         data_ingestor.create_vector_store(files)
 
 
+# the Chatbot is shared by the browser sessions, each one has its own retriever and thread
+if "session" not in st.session_state:
+    st.session_state.session = ChatSession()
+session = st.session_state.session
+
 # Display chat history at the top
 if "messages" not in st.session_state:
     st.session_state.messages = create_history(WELCOME_MESSAGE)
@@ -84,9 +96,6 @@ def handle_file_upload(unique_key_suffix=""):
 
 # Display uploaded files in the sidebar
 files = database.get_data()
-if len(files) > 1:
-    # print(files)
-    chatbot.set_retriever(files[0]["document_path"], files[0]["vector_path"])
 
 
 
@@ -98,7 +107,7 @@ if prompt := st.chat_input("Type your message..."):
         full_response = ""
         message_placeholder = st.empty()
         message_placeholder.status("Analysing", state="running")
-        for event in chatbot.ask(prompt, st.session_state.messages):
+        for event in chatbot.ask(prompt, st.session_state.messages, session):
             if isinstance (event, SourcesEvent):
                 for i, doc in enumerate(event.content):
                     with st.expander (f"Source #{i + 1}"):
@@ -112,19 +121,38 @@ if prompt := st.chat_input("Type your message..."):
 handle_file_upload("1")
 
 
-def process_files(options, option):
-    chatbot.set_retriever(options[option]["document_path"], options[option]["vector_path"])
-    # print(options[option]["document_path"], options[option]["vector_path"])
-
-# Select an option
+def process_files(options, selected):
+    corpus = files[0]
+    selected = [options[option] for option in selected]
+    in_corpus = [file["vector_path"] == corpus["vector_path"] for file in selected]
+    if not selected or corpus in selected:
+        chatbot.set_retriever(corpus["document_path"], corpus["vector_path"], session=session)
+    elif all(in_corpus):
+        # files of the corpus are searched through it, scoped to their chunks
+        chatbot.set_retriever(
+            corpus["document_path"], corpus["vector_path"],
+            document_ids=[file["id"] for file in selected],
+            session=session,
+        )
+    elif len(selected) == 1:
+        # a file ingested with a store of its own
+        chatbot.set_retriever(selected[0]["document_path"], selected[0]["vector_path"], session=session)
+    else:
+        # a retriever searches a single store
+        st.warning(
+            "Files with a store of their own can only be searched one at a time, not together with "
+            "other files. Searching all the files of the corpus instead."
+        )
+        chatbot.set_retriever(corpus["document_path"], corpus["vector_path"], session=session)
+
+# Select the files to search, all of them if none is selected
 options = {}
 for file in files:
     options[f"{file['id']}. {file['name']}"] = file
-selected_option = st.selectbox("Select your file:", options)
+selected_options = st.multiselect("Select your files:", options)
 
-# Call function if valid option is selected
-if selected_option != "Select":
-    process_files(options, selected_option)
+if files:
+    process_files(options, selected_options)
 
 with st.sidebar:
     st.title("Uploaded files")
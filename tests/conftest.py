@@ -0,0 +1,51 @@
+from pathlib import Path
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from accord.admission import AdmissionQueue
+from accord.benchmark import FAKE_ANSWER, FAKE_CONTEXT, StubEmbeddings, StubReranker, benchmark_config
+from accord.chatbot import Chatbot
+from accord.data_ingestor import DataIngestor
+from accord.database import Database
+
+
+@pytest.fixture
+def config(tmp_path: Path):
+    """The benchmark configuration, with every store under tmp_path and the caches off"""
+    return benchmark_config(tmp_path, contextualize=False)
+
+
+@pytest.fixture
+def embedding() -> StubEmbeddings:
+    return StubEmbeddings(dimension=32)
+
+
+@pytest.fixture
+def database(tmp_path: Path, config) -> Database:
+    database = Database(tmp_path / "accord.db", config=config)
+    database.create_table()
+    yield database
+    database.close_connection()
+
+
+@pytest.fixture
+def ingestor(database, embedding, config) -> DataIngestor:
+    """A DataIngestor on the benchmark stand-ins: fake LLM, stub embeddings and reranker"""
+    return DataIngestor(
+        database,
+        llm=FakeListChatModel(responses=[FAKE_CONTEXT]),
+        embedding_model=embedding,
+        reranker=StubReranker(ranker=None, model="stub", top_n=config.preprocessing.N_CONTEXT_RESULTS),
+        config=config,
+    )
+
+
+@pytest.fixture
+def chatbot(database, ingestor, config) -> Chatbot:
+    """A Chatbot answering with the fake LLM, with an admission queue of its own"""
+    return Chatbot(
+        database,
+        llm=FakeListChatModel(responses=[FAKE_ANSWER]),
+        data_ingestor=ingestor,
+        config=config,
+        admission=AdmissionQueue(config.llm.MAX_CONCURRENT_REQUESTS, name="test_llm"),
+    )
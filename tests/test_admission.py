@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+import pytest
+from accord.admission import AdmissionQueue
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_requests_are_bounded():
+    queue = AdmissionQueue(2, name="test")
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def request(session):
+        with queue.slot(session):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=request, args=(f"session {i % 3}",)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert (queue.active, queue.depth, dict(queue.waiting)) == (0, 0, {})
+
+
+def test_sessions_are_served_in_turn():
+    queue = AdmissionQueue(1, name="test")
+    served = []
+
+    def request(session):
+        with queue.slot(session):
+            served.append(session)
+
+    with queue.slot("holder"):
+        threads = []
+        for session in ["ingestion"] * 5 + ["chat"]:
+            threads.append(threading.Thread(target=request, args=(session,)))
+            threads[-1].start()
+            wait_for(lambda: queue.depth == len(threads))
+    for thread in threads:
+        thread.join()
+
+    # the chat question does not wait behind every chunk of the ingestion
+    assert served == ["ingestion", "chat", "ingestion", "ingestion", "ingestion", "ingestion"]
+
+
+def test_cancelled_coroutines_give_up_their_place():
+    queue = AdmissionQueue(1, name="test")
+    served = []
+
+    async def request(session):
+        async with queue.aslot(session):
+            served.append(session)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        async with queue.aslot("holder"):
+            tasks = [asyncio.create_task(request(f"session {i}")) for i in range(4)]
+            while queue.depth < 4:
+                await asyncio.sleep(0.001)
+            tasks[1].cancel()
+            await asyncio.sleep(0)
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert served == ["session 0", "session 2", "session 3"]
+    assert (queue.active, queue.depth) == (0, 0)
+
+
+def test_threads_and_coroutines_share_the_slots():
+    queue = AdmissionQueue(1, name="test")
+    served = []
+
+    async def coroutine():
+        async with queue.aslot("async"):
+            served.append("async")
+
+    def request():
+        with queue.slot("sync"):
+            served.append("sync")
+
+    with queue.slot("holder"):
+        thread = threading.Thread(target=asyncio.run, args=(coroutine(),))
+        thread.start()
+        wait_for(lambda: queue.depth == 1)
+        other = threading.Thread(target=request)
+        other.start()
+        wait_for(lambda: queue.depth == 2)
+    thread.join()
+    other.join()
+
+    assert served == ["async", "sync"]
+    assert queue.active == 0
+
+
+def test_failed_requests_release_their_slot():
+    queue = AdmissionQueue(1, name="test")
+
+    with pytest.raises(RuntimeError):
+        with queue.slot("session"):
+            raise RuntimeError("the server is down")
+
+    assert queue.active == 0
+    with queue.slot("session"):
+        assert queue.active == 1
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from accord.ann_index import IVFIndex
+from accord.segment_store import SegmentedVectorStore
+from accord.vector_store import NumpyVectorStore
+
+
+def random_vectors(n: int, dimension: int = 16, seed: int = 0) -> np.ndarray:
+    return NumpyVectorStore.normalize(np.random.default_rng(seed).standard_normal((n, dimension)))
+
+
+def test_every_vector_is_assigned_to_one_list():
+    vectors = random_vectors(500)
+    index = IVFIndex.train(vectors, nlist=8)
+
+    assert index.nlist == 8
+    assert len(index) == 500
+    assert np.array_equal(index.assignments, index.assign(vectors))
+
+
+def test_scanning_every_list_is_exact():
+    vectors = random_vectors(500)
+    index = IVFIndex.train(vectors, nlist=8)
+    query = vectors[7]
+
+    rows, scores = index.search(vectors, query, k=10, nprobe=8)
+
+    exact = np.argsort(-(vectors @ query))[:10]
+    assert list(rows) == list(exact)
+    assert np.allclose(scores, vectors[exact] @ query)
+
+
+def test_nprobe_is_clamped_to_one_list():
+    vectors = random_vectors(200)
+    index = IVFIndex.train(vectors, nlist=4)
+
+    rows, _ = index.search(vectors, vectors[3], k=1, nprobe=0)
+
+    assert list(rows) == [3]
+
+
+def test_index_is_saved_and_loaded(tmp_path):
+    vectors = random_vectors(100)
+    index = IVFIndex.train(vectors, nlist=4)
+    index.save(tmp_path / "index.npz")
+
+    loaded = IVFIndex.load(tmp_path / "index.npz")
+
+    assert np.array_equal(loaded.centroids, index.centroids)
+    assert np.array_equal(loaded.assignments, index.assignments)
+
+
+def test_store_rejects_nprobe_below_one(config, embedding):
+    config.ann.USE_ANN = True
+    config.ann.NPROBE = 0
+    with pytest.raises(ValueError):
+        NumpyVectorStore(embedding, ann_config=config.ann)
+
+
+def test_store_builds_its_index_when_saved(tmp_path, config, embedding):
+    config.ann.USE_ANN = True
+    config.ann.MIN_VECTORS = 50
+    store = NumpyVectorStore(embedding, ann_config=config.ann)
+    store.add_texts([f"word{i} text{i % 7}" for i in range(60)])
+    store.dump(tmp_path / "store.npy")
+
+    loaded = NumpyVectorStore.load(tmp_path / "store.npy", embedding, ann_config=config.ann)
+
+    assert loaded.use_index
+    assert NumpyVectorStore.index_path(tmp_path / "store.npy").exists()
+    # rows added after the index was trained are searched exactly until the next dump
+    loaded.add_texts(["word60 text0"])
+    assert not loaded.use_index
+    assert loaded.similarity_search("word60 text0", k=1)[0].page_content == "word60 text0"
+
+
+def test_compaction_merges_segments_up_to_the_index_size(tmp_path, config, embedding):
+    config.ann.USE_ANN = True
+    config.ann.MIN_VECTORS = 50
+    config.ann.NPROBE = 64
+    store = SegmentedVectorStore(tmp_path / "corpus", embedding, config.ann)
+    for i in range(3):
+        segment = NumpyVectorStore(embedding, ann_config=config.ann)
+        segment.add_texts([f"segment{i} word{j}" for j in range(20)])
+        store.add_segment(segment)
+    assert not any(segment.use_index for segment in store.segments)
+
+    # the segments are larger than the configured size but smaller than MIN_VECTORS
+    merged = store.compact(min_segment_size=10)
+
+    assert store.segment_names == [merged]
+    assert store.segments[0].use_index
+    assert store.similarity_search("segment2 word5", k=1)[0].page_content == "segment2 word5"
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+from accord.answer_cache import SemanticAnswerCache, history_fingerprint
+from accord.benchmark import synthetic_corpus
+from accord.entity import FinalAnswerEvent, Message, Role, SourcesEvent, TimingEvent
+
+
+def vector(*values: float) -> list:
+    return list(values)
+
+
+def test_similar_questions_find_the_answer():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.put(("scope",), "history", vector(1, 0, 0), [], "first")
+    cache.put(("scope",), "history", vector(0, 1, 0), [], "second")
+
+    assert cache.get(("scope",), "history", vector(0.1, 1, 0)).answer == "second"
+    assert cache.get(("scope",), "history", vector(1, 1, 0)) is None
+    # another scope or conversation is another question
+    assert cache.get(("other",), "history", vector(1, 0, 0)) is None
+    assert cache.get(("scope",), "other", vector(1, 0, 0)) is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "entries": 2}
+
+
+def test_answers_expire_and_are_evicted():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=0.05, max_entries=2)
+    for i in range(3):
+        cache.put(("scope",), "history", np.eye(3)[i], [], str(i))
+
+    assert [entry.answer for entry in cache.entries.values()] == ["1", "2"]
+    assert cache.get(("scope",), "history", np.eye(3)[1]).answer == "1"
+    time.sleep(0.06)
+    assert cache.get(("scope",), "history", np.eye(3)[1]) is None
+    assert cache.entries == {} and cache.buckets == {}
+
+
+def test_invalidated_scopes_are_dropped():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.put(("a", 1), "history", vector(1, 0), [], "old")
+    cache.put(("b", 1), "history", vector(1, 0), [], "kept")
+
+    assert cache.invalidate(lambda scope: scope[0] == "a") == 1
+    assert cache.get(("b", 1), "history", vector(1, 0)).answer == "kept"
+
+
+def test_history_fingerprint_depends_on_roles_and_contents():
+    question = [Message(Role.USER, "hello")]
+    assert history_fingerprint(question) == history_fingerprint([Message(Role.USER, "hello")])
+    assert history_fingerprint(question) != history_fingerprint([Message(Role.ASSISTANT, "hello")])
+    assert history_fingerprint([]) != history_fingerprint(question)
+
+
+def ask(chatbot, question: str) -> dict:
+    events = {type(event): event for event in chatbot.ask(question, [])}
+    return {
+        "answer": events[FinalAnswerEvent].content,
+        "sources": [document.id for document in events[SourcesEvent].content],
+        "cached": "answer_cache" in events[TimingEvent].content,
+    }
+
+
+def test_repeated_questions_are_answered_from_the_cache(chatbot, ingestor, config):
+    config.cache.USE_ANSWER_CACHE = True
+    files = synthetic_corpus(3, 300, 400, 71)
+    ingestor.create_vector_store(files[:2])
+    paths = (config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH, config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+    chatbot.set_retriever(*paths)
+    question = "What about " + " ".join(files[0].content.split()[:8])
+
+    first = ask(chatbot, question)
+    again = ask(chatbot, question)
+
+    assert not first["cached"] and again["cached"]
+    assert again["answer"] == first["answer"] and again["sources"] == first["sources"]
+    # new files in the store make the cached answers stale
+    ingestor.create_vector_store(files[2:])
+    chatbot.set_retriever(*paths)
+    assert not ask(chatbot, question)["cached"]
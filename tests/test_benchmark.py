@@ -0,0 +1,44 @@
+import json
+from accord.benchmark import StubEmbeddings, main, run_benchmark, synthetic_corpus, synthetic_queries
+
+
+def test_synthetic_corpus_is_reproducible():
+    files = synthetic_corpus(3, 100, 50, seed=7)
+
+    assert [file.content for file in files] == [file.content for file in synthetic_corpus(3, 100, 50, seed=7)]
+    assert files[0].content != synthetic_corpus(1, 100, 50, seed=8)[0].content
+    assert all(len(file.content.split()) == 100 for file in files)
+    assert synthetic_queries(files, 5, 7) == synthetic_queries(files, 5, 7)
+
+
+def test_stub_embeddings_are_similar_for_shared_words():
+    embedding = StubEmbeddings(dimension=64)
+    fox, foxes, other = embedding.embed_documents(["the quick fox", "the quick fox runs", "lorem ipsum"])
+
+    assert sum(a * b for a, b in zip(fox, foxes)) > sum(a * b for a, b in zip(fox, other))
+    assert embedding.embed_query("the quick fox") == fox
+
+
+def test_benchmark_reports_ingestion_and_queries(tmp_path):
+    report = run_benchmark(
+        n_documents=10, words_per_document=400, vocabulary_size=500,
+        n_queries=10, seed=3, contextualize=True, workdir=tmp_path,
+    )
+
+    assert report["ingestion"]["documents"] == 10
+    assert report["ingestion"]["chunks"] > 0
+    assert set(report["ingestion"]["stages"]) >= {"chunk", "contextualize", "embed", "persist"}
+    assert report["query"]["source_hit_rate"] >= 0.8
+    assert report["query"]["latency_seconds"]["p50"] > 0
+    assert report["index_bytes"] > 0
+
+
+def test_benchmark_writes_its_report(tmp_path):
+    output = tmp_path / "report.json"
+
+    main([
+        "--documents", "3", "--words-per-document", "200", "--vocabulary-size", "200",
+        "--queries", "3", "--workdir", str(tmp_path / "work"), "--output", str(output),
+    ])
+
+    assert json.loads(output.read_text())["parameters"]["documents"] == 3
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+from rank_bm25 import BM25Okapi
+from accord.benchmark import synthetic_corpus
+from accord.bm25_index import BM25Index, fts_query, tokenize
+from accord.segment_store import SegmentedVectorStore
+
+
+TEXTS = [
+    "The quick brown fox jumps over the lazy dog",
+    "A quick brown dog outpaces a quick red fox",
+    "Lorem ipsum dolor sit amet",
+    "The dog sleeps, the fox runs",
+    "Foxes and dogs are not the same animal",
+    "Nothing to see here",
+]
+QUERIES = ["quick fox", "lazy dog", "the", "ipsum amet fox", "unknown words"]
+
+
+def documents(texts, prefix: str = "id") -> list:
+    return [Document(id=f"{prefix}-{i}", page_content=text) for i, text in enumerate(texts)]
+
+
+def all_scores(index: BM25Index, query: str) -> dict:
+    return dict(index.search(query, len(index)))
+
+
+def test_scores_match_rank_bm25():
+    index = BM25Index.from_documents(documents(TEXTS))
+    reference = BM25Okapi([tokenize(text) for text in TEXTS])
+
+    for query in QUERIES:
+        expected = reference.get_scores(tokenize(query))
+        scores = all_scores(index, query)
+        # the documents with a positive score are returned, with the same score
+        assert scores == pytest.approx({f"id-{i}": score for i, score in enumerate(expected) if score > 0}, rel=1e-5)
+
+
+def test_search_returns_the_best_k_first():
+    index = BM25Index.from_documents(documents(TEXTS))
+
+    results = index.search("quick fox", 2)
+
+    assert [doc_id for doc_id, _ in results] == ["id-1", "id-0"]
+    assert results[0][1] > results[1][1]
+    assert index.search("unknown", 3) == []
+
+
+def test_search_is_scoped_to_rows():
+    index = BM25Index.from_documents(documents(TEXTS))
+
+    results = index.search("lazy runs", 5, rows=index.rows_of(["id-0", "id-3"]))
+
+    assert {doc_id for doc_id, _ in results} == {"id-0", "id-3"}
+
+
+def test_added_documents_score_like_a_single_build():
+    whole = BM25Index.from_documents(documents(TEXTS))
+    index = BM25Index.from_documents(documents(TEXTS[:3]))
+    index.add(TEXTS[3:], [f"id-{i}" for i in range(3, len(TEXTS))])
+
+    for query in QUERIES:
+        assert index.search(query, 10) == pytest.approx(whole.search(query, 10))
+
+
+def test_merged_indexes_score_like_a_single_build():
+    texts = [file.content for file in synthetic_corpus(9, 200, 300, 3)]
+    whole = BM25Index.from_documents(documents(texts))
+    parts = [BM25Index.from_documents(documents(texts, prefix="id")[start:start + 3]) for start in (0, 3, 6)]
+
+    merged = BM25Index.merge(parts)
+
+    assert merged.ids == whole.ids
+    assert np.array_equal(merged.doc_len, whole.doc_len)
+    for query in [" ".join(text.split()[:5]) for text in texts]:
+        expected = whole.search(query, 9)
+        result = merged.search(query, 9)
+        assert [doc_id for doc_id, _ in result] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in result] == pytest.approx([score for _, score in expected])
+    assert len(BM25Index.merge([])) == 0
+
+
+def test_index_is_saved_and_loaded(tmp_path):
+    index = BM25Index.from_documents(documents(TEXTS))
+    index.save(tmp_path / "bm25.npz")
+
+    loaded = BM25Index.load(tmp_path / "bm25.npz")
+
+    assert loaded.ids == index.ids
+    for query in QUERIES:
+        assert loaded.search(query, 10) == pytest.approx(index.search(query, 10))
+
+
+def test_fts_query_quotes_every_word():
+    assert fts_query('What is "AND" (x-y)?') == '"what" OR "is" OR "and" OR "x" OR "y"'
+    assert fts_query("?!") == ""
+
+
+def test_corpus_ingestion_writes_postings_per_segment(tmp_path, config, ingestor):
+    config.preprocessing.LEXICAL_BACKEND = "bm25"
+    files = synthetic_corpus(3, 300, 400, 5)
+    ingestor.create_vector_store(files[:2])
+    corpus_path = config.vector_store.CONCATENATE_VECTOR_FILE_PATH
+    corpus = SegmentedVectorStore(corpus_path, ingestor.embedding_model)
+    postings = {name: corpus.bm25_path(name).stat().st_mtime_ns for name in corpus.segment_names}
+    assert len(postings) == 2
+
+    ingestor.create_vector_store(files[2:])
+
+    corpus.refresh()
+    assert len(corpus.segment_names) == 3
+    # the postings of the earlier segments are not rewritten
+    assert {name: corpus.bm25_path(name).stat().st_mtime_ns for name in postings} == postings
+    data, _ = ingestor.load_retrieval_data(config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH, corpus_path)
+    assert sorted(data.bm25_index.ids) == sorted(data.documents.ids)
+    query = " ".join(files[2].content.split()[:10])
+    expected = BM25Index.from_documents(list(data.documents.documents())).search(query, 5)
+    assert data.bm25_index.search(query, 5) == pytest.approx(expected)
+
+
+def test_compaction_merges_the_postings_of_segments(tmp_path, config, ingestor):
+    config.preprocessing.LEXICAL_BACKEND = "bm25"
+    files = synthetic_corpus(4, 200, 300, 6)
+    ingestor.create_vector_store(files)
+    corpus = SegmentedVectorStore(config.vector_store.CONCATENATE_VECTOR_FILE_PATH, ingestor.embedding_model)
+    before = corpus.bm25_index()
+
+    merged = corpus.compact(min_segment_size=10_000)
+
+    assert corpus.segment_names == [merged]
+    assert corpus.bm25_path(merged).exists()
+    assert sorted(path.name for path in corpus.directory.glob("*.bm25.npz")) == [f"{merged}.bm25.npz"]
+    after = corpus.bm25_index()
+    assert after.ids == before.ids
+    query = " ".join(files[1].content.split()[:10])
+    assert after.search(query, 5) == pytest.approx(before.search(query, 5))
+    assert after.search(query, 5)
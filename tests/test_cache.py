@@ -0,0 +1,89 @@
+import threading
+from accord.cache import ContextCache, LRUCache, SQLiteCache, make_key
+
+
+def test_keys_depend_on_every_part():
+    assert make_key("model", "text") == make_key("model", "text")
+    assert make_key("model", "text") != make_key("model", "other")
+    # the parts are length-prefixed, moving a character between them changes the key
+    assert make_key("ab", "c") != make_key("a", "bc")
+
+
+def test_sqlite_cache_persists_values(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.db", max_bytes=1024)
+    cache.set_many([("a", b"first", 1.5), ("b", b"second", 0.5)])
+    cache.close()
+
+    reopened = SQLiteCache(tmp_path / "cache.db", max_bytes=1024)
+
+    assert reopened.get_many(["a", "b", "c"]) == {"a": b"first", "b": b"second"}
+    stats = reopened.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 2)
+    assert stats["saved_seconds"] == 2.0
+
+
+def test_sqlite_cache_evicts_the_least_recently_used(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.db", max_bytes=20)
+    cache.set("old", b"x" * 8)
+    cache.set("used", b"y" * 8)
+    # reading an entry makes it the most recently used
+    cache.connection.execute("UPDATE cache SET last_access = 0 WHERE key = 'used';")
+    cache.get("used")
+
+    cache.set("new", b"z" * 8)
+
+    assert cache.get_many(["old", "used", "new"]) == {"used": b"y" * 8, "new": b"z" * 8}
+    assert cache.stats()["bytes"] <= 20
+
+
+def test_context_cache_round_trips_text(tmp_path):
+    contexts = ContextCache(tmp_path / "context.db", max_bytes=1 << 20)
+    key = contexts.key("model", "prompt", "document", "chunk")
+    contexts.set_contexts([(key, "contexte ünïcode", 0.1)])
+
+    assert contexts.get_contexts([key]) == {key: "contexte ünïcode"}
+    assert key != contexts.key("model", "other prompt", "document", "chunk")
+
+
+def test_lru_cache_is_bounded_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", 1, size=4)
+    cache.put("b", 2, size=4)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3, size=4)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.size == 8
+    # a value larger than the bound is still kept, alone
+    cache.put("huge", 4, size=100)
+    assert list(cache.entries) == ["huge"]
+
+
+def test_lru_cache_invalidates_matching_keys():
+    cache = LRUCache(max_bytes=100)
+    for key in [("a", 1), ("a", 2), ("b", 1)]:
+        cache.put(key, key, size=1)
+
+    assert cache.invalidate(lambda key: key[0] == "a") == 2
+
+    assert list(cache.entries) == [("b", 1)]
+    assert cache.size == 1
+
+
+def test_lru_cache_is_thread_safe():
+    cache = LRUCache(max_bytes=50)
+
+    def fill(offset):
+        for i in range(500):
+            cache.put((offset + i) % 80, i, size=1)
+            cache.get((offset + 3 * i) % 80)
+
+    threads = [threading.Thread(target=fill, args=(i * 11,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache.entries) == cache.size == 50
@@ -0,0 +1,65 @@
+import asyncio
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from accord.benchmark import FAKE_ANSWER, synthetic_corpus
+from accord.entity import ChatSession, FinalAnswerEvent, Role, SourcesEvent
+
+
+async def stream(chatbot, question: str, history: list, session: ChatSession) -> dict:
+    events = {}
+    async for event in chatbot.astream(question, history, session):
+        events[type(event)] = event
+    return events
+
+
+def test_sessions_are_answered_concurrently_from_their_own_files(chatbot, ingestor, database, config):
+    chatbot.llm = FakeListChatModel(responses=[FAKE_ANSWER], sleep=0.002)
+    files = synthetic_corpus(2, 300, 400, 101)
+    ingestor.create_vector_store(files)
+    rows = {row["name"]: row["id"] for row in database.get_data()}
+    paths = (config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH, config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+    sessions = [chatbot.set_retriever(*paths, document_ids=[rows[file.name]], session=ChatSession()) for file in files]
+    histories = [[] for _ in range(6)]
+    question = "What about " + " ".join(files[0].content.split()[:8])
+    peak = []
+
+    async def watch():
+        while True:
+            peak.append(chatbot.admission.active)
+            await asyncio.sleep(0.001)
+
+    async def main():
+        watcher = asyncio.create_task(watch())
+        results = await asyncio.gather(*[
+            stream(chatbot, question, history, sessions[i % 2]) for i, history in enumerate(histories)
+        ])
+        watcher.cancel()
+        return results
+
+    results = asyncio.run(main())
+
+    for i, events in enumerate(results):
+        assert {document.metadata["source"] for document in events[SourcesEvent].content} == {files[i % 2].name}
+        assert events[FinalAnswerEvent].content == FAKE_ANSWER
+        assert [message.role for message in histories[i]] == [Role.USER, Role.ASSISTANT]
+        assert histories[i][1].content == "The answer, according to the excerpts, is in the files."
+    assert max(peak) == config.llm.MAX_CONCURRENT_REQUESTS
+    assert chatbot.admission.active == 0
+
+
+def test_cancelled_streams_release_the_llm(chatbot):
+    chatbot.llm = FakeListChatModel(responses=[FAKE_ANSWER], sleep=0.005)
+
+    async def main():
+        tasks = [asyncio.create_task(stream(chatbot, "Hello?", [], ChatSession())) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        for task in tasks[::2]:
+            task.cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert [isinstance(result, asyncio.CancelledError) for result in results] == [True, False, True, False, True]
+    assert (chatbot.admission.active, chatbot.admission.depth) == (0, 0)
+    # the sync API is served by the same queue
+    events = list(chatbot.ask("Hello?", []))
+    assert any(isinstance(event, FinalAnswerEvent) for event in events)
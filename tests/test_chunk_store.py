@@ -0,0 +1,73 @@
+import os
+import pickle
+import pytest
+from langchain.schema import Document
+from langchain_core.vectorstores import InMemoryVectorStore
+from accord.chunk_store import ChunkStore, load_pickled_chunks
+
+
+def chunks(*texts: str, source: str = "a.pdf") -> list:
+    return [Document(id=f"id-{text}", page_content=text, metadata={"source": source}) for text in texts]
+
+
+def test_chunks_are_read_back_by_id(tmp_path):
+    store = ChunkStore.write(tmp_path / "chunks", chunks("first", "second ünïcode", ""))
+
+    assert len(store) == 3
+    assert list(store) == ["id-first", "id-second ünïcode", "id-"]
+    assert store["id-second ünïcode"].page_content == "second ünïcode"
+    assert store["id-"].page_content == ""
+    assert store["id-first"].metadata == {"source": "a.pdf"}
+    assert "id-missing" not in store
+    # the chunks of a file share one metadata entry
+    assert len(store.metadata_table) == 1
+
+
+def test_appended_chunks_keep_the_existing_ones(tmp_path):
+    first = ChunkStore.write(tmp_path / "chunks", chunks("one", "two"))
+    store = ChunkStore.append(tmp_path / "chunks", chunks("three", source="b.pdf"))
+
+    assert [document.page_content for document in store.documents()] == ["one", "two", "three"]
+    assert store["id-three"].metadata == {"source": "b.pdf"}
+    # a store opened before the append still reads its own chunks
+    assert first["id-two"].page_content == "two"
+    assert ChunkStore.open(tmp_path / "chunks").ids == store.ids
+
+
+def test_write_replaces_the_store(tmp_path):
+    ChunkStore.write(tmp_path / "chunks", chunks("old"))
+    store = ChunkStore.write(tmp_path / "chunks", chunks("new"))
+
+    assert list(store) == ["id-new"]
+    assert store["id-new"].page_content == "new"
+
+
+def test_pickled_chunks_refuse_other_classes(tmp_path):
+    path = tmp_path / "evil.pkl"
+    with open(path, "wb") as f:
+        pickle.dump([Document("text"), {"not": "a chunk"}], f)
+    with pytest.raises(pickle.UnpicklingError):
+        load_pickled_chunks(path)
+
+    with open(path, "wb") as f:
+        pickle.dump([Document("text"), os.getcwd], f)
+    with pytest.raises(pickle.UnpicklingError):
+        load_pickled_chunks(path)
+
+
+def test_legacy_pickles_take_the_ids_of_their_vectors(tmp_path, ingestor, embedding):
+    texts = ["alpha beta gamma", "delta epsilon", "alpha beta gamma", "zeta eta theta"]
+    vector_store = InMemoryVectorStore(embedding)
+    vector_ids = vector_store.add_texts(texts, [{"source": "old.pdf"} for _ in texts])
+    vector_path = tmp_path / "old.db"
+    vector_store.dump(vector_path)
+    document_path = tmp_path / "old.pkl"
+    with open(document_path, "wb") as f:
+        pickle.dump([Document(text, metadata={"source": "old.pdf"}) for text in texts], f)
+
+    data, _ = ingestor.load_retrieval_data(document_path, vector_path)
+
+    assert list(data.documents) == vector_ids
+    retriever = ingestor.create_retriever(data).base_retriever
+    semantic, lexical = [retriever.invoke("zeta eta") for retriever in retriever.retrievers]
+    assert semantic[0].id == lexical[0].id == vector_ids[3]
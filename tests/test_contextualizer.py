@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from accord.admission import AdmissionQueue
+from accord.contextualizer import Contextualizer
+from accord.entity import ContextStats
+
+
+CHUNK_TAG_PATTERN = re.compile(r'<chunk id="(\d+)">\n(.*?)\n</chunk>', re.DOTALL)
+
+
+class RecordingLLM:
+    """Answers every context request, recording the prompts and how many ran at once"""
+
+    def __init__(self, failures: int = 0, delay: float = 0.0, skip: tuple = ()):
+        self.failures = failures
+        self.delay = delay
+        self.skip = skip
+        self.lock = threading.Lock()
+        self.prompts = []
+        self.active = 0
+        self.max_active = 0
+
+    def invoke(self, messages):
+        with self.lock:
+            self.prompts.append(messages[-1].content)
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("the server is busy")
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        prompt = messages[-1].content
+        tagged = CHUNK_TAG_PATTERN.findall(prompt)
+        if tagged:
+            return AIMessage("".join(
+                f'<context id="{i}">context of {chunk}</context>' for i, chunk in tagged if int(i) not in self.skip
+            ))
+        return AIMessage(f"context of {prompt.split('<chunk>')[-1].split('</chunk>')[0].strip()}")
+
+
+def contextualizer(config, llm, **preprocessing) -> Contextualizer:
+    config.preprocessing.CONTEXT_RETRY_BACKOFF = 0
+    for name, value in preprocessing.items():
+        setattr(config.preprocessing, name, value)
+    return Contextualizer(llm, config=config, admission=AdmissionQueue(8, name="test"))
+
+
+CHUNKS = [f"chunk number {i}" for i in range(7)]
+DOCUMENT = "\n".join(CHUNKS)
+
+
+def test_contexts_follow_the_chunks(config):
+    llm = RecordingLLM()
+    stats = ContextStats("full")
+
+    contexts = contextualizer(config, llm).generate_contexts(DOCUMENT, CHUNKS, stats)
+
+    assert contexts == [f"context of {chunk}" for chunk in CHUNKS]
+    assert stats.context_requests == len(CHUNKS)
+    assert stats.chunks == len(CHUNKS)
+
+
+def test_requests_run_concurrently_up_to_the_limit(config):
+    llm = RecordingLLM(delay=0.05)
+
+    contextualizer(config, llm, CONTEXT_CONCURRENCY=3).generate_contexts(DOCUMENT, CHUNKS)
+
+    assert llm.max_active == 3
+
+
+def test_chunks_are_contextualized_in_batches(config):
+    llm = RecordingLLM()
+    stats = ContextStats("full")
+
+    contexts = contextualizer(config, llm, CONTEXT_BATCH_SIZE=3).generate_contexts(DOCUMENT, CHUNKS, stats)
+
+    assert contexts == [f"context of {chunk}" for chunk in CHUNKS]
+    # 3 + 3 + 1 chunks, the last one alone with the single chunk prompt
+    assert stats.context_requests == 3
+    assert [len(CHUNK_TAG_PATTERN.findall(prompt)) for prompt in llm.prompts] == [3, 3, 0]
+
+
+def test_unanswered_chunks_of_a_batch_are_sent_alone(config):
+    llm = RecordingLLM(skip=(2,))
+
+    contexts = contextualizer(config, llm).generate_batch_context(DOCUMENT, CHUNKS[:3])
+
+    assert contexts == [f"context of {chunk}" for chunk in CHUNKS[:3]]
+    assert len(llm.prompts) == 2
+    assert CHUNKS[1] in llm.prompts[1] and not CHUNK_TAG_PATTERN.findall(llm.prompts[1])
+
+
+def test_failed_requests_are_retried(config):
+    llm = RecordingLLM(failures=2)
+
+    context = contextualizer(config, llm, CONTEXT_MAX_RETRIES=2).generate_context(DOCUMENT, CHUNKS[0])
+
+    assert context == f"context of {CHUNKS[0]}"
+    assert len(llm.prompts) == 3
+
+
+def test_the_last_failure_is_raised(config):
+    llm = RecordingLLM(failures=3)
+
+    with pytest.raises(ConnectionError):
+        contextualizer(config, llm, CONTEXT_MAX_RETRIES=2).generate_context(DOCUMENT, CHUNKS[0])
+    assert len(llm.prompts) == 3
+
+
+def test_thinking_is_removed_from_the_context(config):
+    llm = FakeListChatModel(responses=["<think>hmm</think>The context."])
+
+    assert contextualizer(config, llm).generate_context(DOCUMENT, CHUNKS[0]) == "The context."
+
+
+def test_cached_contexts_are_not_generated_again(tmp_path, config):
+    config.cache.USE_CONTEXT_CACHE = True
+    config.cache.CONTEXT_CACHE_PATH = str(tmp_path / "context.db")
+    contexts = contextualizer(config, RecordingLLM(), CONTEXT_BATCH_SIZE=3).generate_contexts(DOCUMENT, CHUNKS)
+
+    llm = RecordingLLM()
+    stats = ContextStats("full")
+    again = contextualizer(config, llm, CONTEXT_BATCH_SIZE=3).generate_contexts(DOCUMENT, CHUNKS + ["new chunk"], stats)
+
+    assert again == contexts + ["context of new chunk"]
+    assert stats.cached_contexts == len(CHUNKS)
+    assert len(llm.prompts) == 1
+    # contexts made with the batch prompt are reused without batching too
+    llm = RecordingLLM()
+    assert contextualizer(config, llm).generate_contexts(DOCUMENT, CHUNKS) == contexts
+    assert llm.prompts == []
+    # another document is another key
+    contextualizer(config, llm).generate_contexts(DOCUMENT + ".", CHUNKS[:1])
+    assert len(llm.prompts) == 1
+
+
+class SummaryLLM(RecordingLLM):
+    """RecordingLLM summarizing a text as its number of characters"""
+
+    def invoke(self, messages):
+        prompt = messages[-1].content
+        if "<text>" in prompt:
+            with self.lock:
+                self.prompts.append(prompt)
+            text = prompt.split("<text>\n")[1].split("\n</text>")[0]
+            return AIMessage(f"summary of {len(text)} characters")
+        return super().invoke(messages)
+
+
+def test_window_strategy_sends_the_neighbouring_chunks(config):
+    views = contextualizer(config, SummaryLLM(), CONTEXT_STRATEGY="window", CONTEXT_WINDOW_CHUNKS=1).document_views(DOCUMENT, CHUNKS)
+
+    assert views[0].endswith("chunk number 0\nchunk number 1")
+    assert views[3].endswith("chunk number 2\nchunk number 3\nchunk number 4")
+    assert DOCUMENT not in views[3]
+
+
+def test_summary_strategy_summarizes_the_document_once(config):
+    llm = SummaryLLM()
+    stats = ContextStats("summary")
+
+    contexts = contextualizer(config, llm, CONTEXT_STRATEGY="summary").generate_contexts(DOCUMENT, CHUNKS, stats)
+
+    assert contexts == [f"context of {chunk}" for chunk in CHUNKS]
+    assert (stats.summary_requests, stats.context_requests) == (1, len(CHUNKS))
+    assert all(f"summary of {len(DOCUMENT)} characters" in prompt for prompt in llm.prompts[1:])
+    assert not any(DOCUMENT in prompt for prompt in llm.prompts[1:])
+
+
+def test_long_texts_are_summarized_in_parts(config):
+    llm = SummaryLLM()
+    stats = ContextStats("summary")
+
+    summary = contextualizer(config, llm, CONTEXT_SUMMARY_INPUT_CHARS=80).summarize("x" * 200, stats)
+
+    # 3 parts, then the summary of their summaries
+    parts = "\n\n".join(["summary of 80 characters"] * 2 + ["summary of 40 characters"])
+    assert stats.summary_requests == 4
+    assert summary == f"summary of {len(parts)} characters"
+
+
+def test_summaries_that_do_not_shrink_are_cut(config):
+    summary = contextualizer(config, SummaryLLM(), CONTEXT_SUMMARY_INPUT_CHARS=40).summarize("x" * 100)
+
+    assert summary == "summary of 40 characters"
+
+
+def test_hierarchical_strategy_nests_section_summaries(config):
+    llm = SummaryLLM()
+    stats = ContextStats("hierarchical")
+    chunks = [f"chunk {i} " + "y" * i for i in range(5)]
+
+    views = contextualizer(config, llm, CONTEXT_STRATEGY="hierarchical", CONTEXT_SECTION_CHUNKS=2).document_views(
+        "unused", chunks, stats
+    )
+
+    # 3 sections and the document summary made from theirs
+    assert stats.summary_requests == 4
+    assert views[0] == views[1] != views[2]
+    assert all(view.startswith("Summary of the document:\nsummary of") for view in views)
+    assert views[4].endswith(f"Summary of the section of the chunk:\nsummary of {len(chunks[4])} characters")
+
+
+def test_unknown_strategies_are_refused(config):
+    with pytest.raises(ValueError):
+        contextualizer(config, SummaryLLM(), CONTEXT_STRATEGY="everything")
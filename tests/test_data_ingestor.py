@@ -0,0 +1,165 @@
+import hashlib
+from langchain_core.vectorstores import InMemoryVectorStore
+from accord.benchmark import synthetic_corpus
+from accord.data_ingestor import LEGACY_SEGMENT, RETRIEVER_CACHE
+from accord.entity import File
+from accord.segment_store import SegmentedVectorStore
+
+
+def corpus(ingestor, config) -> SegmentedVectorStore:
+    return SegmentedVectorStore(config.vector_store.CONCATENATE_VECTOR_FILE_PATH, ingestor.embedding_model)
+
+
+def legacy_corpus(tmp_path, ingestor, database, files, contextualized: bool):
+    """The single in-memory store and concatenate.pdf row of earlier versions"""
+    vector_store = InMemoryVectorStore(ingestor.embedding_model)
+    for file in files:
+        chunks = ingestor.text_splitter.split_text(file.content)
+        if contextualized:
+            chunks = [f"Where chunk {i} of {file.name} sits.\n\n{chunk}" for i, chunk in enumerate(chunks)]
+        vector_store.add_texts(chunks, [{"source": file.name} for _ in chunks])
+    vector_path = tmp_path / "vector_store" / "concatenate.db"
+    vector_path.parent.mkdir(parents=True, exist_ok=True)
+    vector_store.dump(vector_path)
+    legacy = next(row for row in database.get_data() if row["name"] == "concatenate.pdf")
+    database.update_data(legacy["id"], str(vector_path), str(tmp_path / "document" / "concatenate.pkl"))
+    return vector_store
+
+
+def test_migrated_corpus_is_searchable(tmp_path, ingestor, database, config):
+    files = synthetic_corpus(2, 300, 400, 11)
+    legacy = legacy_corpus(tmp_path, ingestor, database, files, contextualized=False)
+
+    ingestor.migrate_legacy_corpus()
+
+    store = corpus(ingestor, config)
+    assert store.segment_names == [LEGACY_SEGMENT]
+    assert sorted(document.id for document in store.documents()) == sorted(legacy.store)
+    rows = {row["name"]: row for row in database.get_data()}
+    assert rows["concatenate.pdf"]["vector_path"] == str(config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+    data, _ = ingestor.load_retrieval_data(
+        config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH,
+        config.vector_store.CONCATENATE_VECTOR_FILE_PATH,
+    )
+    assert len(data.documents) == len(legacy.store)
+
+
+def test_migration_runs_once(tmp_path, ingestor, database, config):
+    files = synthetic_corpus(2, 300, 400, 12)
+    legacy = legacy_corpus(tmp_path, ingestor, database, files, contextualized=False)
+    legacy_row = next(row for row in database.get_data() if row["name"] == "concatenate.pdf")
+
+    ingestor.migrate_legacy_corpus()
+    ingestor.migrate_legacy_corpus()
+    # a migration stopped after the import, before the rows were moved
+    database.update_data(legacy_row["id"], legacy_row["vector_path"], legacy_row["document_path"])
+    ingestor.migrate_legacy_corpus()
+
+    assert len(corpus(ingestor, config)) == len(legacy.store)
+    assert len(database.get_chunk_ids()) == len({record["text"] for record in legacy.store.values()})
+
+
+def test_migrated_chunks_are_reused_by_uploads(tmp_path, ingestor, database, config):
+    config.preprocessing.CONTEXTUALIZE_CHUNKS = True
+    files = synthetic_corpus(2, 300, 400, 13)
+    legacy = legacy_corpus(tmp_path, ingestor, database, files, contextualized=True)
+    ingestor.migrate_legacy_corpus()
+    segments = corpus(ingestor, config).segment_names
+
+    ingestor.create_vector_store([File(
+        name=files[0].name,
+        content=files[0].content,
+        content_hash=hashlib.sha256(files[0].content.encode("utf-8")).hexdigest(),
+    )])
+
+    store = corpus(ingestor, config)
+    # every chunk of the file is already in the corpus, nothing is added
+    assert store.segment_names == segments
+    assert len(store) == len(legacy.store)
+    row = next(row for row in database.get_data() if row["name"] == files[0].name)
+    legacy_ids = {record["id"] for record in legacy.store.values() if record["metadata"]["source"] == files[0].name}
+    assert set(database.get_document_chunk_ids([row["id"]])) == legacy_ids
+
+
+def test_retrievers_share_the_cached_stores_until_they_change(ingestor, config, monkeypatch):
+    files = synthetic_corpus(3, 300, 400, 14)
+    ingestor.create_vector_store(files[:2])
+    loads = []
+    load_retrieval_data = ingestor.load_retrieval_data
+
+    def counted(*args):
+        loads.append(args)
+        return load_retrieval_data(*args)
+
+    monkeypatch.setattr(ingestor, "load_retrieval_data", counted)
+    paths = (config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH, config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+
+    ingestor.get_retriever(*paths)
+    ingestor.get_retriever(*paths, document_ids=[1])
+    assert len(loads) == 1
+
+    ingestor.create_vector_store(files[2:])
+    retriever = ingestor.get_retriever(*paths)
+
+    assert len(loads) == 2
+    # the entry of the previous version of the corpus was dropped
+    assert len([key for key in RETRIEVER_CACHE.entries if key[:2] == tuple(map(str, paths))]) == 1
+    query = " ".join(files[2].content.split()[:10])
+    assert files[2].name in {document.metadata["source"] for document in retriever.invoke(query)}
+
+
+def file(name: str, content: str) -> File:
+    return File(name=name, content=content, content_hash=hashlib.sha256(content.encode("utf-8")).hexdigest())
+
+
+def test_identical_uploads_are_ingested_once(ingestor, database, config):
+    original = synthetic_corpus(1, 300, 400, 15)[0]
+
+    ingestor.create_vector_store([original, file("copy.txt", original.content)])
+    ingestor.create_vector_store([file("again.txt", original.content)])
+
+    assert [row["name"] for row in database.get_data() if row["name"] != "concatenate.pdf"] == [original.name]
+    assert len(corpus(ingestor, config)) == len(ingestor.text_splitter.split_text(original.content))
+
+
+def test_shared_chunks_are_stored_once(ingestor, database, config):
+    first, second, third = synthetic_corpus(3, 1500, 400, 16)
+    combined = file("combined.txt", first.content + "\n\n" + second.content)
+
+    ingestor.create_vector_store([first])
+    # the second file shares chunks with a file of the same run too
+    ingestor.create_vector_store([combined, second, third])
+
+    texts = {
+        name: ingestor.text_splitter.split_text(content)
+        for name, content in [(first.name, first.content), (combined.name, combined.content),
+                              (second.name, second.content), (third.name, third.content)]
+    }
+    store = corpus(ingestor, config)
+    assert sorted(document.page_content for document in store.documents()) == sorted(set().union(*texts.values()))
+    rows = {row["name"]: row["id"] for row in database.get_data()}
+    chunk_texts = {document.id: document.page_content for document in store.documents()}
+    for name, chunks in texts.items():
+        # every file is scoped to all of its chunks, shared or not
+        assert {chunk_texts[chunk_id] for chunk_id in database.get_document_chunk_ids([rows[name]])} == set(chunks)
+
+
+def test_retrievers_are_scoped_to_the_selected_documents(ingestor, database, config):
+    config.preprocessing.LEXICAL_BACKEND = "bm25"
+    files = synthetic_corpus(3, 600, 400, 17)
+    ingestor.create_vector_store(files[:2])
+    ingestor.create_vector_store(files[2:])
+    rows = {row["name"]: row["id"] for row in database.get_data()}
+    paths = (config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH, config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+    query = " ".join(files[0].content.split()[:10])
+
+    everything = ingestor.get_retriever(*paths)
+    scoped = ingestor.get_retriever(*paths, document_ids=[rows[files[1].name], rows[files[2].name]])
+
+    assert everything.invoke(query)[0].metadata["source"] == files[0].name
+    # the legs only return chunks of the selected files, from every segment of the corpus
+    legs = [leg.invoke(query) for leg in scoped.base_retriever.retrievers]
+    for documents in legs:
+        assert documents and {document.metadata["source"] for document in documents} <= {files[1].name, files[2].name}
+    assert {document.metadata["source"] for document in legs[0]} == {files[1].name, files[2].name}
+    assert ingestor.get_retriever(*paths, document_ids=[]).invoke(query) == []
@@ -0,0 +1,54 @@
+from accord.benchmark import synthetic_corpus
+from accord.bm25_index import fts_query
+
+
+def test_chunk_texts_are_ranked_by_bm25(database):
+    database.insert_chunk_texts("store", [
+        ("a", "the quick brown fox"),
+        ("b", "a quick fox, a quick fox"),
+        ("c", "nothing here"),
+        ("d", "Le café crème"),
+    ])
+    database.insert_chunk_texts("other", [("e", "quick fox")])
+
+    results = database.search_chunk_texts("store", fts_query("quick fox?"), k=5)
+
+    assert [chunk_id for chunk_id, _ in results] == ["b", "a"]
+    assert results[0][1] > results[1][1] > 0
+    # accents are ignored
+    assert [chunk_id for chunk_id, _ in database.search_chunk_texts("store", fts_query("cafe creme"), k=5)] == ["d"]
+    assert database.count_chunk_texts("store") == 4
+    assert database.get_chunk_text_ids("other") == {"e"}
+
+
+def test_chunk_text_search_is_scoped_to_documents(database):
+    database.insert_chunk_texts("store", [("a", "quick fox"), ("b", "quick fox again"), ("c", "quick")])
+    first = database.insert_data("first.txt", "store", "vectors")
+    second = database.insert_data("second.txt", "store", "vectors")
+    database.insert_document_chunks(first, ["a"])
+    database.insert_document_chunks(second, ["b", "c"])
+
+    results = database.search_chunk_texts("store", fts_query("quick fox"), k=5, document_ids=[second])
+
+    assert [chunk_id for chunk_id, _ in results] == ["b", "c"]
+    assert database.search_chunk_texts("store", fts_query("quick fox"), k=5, document_ids=[]) == []
+
+
+def test_stores_ingested_without_the_index_are_backfilled(ingestor, database, config):
+    config.preprocessing.LEXICAL_BACKEND = "bm25"
+    files = synthetic_corpus(3, 300, 400, 91)
+    ingestor.create_vector_store(files)
+    store = config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH
+    assert database.count_chunk_texts(store) == 0
+
+    config.preprocessing.LEXICAL_BACKEND = "fts5"
+    data, _ = ingestor.load_retrieval_data(store, config.vector_store.CONCATENATE_VECTOR_FILE_PATH)
+
+    assert data.bm25_index is None
+    assert database.get_chunk_text_ids(store) == set(data.documents.ids)
+    # the index is complete, loading again adds nothing
+    ingestor.load_chunk_texts(store, data.documents)
+    assert database.count_chunk_texts(store) == len(data.documents)
+    lexical = ingestor.create_retriever(data).base_retriever.retrievers[1]
+    query = " ".join(files[1].content.split()[:10])
+    assert lexical.invoke(query)[0].metadata["source"] == files[1].name
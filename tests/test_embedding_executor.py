@@ -0,0 +1,89 @@
+import threading
+import numpy as np
+from accord.benchmark import StubEmbeddings, synthetic_corpus
+from accord.embedding_executor import MAX_BATCH_TOKENS, MIN_BATCH_TOKENS, EmbeddingExecutor
+
+
+class BatchRecorder:
+    """Factory of StubEmbeddings recording the models made and the batches they embed"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = []
+        self.batches = []
+
+    def __call__(self) -> StubEmbeddings:
+        recorder = self
+        model = StubEmbeddings(dimension=16)
+        embed_documents = model.embed_documents
+
+        def record(texts):
+            with recorder.lock:
+                recorder.batches.append((threading.get_ident(), list(texts)))
+            return embed_documents(texts)
+
+        model.embed_documents = record
+        with self.lock:
+            self.models.append(model)
+        return model
+
+
+def texts(n: int = 200) -> list:
+    rng = np.random.default_rng(3)
+    words = synthetic_corpus(1, 20_000, 500, 61)[0].content.split()
+    return [" ".join(words[i:i + int(rng.integers(5, 200))]) for i in range(n)]
+
+
+def executor(factory, workers: int = 3, batch_tokens: int = 1024) -> EmbeddingExecutor:
+    return EmbeddingExecutor(factory, workers=workers, min_batch_size=2, max_batch_size=32, batch_tokens=batch_tokens)
+
+
+def test_every_text_is_embedded_once():
+    corpus = texts()
+    recorder = BatchRecorder()
+    reference = StubEmbeddings(dimension=16)
+
+    results = list(executor(recorder).map(corpus))
+
+    rows = np.concatenate([rows for rows, _ in results])
+    assert sorted(rows) == list(range(len(corpus)))
+    for batch_rows, vectors in results:
+        assert np.allclose(vectors, reference.embed_documents([corpus[row] for row in batch_rows]))
+    assert sum(len(batch) for _, batch in recorder.batches) == len(corpus)
+
+
+def test_batches_group_texts_of_similar_length():
+    corpus = texts()
+    recorder = BatchRecorder()
+    embedder = executor(recorder, workers=1)
+
+    batches = [rows for rows, _ in embedder.map(corpus)]
+
+    # the batches come in completion order, each one holds a run of the texts sorted by length
+    lengths = sorted([embedder.estimate_tokens(corpus[row]) for row in rows] for rows in batches)
+    assert [length for batch in lengths for length in batch] == sorted(embedder.estimate_tokens(text) for text in corpus)
+    assert all(2 <= len(batch) <= 32 for batch in lengths[:-1])
+
+
+def test_every_worker_has_its_own_model():
+    recorder = BatchRecorder()
+
+    list(executor(recorder, workers=3, batch_tokens=256).map(texts()))
+
+    assert 1 <= len(recorder.models) <= 3
+    assert len({thread for thread, _ in recorder.batches}) == len(recorder.models)
+
+
+def test_batch_budget_follows_the_throughput():
+    embedder = executor(StubEmbeddings, batch_tokens=4096)
+
+    embedder._adapt(4096, 1.0)
+    assert embedder.batch_tokens == 5120
+    embedder._adapt(4096, 2.0)
+    assert embedder.batch_tokens == 4096
+    for _ in range(100):
+        embedder._adapt(10 ** 9, 1.0)
+    assert embedder.batch_tokens == MAX_BATCH_TOKENS
+    embedder.batch_tokens = MIN_BATCH_TOKENS
+    embedder._adapt(10, 1.0)
+    assert embedder.batch_tokens == MIN_BATCH_TOKENS
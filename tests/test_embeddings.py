@@ -0,0 +1,57 @@
+import threading
+import pytest
+from accord.benchmark import StubEmbeddings, synthetic_corpus
+from accord.cache import EmbeddingCache
+from accord.embeddings import CachedEmbeddings
+from accord.segment_store import SegmentedVectorStore
+
+
+class CountingEmbeddings(StubEmbeddings):
+    """StubEmbeddings recording every text it embeds"""
+
+    def __init__(self, dimension: int = 32):
+        super().__init__(dimension)
+        self.embedded = []
+        self.count_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.count_lock:
+            self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def embedding() -> CountingEmbeddings:
+    return CountingEmbeddings(dimension=32)
+
+
+def test_embedding_cache_round_trips_vectors(tmp_path):
+    cache = EmbeddingCache(tmp_path / "embedding.db", max_bytes=1 << 20)
+    cache.set_embeddings([("vector", [0.5, -1.0, 2.25], 0.0)])
+
+    assert cache.get_embeddings(["vector", "missing"]) == {"vector": [0.5, -1.0, 2.25]}
+    assert cache.key("model", "text") != cache.key("other model", "text")
+
+
+def test_only_uncached_texts_are_embedded(tmp_path, embedding):
+    cache = EmbeddingCache(tmp_path / "embedding.db", max_bytes=1 << 20)
+    cached = CachedEmbeddings(embedding, "stub", cache)
+
+    first = cached.embed_documents(["alpha beta", "gamma", "alpha beta"])
+    second = CachedEmbeddings(embedding, "stub", cache).embed_documents(["gamma", "delta", "alpha beta"])
+
+    # identical texts of a batch are embedded once, cached ones not again
+    assert embedding.embedded == ["alpha beta", "gamma", "delta"]
+    assert first[0] == first[2] == second[2]
+    assert second[0] == first[1]
+    assert second[1] == pytest.approx(embedding.embed_query("delta"))
+
+
+def test_ingested_chunks_are_embedded_once(ingestor, embedding, config):
+    files = synthetic_corpus(3, 400, 400, 21)
+
+    ingestor.create_vector_store(files)
+
+    corpus = SegmentedVectorStore(config.vector_store.CONCATENATE_VECTOR_FILE_PATH, embedding)
+    chunks = [document.page_content for document in corpus.documents()]
+    assert sorted(embedding.embedded) == sorted(chunks)
@@ -0,0 +1,83 @@
+import io
+import docx
+import pytest
+from docx.enum.text import WD_BREAK
+from accord.benchmark import synthetic_corpus
+from accord.entity import Page
+from accord.file_loader import iter_docx_pages, load_file
+
+
+class Upload(io.BytesIO):
+    """The part of streamlit's UploadedFile the loader reads"""
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+
+def pages_of(text: str, page_size: int) -> list:
+    return [Page(number=i // page_size + 1, text=text[i:i + page_size]) for i in range(0, len(text), page_size)]
+
+
+@pytest.mark.parametrize("page_size", [300, 2500, 9000, 50_000])
+def test_split_pages_matches_a_whole_text_split(ingestor, page_size):
+    text = "\n\n".join(file.content for file in synthetic_corpus(4, 2500, 600, 41))
+    pages = pages_of(text, page_size)
+
+    chunks = list(ingestor.split_pages(iter(pages), {"source": "file.pdf"}))
+
+    assert [chunk.page_content for chunk in chunks] == ingestor.text_splitter.split_text(text)
+    cursor = 0
+    for chunk in chunks:
+        start = text.index(chunk.page_content, cursor)
+        end = start + len(chunk.page_content) - 1
+        cursor = start + 1
+        assert chunk.metadata == {"source": "file.pdf", "page": start // page_size + 1, "end_page": end // page_size + 1}
+
+
+def test_split_pages_reads_the_pages_lazily(ingestor):
+    text = synthetic_corpus(1, 20_000, 600, 42)[0].content
+    read = []
+
+    def pages():
+        for page in pages_of(text, 1000):
+            read.append(page.number)
+            yield page
+
+    chunks = ingestor.split_pages(pages(), {})
+    next(chunks)
+
+    # the first chunk is out long before the last page is read
+    assert len(read) < len(pages_of(text, 1000)) // 2
+
+
+def test_docx_pages_are_split_on_page_breaks(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("first page")
+    document.add_paragraph("still first")
+    document.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    document.add_paragraph("second page")
+    document.save(tmp_path / "file.docx")
+
+    pages = list(iter_docx_pages(tmp_path / "file.docx"))
+
+    assert [page.number for page in pages] == [1, 2]
+    assert pages[0].text == "first page\nstill first\n"
+    assert pages[1].text.endswith("second page")
+
+
+def test_load_file_streams_only_when_asked(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("some text")
+    buffer = io.BytesIO()
+    document.save(buffer)
+
+    loaded = load_file(Upload("file.docx", buffer.getvalue()))
+    streamed = load_file(Upload("file.docx", buffer.getvalue()), stream=True)
+
+    assert loaded.content == "some text"
+    assert streamed.content == "" and [page.text for page in streamed.pages] == ["some text"]
+    assert loaded.content_hash == streamed.content_hash
+    assert load_file(Upload("notes.md", "# ünïcode".encode("utf-8"))).content == "# ünïcode"
+    with pytest.raises(ValueError):
+        load_file(Upload("script.exe", b""))
@@ -0,0 +1,69 @@
+import asyncio
+import time
+from typing import List
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+from accord.hybrid_retriever import HybridRetriever
+
+
+class ListRetriever(BaseRetriever):
+    """Returns the same documents for every query, after a delay"""
+
+    documents: List[Document]
+    delay: float = 0.0
+
+    def _get_relevant_documents(self, query, *, run_manager) -> List[Document]:
+        time.sleep(self.delay)
+        return self.documents
+
+
+def documents(*ids: str) -> List[Document]:
+    return [Document(id=doc_id, page_content=f"text of {doc_id}") for doc_id in ids]
+
+
+def reference_rrf(results, weights, c=60) -> List[str]:
+    scores = {}
+    for weight, docs in zip(weights, results):
+        for rank, doc in enumerate(docs):
+            scores[doc.id] = scores.get(doc.id, 0.0) + weight / (rank + 1 + c)
+    # ties keep the order the documents were first seen in
+    order = list(scores)
+    return sorted(order, key=lambda doc_id: (-scores[doc_id], order.index(doc_id)))
+
+
+def test_fuse_ranks_by_weighted_reciprocal_rank():
+    results = [documents("a", "b", "c", "d"), documents("d", "c", "e")]
+    for weights in ([0.5, 0.5], [0.8, 0.2], [0.2, 0.8]):
+        retriever = HybridRetriever(retrievers=[], weights=weights)
+
+        fused = retriever.fuse(results)
+
+        assert [doc.id for doc in fused] == reference_rrf(results, weights)
+
+
+def test_fuse_returns_every_chunk_once():
+    semantic = documents("a", "b")
+    lexical = documents("b", "a") + [Document(id="copy", page_content="text of a")]
+    retriever = HybridRetriever(retrievers=[], weights=[0.5, 0.5])
+
+    fused = retriever.fuse([semantic, lexical])
+
+    # the copy of a stored under another id is dropped too
+    assert [doc.id for doc in fused] == ["a", "b"]
+    assert retriever.fuse([[], []]) == []
+
+
+def test_retrievers_run_concurrently():
+    retrievers = [
+        ListRetriever(documents=documents("a", "b"), delay=0.2),
+        ListRetriever(documents=documents("b", "c"), delay=0.2),
+    ]
+    retriever = HybridRetriever(retrievers=retrievers, weights=[0.5, 0.5])
+
+    start = time.perf_counter()
+    fused = retriever.invoke("query")
+    elapsed = time.perf_counter() - start
+
+    assert [doc.id for doc in fused] == ["b", "a", "c"]
+    assert elapsed < 0.35
+    assert [doc.id for doc in asyncio.run(retriever.ainvoke("query"))] == ["b", "a", "c"]
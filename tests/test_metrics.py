@@ -0,0 +1,67 @@
+import contextvars
+import threading
+import urllib.request
+from accord.benchmark import synthetic_corpus
+from accord.entity import TimingEvent
+from accord.metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+    for value in [0.05] * 50 + [0.5] * 45 + [5.0] * 4 + [50.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.95) == 1.0
+    assert histogram.quantile(0.99) == 10.0
+    assert histogram.quantile(1.0) == float("inf")
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_request_timings_include_the_threads_it_spawns():
+    metrics = Metrics()
+
+    with metrics.request() as timings:
+        with metrics.timer("retrieve"):
+            pass
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(metrics.observe, "rerank", 0.25))
+        thread.start()
+        thread.join()
+    metrics.observe("outside", 1.0)
+
+    assert set(timings) == {"retrieve", "rerank"}
+    assert timings["rerank"] == 0.25
+    assert set(metrics.summary()) == {"outside", "rerank", "retrieve"}
+
+
+def test_prometheus_text_is_served():
+    metrics = Metrics()
+    metrics.observe("generation", 0.3)
+    metrics.set_gauge("llm_queue_depth", 2)
+    server = metrics.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+
+    assert 'accord_stage_seconds_bucket{stage="generation",le="0.5"} 1' in text
+    assert 'accord_stage_seconds_count{stage="generation"} 1' in text
+    assert "accord_llm_queue_depth 2" in text
+
+
+def test_answers_report_the_latency_of_every_stage(chatbot, ingestor, config):
+    ingestor.create_vector_store(synthetic_corpus(2, 300, 400, 81))
+    chatbot.set_retriever(
+        config.vector_store.CONCATENATE_DOCUMENT_FILE_PATH,
+        config.vector_store.CONCATENATE_VECTOR_FILE_PATH,
+    )
+
+    timings = [event.content for event in chatbot.ask("What is it about?", []) if isinstance(event, TimingEvent)]
+
+    assert len(timings) == 1
+    assert {"retrieve", "vector_search", "bm25", "rerank", "prompt_build", "generation", "total"} <= set(timings[0])
+    assert timings[0]["total"] >= timings[0]["generation"]
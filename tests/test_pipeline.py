@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from accord.benchmark import synthetic_corpus
+from accord.pipeline import Pipeline, Stage, StageFailure
+
+
+def slow(fn, seconds: float):
+    def stage(item):
+        time.sleep(seconds)
+        return fn(item)
+    return stage
+
+
+def test_every_item_goes_through_every_stage():
+    pipeline = Pipeline([
+        Stage("double", lambda x: 2 * x, workers=3),
+        Stage("increment", lambda x: x + 1, workers=2),
+    ], queue_size=2)
+
+    outputs = list(pipeline.run(range(50)))
+
+    assert sorted(outputs) == [2 * x + 1 for x in range(50)]
+    report = pipeline.report()
+    assert report["double"]["items"] == report["increment"]["items"] == 50
+
+
+def test_stages_work_on_different_items_at_once():
+    pipeline = Pipeline([
+        Stage("first", slow(lambda x: x, 0.05)),
+        Stage("second", slow(lambda x: x, 0.05)),
+    ], queue_size=1)
+
+    start = time.perf_counter()
+    assert sorted(pipeline.run(range(8))) == list(range(8))
+
+    # 9 steps of 0.05s overlapped, instead of 16 one after the other
+    assert time.perf_counter() - start < 0.6
+
+
+def test_failed_items_skip_the_next_stages():
+    def check(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+    seen = []
+    pipeline = Pipeline([Stage("check", check), Stage("record", lambda x: seen.append(x) or x)], queue_size=2)
+
+    outputs = list(pipeline.run(range(6)))
+
+    failures = [item for item in outputs if isinstance(item, StageFailure)]
+    assert [(failure.stage, failure.item, str(failure.error)) for failure in failures] == [("check", 3, "three")]
+    assert sorted(seen) == [0, 1, 2, 4, 5]
+
+
+def test_bounded_queues_hold_back_the_input():
+    read = []
+
+    def items():
+        for i in range(100):
+            read.append(i)
+            yield i
+
+    outputs = Pipeline([Stage("stage", lambda x: x)], queue_size=2).run(items())
+    next(outputs)
+    time.sleep(0.1)
+
+    assert len(read) < 10
+
+
+def test_stopping_early_stops_the_workers():
+    pipeline = Pipeline([Stage("early", slow(lambda x: x, 0.01), workers=2)], queue_size=2)
+
+    for output in pipeline.run(range(1000)):
+        break
+
+    def running():
+        return [thread.name for thread in threading.enumerate() if thread.name.startswith(("early-", "pipeline-"))]
+
+    deadline = time.monotonic() + 2
+    while running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert running() == []
+
+
+def test_a_failed_file_does_not_stop_the_ingestion(ingestor, database, monkeypatch):
+    files = synthetic_corpus(3, 300, 400, 51)
+    embed = ingestor._embed
+
+    def failing(job):
+        if job.file.name == files[1].name:
+            raise RuntimeError("embedding server down")
+        return embed(job)
+
+    monkeypatch.setattr(ingestor, "_embed", failing)
+
+    with pytest.raises(RuntimeError, match="embedding server down"):
+        ingestor.create_vector_store(files)
+
+    names = {row["name"] for row in database.get_data()}
+    assert files[0].name in names and files[2].name in names
+    assert files[1].name not in names
@@ -0,0 +1,115 @@
+import threading
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.schema import Document
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from accord.prompt_builder import SUMMARY_CACHE_SIZE, PromptBuilder
+
+
+TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", "Answer from the files."),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{context}\n\n{question}"),
+])
+FILE_TEMPLATE = "<file name={name}>{content}</file>"
+
+
+def history(turns: int, size: int = 40) -> list:
+    messages = []
+    for i in range(turns):
+        messages += [HumanMessage(f"question {i} " + "q" * size), AIMessage(f"answer {i} " + "a" * size)]
+    return messages
+
+
+def builder(**kwargs) -> PromptBuilder:
+    return PromptBuilder(TEMPLATE, FILE_TEMPLATE, **{"max_tokens": 400, "history_max_tokens": 100, **kwargs})
+
+
+def test_history_within_budget_is_kept():
+    messages = history(2)
+    assert builder().fit_history(messages) == (messages, 0)
+
+
+def test_oldest_turns_are_dropped_in_blocks():
+    messages = history(10)
+    prompt_builder = builder(drop_block=2)
+
+    kept, dropped = prompt_builder.fit_history(messages)
+
+    assert dropped % 4 == 0
+    assert kept == messages[dropped:]
+    assert prompt_builder._message_tokens(kept) <= 100
+    # the oldest kept turn only moves once per block, so most questions reuse the prefix
+    drops = [prompt_builder.fit_history(history(turns))[1] for turns in range(10, 30)]
+    assert drops == sorted(drops)
+    assert len(set(drops)) <= len(drops) // 2 + 1
+
+
+def test_dropped_turns_are_summarized_once():
+    calls = []
+
+    def summarizer(dropped):
+        calls.append(len(dropped))
+        return f"{len(dropped)} messages"
+
+    prompt_builder = builder(summarizer=summarizer)
+    messages = history(10)
+    kept, dropped = prompt_builder.fit_history(messages)
+    again, _ = prompt_builder.fit_history(messages)
+
+    assert isinstance(kept[0], SystemMessage)
+    assert kept[0].content.endswith(f"{dropped} messages")
+    assert again == kept
+    assert calls == [dropped]
+
+
+def test_summaries_are_shared_by_concurrent_sessions():
+    prompt_builder = builder(summarizer=lambda dropped: dropped[0].content)
+    conversations = [history(1, size=i) for i in range(2 * SUMMARY_CACHE_SIZE)]
+    errors = []
+
+    def summarize(offset):
+        try:
+            for i in range(200):
+                conversation = conversations[(offset + i) % len(conversations)]
+                assert prompt_builder._summary(conversation) == conversation[0].content
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=summarize, args=(i * 7,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(prompt_builder._summaries.entries) <= SUMMARY_CACHE_SIZE
+
+
+def test_best_documents_fill_the_budget():
+    documents = [
+        Document("low " * 20, metadata={"source": "low.pdf", "relevance_score": 0.1}),
+        Document("high " * 20, metadata={"source": "high.pdf", "relevance_score": 0.9}),
+        Document("mid " * 100, metadata={"source": "mid.pdf", "relevance_score": 0.5}),
+    ]
+
+    context, included = builder().fit_documents(documents, budget=60)
+
+    assert included == 2
+    assert context.startswith("<file name=high.pdf>")
+    assert "low" not in context
+    # the document that does not fit is truncated, not dropped
+    mid = context.split("\n\n")[1]
+    assert mid.startswith("<file name=mid.pdf>mid") and len(mid) < len("mid " * 100)
+
+
+def test_prompt_stays_within_the_budget():
+    documents = [Document("word " * 200, metadata={"source": f"{i}.pdf", "relevance_score": i}) for i in range(10)]
+    prompt_builder = builder()
+
+    prompt, stats = prompt_builder.build("What is it?", history(10), documents)
+
+    assert stats["prompt_tokens"] <= 400 + 10
+    assert stats["retrieved_documents"] == 10
+    assert 0 < stats["documents"] < 10
+    assert stats["dropped_messages"] > 0
+    assert prompt.to_messages()[-1].content.endswith("What is it?")
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from accord.quantization import QuantizedVectors, evaluate_quantization
+from accord.vector_store import NumpyVectorStore
+
+
+def clustered(n: int, dimension: int = 128, seed: int = 0) -> np.ndarray:
+    """Unit vectors around a few centres, like the embeddings of related chunks"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((16, dimension))
+    vectors = centres[rng.integers(16, size=n)] + 0.8 * rng.standard_normal((n, dimension))
+    return NumpyVectorStore.normalize(vectors)
+
+
+def queries_near(vectors: np.ndarray, n: int) -> np.ndarray:
+    noise = 0.3 * np.random.default_rng(1).standard_normal((n, vectors.shape[1]))
+    return NumpyVectorStore.normalize(vectors[:n] + noise)
+
+
+def test_int8_codes_keep_the_recall():
+    vectors = clustered(3000)
+    quantized = QuantizedVectors.train("int8", vectors)
+
+    report = evaluate_quantization(vectors, quantized, queries_near(vectors, 50), k=10, rescore_factor=4)
+
+    assert report["recall"] >= 0.95
+    assert report["quantized_bytes"] < report["full_bytes"] / 3.9
+
+
+def test_binary_recall_grows_with_the_rescored_candidates():
+    vectors = clustered(3000)
+    quantized = QuantizedVectors.train("binary", vectors)
+    queries = queries_near(vectors, 50)
+
+    recalls = [
+        evaluate_quantization(vectors, quantized, queries, k=10, rescore_factor=factor)["recall"]
+        for factor in (1, 4, 16, 300)
+    ]
+
+    assert recalls == sorted(recalls)
+    assert recalls[-1] == 1.0
+    assert quantized.nbytes == vectors.nbytes // 32
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_results_are_rescored_exactly(mode):
+    vectors = clustered(500)
+    query = vectors[7]
+
+    rows, scores = QuantizedVectors.train(mode, vectors).search(vectors, query, k=5, rescore_factor=4)
+
+    assert rows[0] == 7
+    assert scores == pytest.approx(vectors[rows] @ query)
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_added_codes_use_the_trained_encoding(tmp_path, mode):
+    vectors = clustered(200)
+    quantized = QuantizedVectors.train(mode, vectors[:100])
+    quantized.add(vectors[100:])
+    quantized.save(tmp_path / "codes.npz")
+
+    loaded = QuantizedVectors.load(tmp_path / "codes.npz")
+
+    assert len(loaded) == 200
+    assert np.array_equal(loaded.codes, quantized.encode(vectors))
+    assert loaded.mode == mode
+    with pytest.raises(ValueError):
+        QuantizedVectors("float16", loaded.codes)
+
+
+def test_stores_search_their_quantized_codes(tmp_path, embedding, config):
+    config.ann.QUANTIZATION = "int8"
+    config.ann.QUANTIZATION_EVAL_QUERIES = 0
+    vectors = clustered(300, dimension=32)
+    store = NumpyVectorStore(embedding, ann_config=config.ann)
+    store.add_embeddings([f"text {i}" for i in range(300)], vectors)
+    store.dump(tmp_path / "store")
+
+    loaded = NumpyVectorStore.load(tmp_path / "store", embedding, ann_config=config.ann)
+
+    assert NumpyVectorStore.quantized_path(tmp_path / "store").exists()
+    assert loaded.use_quantized
+    results = loaded.similarity_search_with_score_by_vector(vectors[42].tolist(), k=3)
+    assert results[0][0].page_content == "text 42"
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+    # rows added later are quantized with them
+    loaded.add_embeddings(["new text"], [vectors[0].tolist()])
+    assert loaded.use_quantized
+    config.ann.QUANTIZATION = "none"
+    loaded.dump(tmp_path / "store")
+    assert not NumpyVectorStore.quantized_path(tmp_path / "store").exists()
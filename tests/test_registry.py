@@ -0,0 +1,79 @@
+import threading
+import time
+from accord.registry import ModelRegistry
+
+
+def test_resources_are_created_once():
+    registry = ModelRegistry()
+    created = []
+
+    def factory():
+        time.sleep(0.05)
+        created.append(1)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get(("model", 1), factory))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert len({id(result) for result in results}) == 1
+    assert registry.loaded() == [("model", 1)]
+
+
+def test_a_slow_load_does_not_block_other_resources():
+    registry = ModelRegistry()
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        loading.set()
+        release.wait(5)
+        return "slow"
+
+    thread = threading.Thread(target=registry.get, args=(("slow",), slow))
+    thread.start()
+    loading.wait(5)
+
+    assert registry.get(("fast",), lambda: "fast") == "fast"
+    release.set()
+    thread.join()
+    assert registry.get(("slow",), lambda: "again") == "slow"
+
+
+def test_resources_are_keyed_by_their_settings(config):
+    registry = ModelRegistry()
+    other = config.copy()
+    other.llm.TEMPERATURE = 0.1
+
+    assert registry.config is registry.config
+    assert registry.llm(config) is registry.llm(config)
+    assert registry.llm(other) is not registry.llm(config)
+    assert registry.llm_admission() is registry.llm_admission()
+    # the benchmark configuration disables these caches
+    assert registry.embedding_cache(config) is None
+    assert registry.rerank_score_cache(config) is None
+    config.cache.RERANK_CACHE_MAX_MB = 1
+    assert registry.rerank_score_cache(config) is registry.rerank_score_cache(config)
+
+
+def test_warm_up_runs_once_and_survives_failures(monkeypatch):
+    registry = ModelRegistry()
+    calls = []
+
+    def failing(*args, **kwargs):
+        calls.append(args)
+        raise OSError("model not downloaded")
+
+    monkeypatch.setattr(registry, "embedding_model", failing)
+    monkeypatch.setattr(registry, "reranker", failing)
+
+    thread = registry.warm_up()
+    assert registry.warm_up() is thread
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert len(calls) == 2 + registry.config.preprocessing.USE_LIGHT_RERANKER
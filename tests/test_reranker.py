@@ -0,0 +1,80 @@
+import threading
+from typing import List
+import numpy as np
+from langchain.schema import Document
+from accord import reranker as reranker_module
+from accord.benchmark import StubReranker
+from accord.cache import LRUCache
+from accord.reranker import RerankBatcher
+
+
+class CountingReranker(StubReranker):
+    """StubReranker recording the chunks it scores"""
+
+    scored: List[str] = []
+
+    def _score(self, query: str, documents: List[Document]) -> np.ndarray:
+        self.scored.extend(document.page_content for document in documents)
+        return super()._score(query, documents)
+
+
+def documents(*texts: str) -> List[Document]:
+    return [Document(id=str(i), page_content=text) for i, text in enumerate(texts)]
+
+
+CANDIDATES = documents("red fox", "red green fox", "blue", "green", "red green blue fox")
+
+
+def test_candidates_are_ranked_by_score():
+    reranker = CountingReranker(ranker=None, model="stub", top_n=2)
+
+    ranked = reranker.compress_documents(CANDIDATES, "red green fox")
+
+    assert [document.page_content for document in ranked] == ["red green fox", "red green blue fox"]
+    assert ranked[0].metadata["relevance_score"] == 1.0
+
+
+def test_few_candidates_are_not_scored():
+    reranker = CountingReranker(ranker=None, model="stub", top_n=3)
+
+    ranked = reranker.compress_documents(CANDIDATES[:2] + documents("red fox"), "fox")
+
+    # duplicates are dropped before the candidates are counted
+    assert [document.page_content for document in ranked] == ["red fox", "red green fox"]
+    assert reranker.scored == []
+
+
+def test_scores_are_cached_per_query_and_chunk():
+    reranker = CountingReranker(ranker=None, model="stub", top_n=2, score_cache=LRUCache(1 << 20))
+
+    first = reranker.compress_documents(CANDIDATES[:4], "red fox")
+    second = reranker.compress_documents(CANDIDATES, "red fox")
+    reranker.compress_documents(CANDIDATES[:3], "blue")
+
+    assert reranker.scored == [doc.page_content for doc in CANDIDATES[:4] + CANDIDATES[4:] + CANDIDATES[:3]]
+    assert [doc.page_content for doc in first] == [doc.page_content for doc in second][:2]
+
+
+def test_concurrent_queries_share_one_inference(monkeypatch):
+    batches = []
+
+    def scores(ranker, pairs):
+        batches.append(len(pairs))
+        return np.asarray([len(passage) for _, passage in pairs], dtype=np.float32)
+
+    monkeypatch.setattr(reranker_module, "cross_encoder_scores", scores)
+    batcher = RerankBatcher(ranker=None, max_batch_size=64, max_wait=0.2)
+    results = {}
+
+    def score(i):
+        results[i] = batcher.score([[f"query {i}", "x" * (i + j)] for j in range(3)])
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(batches) == 12 and len(batches) < 4
+    # every query gets the scores of its own pairs back
+    assert {i: list(result) for i, result in results.items()} == {i: [i, i + 1, i + 2] for i in range(4)}
@@ -0,0 +1,84 @@
+from pathlib import Path
+from typing import List
+from accord.segment_store import MANIFEST_FILE, SegmentedVectorStore
+from accord.vector_store import NumpyVectorStore
+
+
+def make_segment(embedding, texts: List[str], ann_config=None) -> NumpyVectorStore:
+    segment = NumpyVectorStore(embedding, ann_config=ann_config)
+    segment.add_texts(texts, [{"source": text.split()[0]} for text in texts], ids=[f"id-{text}" for text in texts])
+    return segment
+
+
+def segment_files(directory: Path) -> List[str]:
+    return sorted(path.name for path in directory.iterdir() if path.name.startswith("segment-"))
+
+
+def test_segments_are_appended_in_order(tmp_path, embedding):
+    store = SegmentedVectorStore(tmp_path / "corpus", embedding)
+    store.add_segment(make_segment(embedding, ["alpha one", "alpha two"]))
+    store.add_segment(make_segment(embedding, ["beta one"]))
+    legacy = store.add_segment(make_segment(embedding, ["gamma one"]), name="segment-legacy", first=True)
+
+    assert store.segment_names[0] == legacy
+    assert len(store) == 4
+    assert [document.page_content for document in store.documents()] == ["gamma one", "alpha one", "alpha two", "beta one"]
+    # another instance sees the same segments through the manifest
+    assert SegmentedVectorStore(tmp_path / "corpus", embedding).segment_names == store.segment_names
+
+
+def test_search_spans_every_segment(tmp_path, embedding):
+    store = SegmentedVectorStore(tmp_path / "corpus", embedding)
+    store.add_segment(make_segment(embedding, ["alpha one", "alpha two"]))
+    store.add_segment(make_segment(embedding, ["beta gamma", "beta delta"]))
+
+    results = store.similarity_search_with_score("beta delta", k=2)
+    assert [document.id for document, _ in results] == ["id-beta delta", "id-beta gamma"]
+    scoped = store.similarity_search("beta delta", k=2, chunk_ids={"id-alpha one"})
+    assert [document.id for document in scoped] == ["id-alpha one"]
+
+
+def test_compaction_keeps_ids_and_results(tmp_path, embedding):
+    store = SegmentedVectorStore(tmp_path / "corpus", embedding)
+    for i in range(4):
+        store.add_segment(make_segment(embedding, [f"word{i} text{i}", f"word{i} other{i}"]))
+    documents = store.documents()
+    before = [store.similarity_search_with_score(f"word{i} text{i}", k=3) for i in range(4)]
+
+    merged = store.compact(min_segment_size=10)
+
+    assert store.segment_names == [merged]
+    assert [document.id for document in store.documents()] == [document.id for document in documents]
+    after = [store.similarity_search_with_score(f"word{i} text{i}", k=3) for i in range(4)]
+    assert [[document.id for document, _ in results] for results in after] == \
+        [[document.id for document, _ in results] for results in before]
+    assert segment_files(tmp_path / "corpus") == sorted([f"{merged}.json", f"{merged}.npy"])
+
+
+def test_compaction_skips_large_and_too_few_segments(tmp_path, embedding):
+    store = SegmentedVectorStore(tmp_path / "corpus", embedding)
+    large = store.add_segment(make_segment(embedding, [f"large {i}" for i in range(5)]))
+    store.add_segment(make_segment(embedding, ["small one"]))
+    assert store.compact(min_segment_size=5) is None
+
+    store.add_segment(make_segment(embedding, ["small two"]))
+    merged = store.compact(min_segment_size=5)
+    assert store.segment_names == [large, merged]
+    assert len(store) == 7
+
+
+def test_compaction_removes_quantized_codes_of_merged_segments(tmp_path, embedding, config):
+    config.ann.QUANTIZATION = "int8"
+    config.ann.QUANTIZATION_EVAL_QUERIES = 0
+    directory = tmp_path / "corpus"
+    store = SegmentedVectorStore(directory, embedding, config.ann)
+    for i in range(3):
+        store.add_segment(make_segment(embedding, [f"word{i} text{i}", f"word{i} other{i}"], config.ann))
+    assert len([name for name in segment_files(directory) if name.endswith(".q.npz")]) == 3
+
+    merged = store.compact(min_segment_size=10)
+
+    assert segment_files(directory) == sorted([f"{merged}.json", f"{merged}.npy", f"{merged}.q.npz"])
+    assert (directory / MANIFEST_FILE).exists()
+    assert store.segments[0].use_quantized
+    assert store.similarity_search("word1 text1", k=1)[0].id == "id-word1 text1"
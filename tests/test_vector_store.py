@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from langchain_core.vectorstores import InMemoryVectorStore
+from accord.benchmark import synthetic_corpus
+from accord.vector_store import NumpyVectorStore
+
+
+def texts(n: int = 40, seed: int = 31) -> list:
+    return [file.content for file in synthetic_corpus(n, 30, 200, seed)]
+
+
+def test_search_matches_the_in_memory_store(embedding):
+    corpus = texts()
+    reference = InMemoryVectorStore(embedding)
+    reference.add_texts(corpus)
+    store = NumpyVectorStore.from_texts(corpus, embedding)
+
+    for query in corpus[:10]:
+        expected = reference.similarity_search_with_score(query, k=5)
+        results = store.similarity_search_with_score(query, k=5)
+        assert [doc.page_content for doc, _ in results] == [doc.page_content for doc, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+def test_dumped_store_is_memory_mapped_on_load(tmp_path, embedding):
+    corpus = texts()
+    store = NumpyVectorStore.from_texts(corpus, embedding, metadatas=[{"row": i} for i in range(len(corpus))])
+    store.dump(tmp_path / "store")
+
+    loaded = NumpyVectorStore.load(tmp_path / "store", embedding)
+
+    assert NumpyVectorStore.exists(tmp_path / "store")
+    assert isinstance(loaded.vectors, np.memmap)
+    assert np.array_equal(loaded.vectors, store.vectors)
+    assert loaded.ids == store.ids and loaded.texts == corpus
+    assert loaded.similarity_search(corpus[3], k=1)[0].metadata == {"row": 3}
+    assert not list(tmp_path.glob("*.tmp.*"))
+
+
+def test_rows_added_to_a_loaded_store_are_searched(tmp_path, embedding):
+    corpus = texts()
+    NumpyVectorStore.from_texts(corpus[:20], embedding).dump(tmp_path / "store")
+    store = NumpyVectorStore.load(tmp_path / "store", embedding)
+
+    ids = store.add_texts(corpus[20:])
+
+    assert len(store) == len(store.vectors) == len(corpus)
+    assert store.similarity_search(corpus[30], k=1)[0].id == ids[10]
+    assert store.similarity_search(corpus[5], k=1)[0].page_content == corpus[5]
+
+
+def test_in_memory_stores_are_converted_with_their_ids(embedding):
+    corpus = texts()
+    reference = InMemoryVectorStore(embedding)
+    ids = reference.add_texts(corpus, [{"row": i} for i in range(len(corpus))])
+
+    store = NumpyVectorStore.from_in_memory(reference)
+
+    assert store.ids == ids
+    assert [document.metadata["row"] for document in store.documents()] == list(range(len(corpus)))
+    assert np.allclose(np.linalg.norm(store.vectors, axis=1), 1)
+
+
+def test_filter_keeps_the_best_accepted_documents(embedding):
+    corpus = texts()
+    store = NumpyVectorStore.from_texts(corpus, embedding, metadatas=[{"row": i} for i in range(len(corpus))])
+
+    results = store.similarity_search(corpus[4], k=3, filter=lambda document: document.metadata["row"] % 2)
+
+    assert len(results) == 3
+    assert all(document.metadata["row"] % 2 for document in results)
+    assert NumpyVectorStore(embedding).similarity_search("anything") == []